@@ -1,5 +1,16 @@
+import sys
 
+from .mod2doctest import convert
+from .mod2doctest import DEFAULT_DOCTEST_FLAGS
+from .mod2doctest import verify
 
-from mod2doctest import convert
-from mod2doctest import DEFAULT_DOCTEST_FLAGS
-
+if sys.version_info >= (3, 7):
+    # Only import asyncio when convert_async is used.
+    def __getattr__(name):
+        if name == 'convert_async':
+            from .aio import convert_async
+            return convert_async
+        raise AttributeError("module %r has no attribute %r"
+                             % (__name__, name))
+elif sys.version_info >= (3, 5):
+    from .aio import convert_async
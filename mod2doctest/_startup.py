@@ -0,0 +1,238 @@
+"""Run by the interpreters |mod2doctest| starts (as ``$PYTHONSTARTUP``) when
+it needs to know more than what they print.  Any Python version has to be
+able to run it, and it leaves nothing behind in ``__main__``.
+
+``$MOD2DOCTEST_STARTUP``
+    The ``$PYTHONSTARTUP`` of the user, which is run first.
+
+``$MOD2DOCTEST_SEED``
+    Seeds :mod:`random` (for the ``deterministic`` option).
+
+``$MOD2DOCTEST_TIME``
+    Freezes the clock at this time (for ``freeze_time``): :func:`time.time`
+    and the functions that default to the current time, and the ``now()``
+    / ``today()`` of :mod:`datetime`, whose ``datetime`` and ``date`` are
+    replaced by subclasses (that ``isinstance()`` and :mod:`pickle` take
+    for the real ones).
+
+``$MOD2DOCTEST_TIMINGS``
+    A file to write the time every statement starts at to, one line per
+    '>>> ' prompt (for the ``export`` of :func:`mod2doctest.convert`).
+
+``$MOD2DOCTEST_MODULES``
+    A file to write the files of the loaded modules to (one per line) when
+    the interpreter exits, so a cached result can be checked against the
+    code it came from (the pytest plugin does).
+
+``$MOD2DOCTEST_PROFILE``
+    A JSON object mapping section numbers to file names (without the
+    extension).  The code is run under :mod:`cProfile`, and the profile of
+    each of those sections is saved as ``<name>.pstats`` and as collapsed
+    stacks (the input of ``flamegraph.pl`` and speedscope) in
+    ``<name>.folded``.  A new section is started by the hidden statement
+    ``sys._mod2doctest_section(n)``, everything before the first one is
+    section 0.  ``sys._mod2doctest_section(-1)`` (right before the
+    ``raise SystemExit``) stops the profiler, so the exit is left out.
+
+"""
+
+def _mod2doctest_startup():
+    import os
+    import sys
+    import time
+
+    if os.environ.get('MOD2DOCTEST_STARTUP'):
+        exec(open(os.environ['MOD2DOCTEST_STARTUP']).read(),
+             sys.modules['__main__'].__dict__)
+
+    clock = time.time
+
+    if os.environ.get('MOD2DOCTEST_SEED'):
+        import random
+        random.seed(int(os.environ['MOD2DOCTEST_SEED']))
+
+    if os.environ.get('MOD2DOCTEST_TIME'):
+        import datetime
+
+        frozen = float(os.environ['MOD2DOCTEST_TIME'])
+        localtime, gmtime = time.localtime, time.gmtime
+        ctime, strftime = time.ctime, time.strftime
+
+        time.time = lambda: frozen
+        if hasattr(time, 'time_ns'):
+            time.time_ns = lambda: int(frozen * 10**9)
+        time.localtime = lambda secs=None: localtime(
+            frozen if secs is None else secs)
+        time.gmtime = lambda secs=None: gmtime(
+            frozen if secs is None else secs)
+        time.ctime = lambda secs=None: ctime(
+            frozen if secs is None else secs)
+        time.strftime = lambda format, t=None: strftime(
+            format, localtime(frozen) if t is None else t)
+
+        # The module gets subclasses of datetime and date.  They pass for
+        # the real ones: isinstance() / issubclass() take either, and the
+        # real ones are pickled as them, so that pickle finds the class it
+        # saves in the module (another interpreter loads the real one).
+        real_date, real_datetime = datetime.date, datetime.datetime
+
+        class Real(type):
+            def __instancecheck__(cls, instance):
+                return isinstance(instance, cls.real)
+
+            def __subclasscheck__(cls, subclass):
+                return issubclass(subclass, cls.real)
+
+        # A subclass' repr is 'date(...)', not 'datetime.date(...)'.
+        def _repr(base):
+            def __repr__(self):
+                text = base.__repr__(self)
+                if not text.startswith('datetime.'):
+                    text = 'datetime.' + text
+                return text
+            return __repr__
+
+        def today(cls):
+            return cls.fromtimestamp(frozen)
+
+        def now(cls, tz=None):
+            if tz is None:
+                return cls.fromtimestamp(frozen)
+            return cls.fromtimestamp(frozen, tz)
+
+        def utcnow(cls):
+            return cls.utcfromtimestamp(frozen)
+
+        date = Real('date', (real_date,), {
+            'real': real_date,
+            '__module__': 'datetime',
+            '__repr__': _repr(real_date),
+            'today': classmethod(today)})
+        datetime_ = Real('datetime', (real_datetime, date), {
+            'real': real_datetime,
+            '__module__': 'datetime',
+            '__repr__': _repr(real_datetime),
+            'today': classmethod(today),
+            'now': classmethod(now),
+            'utcnow': classmethod(utcnow)})
+        date.__qualname__, datetime_.__qualname__ = 'date', 'datetime'
+
+        try:
+            import copyreg
+        except ImportError:
+            import copy_reg as copyreg
+        copyreg.pickle(real_date, lambda value: (
+            date, real_date.__reduce__(value)[1]))
+        copyreg.pickle(real_datetime, lambda value: (
+            datetime_, real_datetime.__reduce__(value)[1]))
+
+        datetime.date = date
+        datetime.datetime = datetime_
+
+    if os.environ.get('MOD2DOCTEST_TIMINGS'):
+        out = open(os.environ['MOD2DOCTEST_TIMINGS'], 'w')
+
+        class Prompt(object):
+            def __str__(self):
+                out.write('%r\n' % clock())
+                out.flush()
+                return '>>> '
+
+        sys.ps1 = Prompt()
+
+    if os.environ.get('MOD2DOCTEST_MODULES'):
+        import atexit
+
+        modules_path = os.environ['MOD2DOCTEST_MODULES']
+        cwd = os.getcwd()
+
+        def modules():
+            out = open(modules_path, 'w')
+            for module in list(sys.modules.values()):
+                filename = getattr(module, '__file__', None)
+                if filename:
+                    out.write('%s\n' % os.path.join(cwd, filename))
+            out.close()
+
+        atexit.register(modules)
+
+    def folded(profile, path, depth=100, smallest=1e-6):
+        """Writes the collapsed stacks (``caller;callee microseconds``) of a
+        :class:`cProfile.Profile` to ``path``.  cProfile only keeps the caller
+        of each function, so the time of a function that is called from
+        several places is split between them by their share of its cumulative
+        time."""
+
+        import pstats
+
+        stats = pstats.Stats(profile).stats
+        callees = {}
+        for func, (cc, nc, tt, ct, callers) in stats.items():
+            for caller, edge in callers.items():
+                callees.setdefault(caller, []).append((func, edge[3]))
+
+        def label(func):
+            filename, line, name = func
+            if filename == '~':
+                return name
+            return '%s (%s:%d)' % (name, os.path.basename(filename), line)
+
+        counts = {}
+
+        def walk(func, stack, funcs, scale):
+            cc, nc, tt, ct, callers = stats[func]
+            stack = stack + [label(func)]
+            key = ';'.join(stack)
+            counts[key] = counts.get(key, 0.0) + tt * scale
+            if len(stack) >= depth:
+                return
+            for callee, edge_ct in callees.get(func, []):
+                total = stats[callee][3]
+                if callee in funcs or not total or edge_ct * scale < smallest:
+                    continue
+                walk(callee, stack, funcs | set([callee]),
+                     scale * min(edge_ct / total, 1.0))
+
+        for func, (cc, nc, tt, ct, callers) in stats.items():
+            if not callers:
+                walk(func, [], set([func]), 1.0)
+
+        out = open(path, 'w')
+        for key in sorted(counts):
+            microseconds = int(round(counts[key] * 10**6))
+            if microseconds:
+                out.write('%s %d\n' % (key, microseconds))
+        out.close()
+
+    if os.environ.get('MOD2DOCTEST_PROFILE'):
+        import atexit
+        import json
+        import cProfile
+
+        names = json.loads(os.environ['MOD2DOCTEST_PROFILE'])
+        state = {'section': 0, 'profile': cProfile.Profile()}
+
+        def stop():
+            profile = state['profile']
+            if profile is None:
+                return
+            profile.disable()
+            state['profile'] = None
+            name = names.get(str(state['section']))
+            if name:
+                profile.dump_stats('%s.pstats' % name)
+                folded(profile, '%s.folded' % name)
+
+        def section(n):
+            stop()
+            state['section'] = n
+            if n >= 0:
+                state['profile'] = cProfile.Profile()
+                state['profile'].enable()
+
+        sys._mod2doctest_section = section
+        atexit.register(stop)
+        state['profile'].enable()
+
+_mod2doctest_startup()
+del _mod2doctest_startup
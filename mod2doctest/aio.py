@@ -0,0 +1,166 @@
+"""An :mod:`asyncio` front end to |mod2doctest| (Python 3.5+ only).
+
+:func:`convert_async` does the same work as :func:`mod2doctest.convert`,
+but the interpreter is driven with :func:`asyncio.create_subprocess_exec`
+(no shell) so many conversions can share one event loop::
+
+    import asyncio
+    from mod2doctest import convert_async
+
+    async def main(paths):
+        return await asyncio.gather(*[convert_async('python', src=path)
+                                      for path in paths])
+
+    docstrs = asyncio.run(main(paths))
+
+Differences from :func:`mod2doctest.convert`:
+
+*  The docstring is always returned, :exc:`SystemExit` is never raised
+   (``target`` defaults to ``None``, but if one is given the docstring is
+   still saved there first).
+*  Nothing is printed while the docstring is built, so the output of
+   concurrent conversions does not get mixed up.
+*  Cancelling the task kills the interpreter.  If one of the interpreters
+   of a conversion fails, the others are killed.
+*  If ``run_doctest`` is set, the target is checked with
+   :func:`mod2doctest.verify` (and the ``doctest_cache``) in a
+   ``python_cmd`` child instead of in the current process.
+
+"""
+
+import asyncio
+import codecs
+import functools
+import locale
+import os
+import shlex
+import sys
+
+from .mod2doctest import _Conversion
+
+
+# Run by the child: sys.argv is [root of the package, target, flags, cache].
+_VERIFY_SCRIPT = ("import sys; sys.path.insert(0, sys.argv[1]); "
+                  "import mod2doctest; "
+                  "mod2doctest.verify(sys.argv[2], int(sys.argv[3]), "
+                  "sys.argv[4] or None)")
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+async def convert_async(python_cmd, src=True, target=None, **kwargs):
+    """
+    :summary: Coroutine version of :func:`mod2doctest.convert`.
+
+    :param python_cmd: The python command that starts the shell (or a list
+                       of them, see :func:`mod2doctest.convert`).  It is
+                       split with :func:`shlex.split` and run without a
+                       shell.  If ``run_doctest`` is set, the saved target
+                       is checked with each of them.
+    :type python_cmd:  str or list of str
+
+    :param src: Same as for :func:`mod2doctest.convert`.
+
+    :param target: Same as for :func:`mod2doctest.convert`, but defaults to
+                   ``None``.
+
+    :param kwargs: Any other keyword argument accepted by
+                   :func:`mod2doctest.convert`.
+
+    :returns: The docstring (str).
+    """
+
+    conversion = _Conversion(python_cmd, src=src, target=target, **kwargs)
+
+    stdouts = await _gather([
+        _run_interpreter(cmd, ['-i'], stdin, env,
+                         functools.partial(conversion.output, i))
+        for i, (cmd, stdin, env) in enumerate(conversion.runs())])
+
+    docstr = conversion.docstr(stdouts)
+
+    if target:
+        target = conversion.save(docstr)
+        if conversion.run_doctest:
+            args = ['-c', _VERIFY_SCRIPT, _ROOT, target,
+                    str(conversion.doctest_flags),
+                    conversion.doctest_cache or '']
+            outputs = await _gather([
+                _run_interpreter(cmd, args) for cmd in conversion.python_cmds])
+            for output in outputs:
+                if output:
+                    sys.stdout.write(output)
+
+    return docstr
+
+async def _gather(coros):
+    """Like ``asyncio.gather(*coros)``, but if one of them fails (or this
+    task is cancelled) the others are cancelled, which kills their
+    interpreters, before the exception is raised."""
+
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+async def _run_interpreter(python_cmd, args, stdin='', env=None, output=None):
+    """Runs ``python_cmd`` with ``args`` (and ``env``), feeding it ``stdin``,
+    and returns its combined stdout/stderr (also passed to ``output`` as it
+    comes in, if given).  The child is killed if the task is cancelled."""
+
+    encoding = locale.getpreferredencoding(False)
+
+    process = await asyncio.create_subprocess_exec(
+                    *(shlex.split(python_cmd) + args),
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.STDOUT,
+                    env=env)
+    try:
+        if output is None:
+            stdout, stderr = await process.communicate(stdin.encode(encoding))
+        else:
+            return await _stream(process, stdin.encode(encoding), encoding,
+                                 output)
+    finally:
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+
+    return stdout.decode(encoding, 'replace')
+
+async def _stream(process, stdin, encoding, output):
+    """Like ``process.communicate(stdin)``, but the output is decoded and
+    passed to ``output`` as it comes in.  Returns all of it."""
+
+    async def write():
+        try:
+            process.stdin.write(stdin)
+            await process.stdin.drain()
+            process.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            # (the interpreter did not read it all)
+            pass
+    writer = asyncio.ensure_future(write())
+
+    try:
+        decode = codecs.getincrementaldecoder(encoding)('replace').decode
+        texts = []
+        while True:
+            data = await process.stdout.read(65536)
+            text = decode(data, not data)
+            if text:
+                texts.append(text)
+                output(text)
+            if not data:
+                break
+        await writer
+        await process.wait()
+    finally:
+        writer.cancel()
+    return ''.join(texts)
@@ -0,0 +1,641 @@
+"""Batch conversion through a work queue in a shared directory.
+
+Jobs (one :func:`mod2doctest.convert` of one module each) are files in a
+queue directory.  Any number of workers, on one host or on several hosts
+that mount the same directory, take jobs from it until it is empty::
+
+    python -m mod2doctest.batch submit QUEUE --python python2.7 a.py b.py
+    python -m mod2doctest.batch work QUEUE --workers 4 --report summary
+    python -m mod2doctest.batch status QUEUE
+    python -m mod2doctest.batch trace QUEUE trace.json
+
+The queue directory holds:
+
+``pending/<order>-<job>.json``
+    Jobs that nobody works on (``{"src": ..., "python_cmd": ...,
+    "options": {...}}``, the options are :func:`mod2doctest.convert`
+    keyword arguments).  Workers take them in file name order, and
+    ``<order>`` puts the longest jobs first: it comes from how long the
+    module took the last time (see the journal), or for a new module from
+    its size, so no worker is left with a long job at the very end.
+
+``claimed/<order>-<job>@<worker>.json``
+    Jobs a worker took.  A job is claimed by renaming it out of
+    ``pending`` (a rename is atomic, so only one worker gets it).  The
+    worker touches the file while it works on the job; if it has not done
+    so for ``lease`` seconds (the worker died) the job is put back in
+    ``pending`` by the next worker that looks.
+
+``results/<job>.json``
+    One per finished job: ``{"src": ..., "status": "ok" or "error",
+    "target": ..., "error": ..., "seconds": ..., "worker": ...}``.  With
+    ``run_doctest`` set the |doctest| ``failed`` / ``attempted`` counts
+    are added (and a failure is an ``"error"``).
+
+``journal/<worker>.ndjson``
+    Every worker also appends a line per finished job to its own journal,
+    with a SHA-1 of the module and of the file saved, and syncs it to disk
+    every ``SYNC_EVERY`` jobs / ``SYNC_INTERVAL`` seconds.  After a crash,
+    ``submit(..., resume=True)`` (``submit --resume``) skips the modules
+    that were done and have not changed since, so only the rest is redone.
+    Jobs that were claimed when the workers died go back to ``pending``
+    once their lease runs out (or right away on Ctrl-C).
+
+``trace/<worker>.ndjson``
+    If the workers run with ``trace=True`` (``work --trace``), the stages
+    of every job (start-up of the interpreter, the run of each ``#>``
+    section, post processing, save and |doctest|) with their start and end
+    times.  :func:`trace` (``trace QUEUE FILE``) puts them together in a
+    Chrome trace event file, with one track per worker, that can be opened
+    in https://ui.perfetto.dev or ``chrome://tracing``.
+
+Hosts should have their clocks in sync, the leases are checked against
+the file modification times.
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import socket
+import hashlib
+import tempfile
+import threading
+
+from .mod2doctest import _Conversion
+from .mod2doctest import _run_interpreters
+from .mod2doctest import _save
+from .mod2doctest import verify
+from .reporters import get_reporter
+
+
+LEASE = 60.0
+POLL = 1.0
+SYNC_EVERY = 32
+SYNC_INTERVAL = 5.0
+
+def submit(queue, srcs, python_cmd, resume=False, **options):
+    """
+    :summary: Adds a job for each of the ``srcs`` to the ``queue`` and
+              returns the job names.
+
+    :param queue: The queue directory (made if it is not there).
+    :type queue:  str
+
+    :param srcs: Paths of the modules to convert.
+    :type srcs:  list of str
+
+    :param python_cmd: Same as for :func:`mod2doctest.convert`.
+    :type python_cmd:  str or list of str
+
+    :param resume: If True, skip the jobs the journal says are done, as
+                   long as neither the module nor the file saved for it
+                   changed since.
+    :type resume:  True or False
+
+    :param options: Any other :func:`mod2doctest.convert` keyword argument
+                    (they have to be JSON serializable, so no ``fn_*``).
+    """
+
+    records = _journal_records(queue)
+    done = _journal_done(records) if resume else {}
+    estimate = _estimator(records)
+    pending = set(filename[:-len('.json')].split('-', 1)[1]
+                  for filename in _listdir(queue, 'pending'))
+
+    names = []
+    for src in srcs:
+        src = os.path.abspath(src)
+        job = {'src': src, 'python_cmd': python_cmd, 'options': options}
+        name = _job_name(job)
+        if name in done and _still_valid(done[name]):
+            continue
+        if name not in pending:
+            # The longer the job the smaller the number (microseconds).
+            order = max(0, 10**15 - 1 - int(estimate(src) * 10**6))
+            _save(os.path.join(queue, 'pending',
+                               '%015d-%s.json' % (order, name)),
+                  json.dumps(job, sort_keys=True).encode('utf-8'))
+        names.append(name)
+    return names
+
+def work(queue, worker=None, lease=LEASE, poll=POLL, wait=True,
+         trace=False, reporter=None):
+    """
+    :summary: Takes jobs from ``queue`` and runs them until there are none
+              left.  Returns the number of jobs this worker ran.
+
+    :param worker: A name for this worker, defaults to ``host-pid``.
+    :type worker:  str
+
+    :param lease: Seconds after which a claimed job whose worker has not
+                  been heard of is given to another worker.
+    :type lease:  float
+
+    :param poll: Seconds to wait before looking at the queue again.
+    :type poll:  float
+
+    :param wait: If True, keep looking while other workers have jobs (they
+                 may die and the job come back), else stop as soon as
+                 there is nothing pending.
+    :type wait:  True or False
+
+    :param trace: If True, record the stages of every job for
+                  :func:`trace`.
+    :type trace:  True or False
+
+    :param reporter: What to print as jobs are done (see
+                     :mod:`mod2doctest.reporters`), nothing by default.
+    :type reporter:  None, str or :class:`mod2doctest.reporters.Reporter`
+    """
+
+    if worker is None:
+        worker = '%s-%d' % (socket.gethostname(), os.getpid())
+    reporter = get_reporter(reporter)
+
+    journal = _Journal(os.path.join(queue, 'journal', '%s.ndjson' % worker))
+    spans = None
+    if trace:
+        spans = _Journal(os.path.join(queue, 'trace', '%s.ndjson' % worker),
+                         sync_every=None)
+    try:
+        count = 0
+        while True:
+            _requeue_expired(queue, lease)
+            claimed = _claim(queue, worker)
+            if claimed is None:
+                if wait and _listdir(queue, 'claimed'):
+                    time.sleep(poll)
+                    continue
+                return count
+
+            name, path, job = claimed
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=_heartbeat,
+                                         args=(path, lease / 3.0, stop))
+            heartbeat.daemon = True
+            heartbeat.start()
+            events = [] if trace else None
+            try:
+                result = _run_job(job, events)
+            except KeyboardInterrupt:
+                # Give the job back now instead of when the lease runs out.
+                _unclaim(queue, path)
+                raise
+            finally:
+                stop.set()
+                heartbeat.join()
+
+            result['worker'] = worker
+            reporter.finish(result)
+            reporter.flush()
+            _save(os.path.join(queue, 'results', '%s.json' % name),
+                  json.dumps(result, sort_keys=True).encode('utf-8'))
+            journal.append(dict(result, job=name,
+                                src_sha1=_sha1(job['src']),
+                                target_sha1=_sha1(result['target'])))
+            for name, start, end, args in events or []:
+                spans.append({'name': name, 'start': start, 'end': end,
+                              'args': args, 'worker': worker,
+                              'host': socket.gethostname()})
+            try:
+                os.remove(path)
+            except OSError:
+                pass # the lease ran out and the job was put back
+            count += 1
+    finally:
+        journal.close()
+        if spans:
+            spans.close()
+        reporter.close()
+
+def status(queue):
+    """Returns the number of ``pending``, ``claimed`` and ``done`` jobs and
+    of the ``failed`` ones (as a dict)."""
+
+    failed = 0
+    for filename in _listdir(queue, 'results'):
+        result = _load(os.path.join(queue, 'results', filename))
+        if result is None or result['status'] != 'ok':
+            failed += 1
+    return {'pending': len(_listdir(queue, 'pending')),
+            'claimed': len(_listdir(queue, 'claimed')),
+            'done': len(_listdir(queue, 'results')),
+            'failed': failed}
+
+class _Journal(object):
+    """An append-only NDJSON file that is synced to disk every
+    ``sync_every`` records or ``sync_interval`` seconds (and when it is
+    closed).  A crash loses at most the records since the last sync, and
+    maybe leaves half a line at the end (which :func:`_journal_records`
+    skips).  With ``sync_every=None`` it is only synced when closed."""
+
+    def __init__(self, path, sync_every=SYNC_EVERY,
+                 sync_interval=SYNC_INTERVAL):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass
+        self.file = open(path, 'ab')
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.unsynced = 0
+        self.synced_at = time.time()
+
+    def append(self, record):
+        self.file.write((json.dumps(record, sort_keys=True) + '\n')
+                        .encode('utf-8'))
+        self.unsynced += 1
+        if self.sync_every is None:
+            return
+        if (self.unsynced >= self.sync_every or
+            time.time() - self.synced_at >= self.sync_interval):
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.synced_at = time.time()
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+def _journal_records(queue):
+    """Returns the records of every journal in ``queue``, oldest first."""
+
+    records = []
+    directory = os.path.join(queue, 'journal')
+    if not os.path.isdir(directory):
+        return records
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.ndjson'):
+            continue
+        for line in open(os.path.join(directory, filename), 'rb'):
+            try:
+                records.append(json.loads(line.decode('utf-8')))
+            except ValueError:
+                pass # cut off by a crash
+    records.sort(key=lambda record: record.get('finished', 0))
+    return records
+
+def _journal_done(records):
+    """Returns ``{job name: journal record}`` of the jobs that finished
+    without an error (the last record of a job wins)."""
+
+    done = {}
+    for record in records:
+        if record.get('status') == 'ok':
+            done[record['job']] = record
+        else:
+            done.pop(record.get('job'), None)
+    return done
+
+def _estimator(records):
+    """Returns a function that guesses how many seconds the conversion of a
+    module takes: as long as it took the last time, or, for a module that
+    was never run, its size times the average seconds per byte of the
+    modules that were (just its size if there are none)."""
+
+    durations = {}
+    for record in records:
+        durations[record['src']] = record['seconds']
+
+    total_bytes = total_seconds = 0
+    for src, seconds in durations.items():
+        if os.path.isfile(src):
+            total_bytes += os.path.getsize(src)
+            total_seconds += seconds
+    rate = total_seconds / total_bytes if total_bytes else 1e-6
+
+    def estimate(src):
+        if src in durations:
+            return durations[src]
+        return os.path.getsize(src) * rate if os.path.isfile(src) else 0.0
+    return estimate
+
+def _still_valid(record):
+    """Returns True if neither the module nor the saved file of a journal
+    ``record`` changed since it was written."""
+    return (_sha1(record['src']) == record['src_sha1'] and
+            _sha1(record['target']) == record['target_sha1'])
+
+def _sha1(path):
+    """Returns the SHA-1 of the file at ``path`` (``None`` if there is
+    none)."""
+    if not path or not os.path.isfile(path):
+        return None
+    return hashlib.sha1(open(path, 'rb').read()).hexdigest()
+
+def trace(queue, path):
+    """
+    :summary: Writes the stages the workers recorded (see ``trace`` in
+              :func:`work`) to ``path`` as a Chrome trace event file: one
+              process per host, one thread per worker.
+
+    :param queue: The queue directory.
+    :type queue:  str
+
+    :param path: The file to write (JSON).
+    :type path:  str
+    """
+
+    spans = []
+    directory = os.path.join(queue, 'trace')
+    for filename in sorted(_listdir(queue, 'trace', '.ndjson')):
+        for line in open(os.path.join(directory, filename), 'rb'):
+            try:
+                spans.append(json.loads(line.decode('utf-8')))
+            except ValueError:
+                pass # cut off by a crash
+
+    events = []
+    pids, tids = {}, {}
+    begin = min([span['start'] for span in spans] or [0])
+    for span in spans:
+        if span['host'] not in pids:
+            pids[span['host']] = len(pids) + 1
+            events.append({'ph': 'M', 'name': 'process_name',
+                           'pid': pids[span['host']], 'tid': 0,
+                           'args': {'name': span['host']}})
+        pid = pids[span['host']]
+        if span['worker'] not in tids:
+            tids[span['worker']] = len(tids) + 1
+            events.append({'ph': 'M', 'name': 'thread_name', 'pid': pid,
+                           'tid': tids[span['worker']],
+                           'args': {'name': span['worker']}})
+        events.append({'ph': 'X', 'cat': 'mod2doctest', 'name': span['name'],
+                       'pid': pid, 'tid': tids[span['worker']],
+                       'ts': round((span['start'] - begin) * 10**6, 3),
+                       'dur': round((span['end'] - span['start']) * 10**6,
+                                    3),
+                       'args': span['args']})
+
+    open(path, 'w').write(json.dumps({'traceEvents': events,
+                                      'displayTimeUnit': 'ms'}))
+
+def _job_name(job):
+    """Returns a file name for ``job``: the module name and a hash of the
+    job (the same job submitted twice is only run once)."""
+    digest = hashlib.sha1(json.dumps(job, sort_keys=True).encode('utf-8'))
+    module = os.path.splitext(os.path.basename(job['src']))[0]
+    return '%s-%s' % (module, digest.hexdigest()[:12])
+
+def _listdir(queue, directory, extension='.json'):
+    try:
+        return sorted(filename for filename
+                      in os.listdir(os.path.join(queue, directory))
+                      if filename.endswith(extension))
+    except OSError:
+        return []
+
+def _load(path):
+    try:
+        return _native(json.loads(open(path, 'rb').read().decode('utf-8')))
+    except (IOError, OSError, ValueError):
+        return None
+
+def _native(value):
+    """Returns ``value`` (loaded from JSON) with its text as ``str``: on
+    Python 2 :mod:`json` gives ``unicode``, which :func:`convert` does not
+    take for paths or commands."""
+    if isinstance(value, dict):
+        return dict((_native(key), _native(item))
+                    for key, item in value.items())
+    if isinstance(value, list):
+        return [_native(item) for item in value]
+    if str is bytes and not isinstance(value, str) and hasattr(value,
+                                                               'encode'):
+        return value.encode('utf-8')
+    return value
+
+def _claim(queue, worker):
+    """Moves the first pending job to ``claimed`` and returns ``(name,
+    claimed path, job)``, or ``None`` if there are no jobs left."""
+
+    claimed = os.path.join(queue, 'claimed')
+    if not os.path.isdir(claimed):
+        try:
+            os.makedirs(claimed)
+        except OSError:
+            pass
+
+    for filename in _listdir(queue, 'pending'):
+        stem = filename[:-len('.json')]
+        path = os.path.join(claimed, '%s@%s.json' % (stem, worker))
+        try:
+            os.rename(os.path.join(queue, 'pending', filename), path)
+        except OSError:
+            continue # another worker got it first
+        os.utime(path, None)
+        job = _load(path)
+        if job is not None:
+            return stem.split('-', 1)[1], path, job
+    return None
+
+def _unclaim(queue, path):
+    """Puts the job claimed at ``path`` back in ``pending``."""
+    stem = os.path.basename(path).rsplit('@', 1)[0]
+    os.rename(path, os.path.join(queue, 'pending', '%s.json' % stem))
+
+def _requeue_expired(queue, lease):
+    """Puts the claimed jobs whose lease ran out back in ``pending``."""
+    now = time.time()
+    for filename in _listdir(queue, 'claimed'):
+        path = os.path.join(queue, 'claimed', filename)
+        try:
+            if now - os.path.getmtime(path) > lease:
+                _unclaim(queue, path)
+        except OSError:
+            pass # done, or another worker put it back
+
+def _heartbeat(path, interval, stop):
+    """Touches ``path`` every ``interval`` seconds until ``stop`` is set."""
+    while True:
+        stop.wait(interval)
+        if stop.is_set():
+            return
+        try:
+            os.utime(path, None)
+        except OSError:
+            return
+
+def _run_job(job, events=None):
+    """Runs one job (like :func:`mod2doctest.convert`, but without printing
+    and without raising :exc:`SystemExit`) and returns its result.
+
+    If ``events`` is a list, the ``(name, start, end, args)`` of every stage
+    of the job are appended to it.  The interpreter side is taken from the
+    ``export`` records of the conversion (a temporary file if the job has
+    no ``export`` of its own).
+
+    """
+
+    def span(name, start, end=None, **args):
+        if events is not None:
+            events.append((name, start, end or time.time(), args))
+
+    options = dict(job['options'])
+    export = None
+    if events is not None and not options.get('export'):
+        handle, export = tempfile.mkstemp(prefix='mod2doctest-',
+                                          suffix='.ndjson')
+        os.close(handle)
+        options['export'] = export
+
+    result = {'src': job['src'], 'target': None, 'error': None}
+    start = time.time()
+    try:
+        conversion = _Conversion(job['python_cmd'], src=job['src'],
+                                 **options)
+        span('parse', start)
+
+        started = time.time()
+        stdouts = _run_interpreters(conversion.runs(), conversion.output)
+        ended = time.time()
+
+        began = time.time()
+        docstr = conversion.docstr(stdouts)
+        postprocessed = time.time()
+
+        if events is not None:
+            _execution_spans(span, conversion.export, started, ended)
+        span('postprocess', began, postprocessed)
+
+        if conversion.target:
+            began = time.time()
+            result['target'] = conversion.save(docstr)
+            span('save', began)
+            if conversion.run_doctest:
+                began = time.time()
+                results = verify(result['target'], conversion.doctest_flags,
+                                 conversion.doctest_cache)
+                span('doctest', began, failed=results.failed,
+                     attempted=results.attempted)
+                result['failed'] = results.failed
+                result['attempted'] = results.attempted
+                if results.failed:
+                    result['error'] = '%d of %d examples failed' % results
+    except Exception as e:
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+    finally:
+        if export:
+            os.remove(export)
+    result['seconds'] = time.time() - start
+    result['finished'] = time.time()
+    result['status'] = 'error' if result['error'] else 'ok'
+    span(os.path.basename(job['src']), start, result['finished'],
+         src=job['src'], status=result['status'], error=result['error'])
+    return result
+
+def _execution_spans(span, export, started, ended):
+    """Adds the ``spawn`` (up to the first statement), ``execute`` and
+    per-section spans of an interpreter run that went from ``started`` to
+    ``ended``, using the ``export`` records."""
+
+    records = []
+    for line in open(export, 'rb'):
+        record = json.loads(line.decode('utf-8'))
+        if record['started'] is not None:
+            records.append(record)
+    if not records:
+        span('execute', started, ended)
+        return
+
+    first = min(record['started'] for record in records)
+    span('spawn', started, first)
+    span('execute', first, ended)
+
+    # Consecutive statements of the same section make one span.
+    sections = []
+    for record in records:
+        end = record['started'] + (record['duration'] or 0.0)
+        if sections and sections[-1][0] == record['section']:
+            sections[-1][2] = max(sections[-1][2], end)
+        else:
+            sections.append([record['section'], record['started'], end])
+    for title, start, end in sections:
+        span('#>%s' % title if title else '(before the first section)',
+             start, end)
+
+def main(args):
+    """The ``python -m mod2doctest.batch`` command line."""
+
+    usage = ('usage: python -m mod2doctest.batch submit QUEUE '
+             '--python CMD [--option NAME=JSON ...] [--resume] FILE ...\n'
+             '       python -m mod2doctest.batch work QUEUE '
+             '[--workers N] [--lease SECONDS] [--trace]\n'
+             '           [--report progress|summary|quiet]\n'
+             '       python -m mod2doctest.batch status QUEUE\n'
+             '       python -m mod2doctest.batch trace QUEUE FILE\n')
+    if (len(args) < 2 or
+        args[0] not in ('submit', 'work', 'status', 'trace') or
+        (args[0] == 'trace' and len(args) != 3)):
+        sys.stderr.write(usage)
+        return 2
+    command, queue, args = args[0], args[1], list(args[2:])
+
+    def option(flag, default=None):
+        if flag in args:
+            i = args.index(flag)
+            value = args[i+1]
+            del args[i:i+2]
+            return value
+        return default
+
+    if command == 'submit':
+        python_cmd = option('--python', 'python')
+        resume = '--resume' in args
+        if resume:
+            args.remove('--resume')
+        options = {}
+        while '--option' in args:
+            name, value = option('--option').split('=', 1)
+            options[name] = json.loads(value)
+        names = submit(queue, args, python_cmd, resume=resume, **options)
+        print('%d jobs submitted (%d already done)'
+              % (len(names), len(args) - len(names)))
+    elif command == 'work':
+        workers = int(option('--workers', '1'))
+        lease = float(option('--lease', str(LEASE)))
+        tracing = '--trace' in args
+        report = option('--report', 'progress')
+        reporter = get_reporter(report)
+        if workers == 1:
+            work(queue, lease=lease, trace=tracing, reporter=reporter)
+        else:
+            # The workers are quiet, this process shows how the queue does.
+            import subprocess
+            popens = [subprocess.Popen([sys.executable, '-m',
+                                        'mod2doctest.batch', 'work', queue,
+                                        '--lease', str(lease),
+                                        '--report', 'quiet'] +
+                                       (['--trace'] if tracing else []))
+                      for i in range(workers)]
+            while [popen for popen in popens if popen.poll() is None]:
+                reporter.status(status(queue))
+                reporter.flush()
+                time.sleep(POLL)
+            reporter.status(status(queue))
+            reporter.close()
+    elif command == 'trace':
+        trace(queue, args[0])
+        print('Trace written to %s' % args[0])
+        return 0
+
+    counts = status(queue)
+    if command == 'work' and report == 'quiet':
+        return 1 if counts['failed'] else 0
+    print('%(pending)d pending, %(claimed)d claimed, %(done)d done '
+          '(%(failed)d failed)' % counts)
+    return 1 if counts['failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
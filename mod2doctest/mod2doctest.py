@@ -28,22 +28,35 @@ Attributes:
                                  doctest.REPORT_ONLY_FIRST_FAILURE |
                                  doctest.NORMALIZE_WHITESPACE)
 
+    verify (function): Runs |doctest| on a saved ``target`` file, with an
+    optional cache so unchanged files are not parsed (or run) again.
+
+    convert_async (coroutine function): An :mod:`asyncio` version of
+    :func:`convert` (Python 3 only), see :mod:`mod2doctest.aio`.
+
 """
 
+from __future__ import print_function
+
 import sys
 import os
-import inspect
-import subprocess
+import array
+import types
+import collections
+import functools
+import itertools
 import re
-import doctest
 import time
-import pdb
-import atexit
 
+from .reporters import get_reporter
 
-DEFAULT_DOCTEST_FLAGS = (doctest.ELLIPSIS |
-                         doctest.REPORT_ONLY_FIRST_FAILURE |
-                         doctest.NORMALIZE_WHITESPACE)
+# Anything else (doctest, subprocess ...) is imported where it is used, so
+# that ``import mod2doctest`` stays cheap.
+
+# doctest.ELLIPSIS | doctest.REPORT_ONLY_FIRST_FAILURE |
+# doctest.NORMALIZE_WHITESPACE (the values are the same in every Python
+# version since 2.5, spelled out so doctest does not have to be imported).
+DEFAULT_DOCTEST_FLAGS = 8 | 512 | 4
 
 def convert(python_cmd,
             src=True,
@@ -53,19 +66,41 @@ def convert(python_cmd,
             ellipse_memid=True,
             ellipse_traceback=True,
             ellipse_path=True,
+            ellipse_volatile=False,
+            deterministic=False,
+            freeze_time=None,
+            tmpdir=None,
             run_doctest=False,
             doctest_flags=DEFAULT_DOCTEST_FLAGS,
+            doctest_cache=None,
+            export=None,
+            profile=None,
             fn_process_input=None,
             fn_process_docstr=None,
+            fn_process_example=None,
             fn_title_docstr=None,
             clean_blanklines=True,
+            hoist_literals=None,
+            max_output_lines=None,
+            max_output_bytes=None,
+            max_line_width=None,
+            collapse_repeats=None,
+            sections=None,
+            until=None,
+            reporter='verbose',
+            layout='docstring',
             ):
     """
     :summary: Runs a module in shell, grabs output and creates a docstring.
 
     :param python_cmd: The python command that starts the shell (e.g. python
-                       or /bin/python2.4, etc).
-    :type python_cmd:  str
+                       or /bin/python2.4, etc).  If a list of commands is
+                       given, the module is run in all of them
+                       concurrently and a single docstr is made in which
+                       output that differs between them is ellipsed (see
+                       ``ellipse_volatile``).  The statements whose output
+                       differs are listed on stderr.
+    :type python_cmd:  str or list of str
 
     :param src: The python module to be converted. If ``True`` is given, the
                 current module is used.  Otherwise, you need to provide
@@ -107,6 +142,38 @@ def convert(python_cmd,
                           path)
     :type ellipse_paths:  True or False
 
+    :param ellipse_volatile: If a number N (> 1) is given, every interpreter
+                             is run N times concurrently, each time with a
+                             different ``PYTHONHASHSEED``.  Output that
+                             differs between the runs (set ordering,
+                             timings, random values ...) is replaced by an
+                             ellipse.  Differences that cannot be ellipsed
+                             (a whole line right after the input) are
+                             left as in the first run and reported on
+                             stderr.
+    :type ellipse_volatile:  False or int
+
+    :param deterministic: Run the interpreters with a fixed
+                          ``PYTHONHASHSEED`` and with :mod:`random` seeded,
+                          both with this number (0 if ``True`` is given),
+                          so set / dict ordering and random values are the
+                          same every time.  With ``ellipse_volatile`` the
+                          hash seed still changes from run to run.
+    :type deterministic:  False, True or int
+
+    :param freeze_time: Make the clock of the interpreters stand still at
+                        this time (in seconds since the epoch):
+                        :func:`time.time`, :func:`time.localtime`,
+                        :func:`time.ctime`, ``datetime.now()`` etc. always
+                        return it.  :func:`time.sleep` and the monotonic
+                        clocks are left alone.
+    :type freeze_time:  None, int or float
+
+    :param tmpdir: A directory (created if needed) the interpreters use for
+                   temporary files instead of the system one (``$TMPDIR``),
+                   so their paths do not change between runs.
+    :type tmpdir:  None or str directory path
+
     :param ellipse_traceback: Ellipse middle part of traceback.
     :type ellipse_traceback: True or False
 
@@ -119,8 +186,43 @@ def convert(python_cmd,
                           doctest.NORMALIZE_WHITESPACE)``
     :type doctest_flags: :mod:`doctest` flags
 
+    :param doctest_cache: A directory where the parsed docstring and the
+                          passing runs are cached when ``run_doctest`` is
+                          set (see :func:`verify`).
+    :type doctest_cache:  None or str directory path
+
+    :param export: Path of a file to write one JSON record per statement to
+                   (NDJSON), for tools that want the results without
+                   parsing the docstr.  A record is written (and flushed)
+                   as soon as the next statement starts, while the
+                   interpreter runs.  Every record has the ``source`` of
+                   the statement, its ``start`` and ``end`` line in the src,
+                   the ``section`` title (``#>``, ``null`` before the first
+                   one), the ``raw_output`` of the interpreter, the
+                   ``output`` as put in the docstr (ellipsed and capped,
+                   before any ``fn_process_example`` /
+                   ``fn_process_docstr``), the
+                   ``exception`` raised (e.g. ``"ValueError"``, or
+                   ``null``), when it ``started`` (:func:`time.time`) and
+                   the ``duration`` in seconds (both ``null`` if they could
+                   not be measured).
+    :type export:  None or str file path
+
+    :param profile: Run the code under :mod:`cProfile`: ``'module'`` saves
+                    one profile, ``'section'`` one for every ``#>`` section
+                    (and one, numbered 0, for the code before the first).
+                    They are saved next to the ``target`` (next to the src
+                    if there is none) as ``.pstats`` files (see
+                    :mod:`pstats`) and as collapsed stacks for flame graphs
+                    (``.folded``), e.g. ``mytest_doctest.03-setup.pstats``
+                    for the third section, titled 'Setup'.  Only the first
+                    ``python_cmd`` is profiled, and with ``'module'`` the
+                    ``[isolated]`` sections are left out.
+    :type profile:  None, 'module' or 'section'
+
     :param fn_process_input: A function that is called and is passed the
-                             module input.  Used for preprocessing.
+                             module input.  Used for preprocessing, it
+                             should return the (new) input.
     :type fn_process_input:  callable
 
 
@@ -132,6 +234,25 @@ def convert(python_cmd,
                               from your output before |doctest| is run.
     :type fn_process_docstr:  callable
 
+    :param fn_process_example: Like ``fn_process_docstr``, but called once
+                               for every statement, as
+                               ``fn(source, output, section)``: ``source``
+                               is the list of input lines (without
+                               '>>> ' / '... '), ``output`` the list of
+                               output lines and ``section`` the ``#>``
+                               title of the section (``None`` before the
+                               first one).  It returns the new list of
+                               output lines (``None`` keeps ``output``).
+                               If a list of functions is given they are
+                               called in turn, each one getting the output
+                               of the one before.  Blank lines, comments
+                               (``#>`` / ``#|`` ones too) and the ``raise
+                               SystemExit`` that ends the run are not
+                               passed.  Called before the traceback
+                               ellipses are applied to the whole docstr
+                               (the id / path ones are done).
+    :type fn_process_example:  callable or list of callables
+
     :param fn_title_docstr: A function that is called and should return a
                             string that will be used for the title.
     :type fn_title_docstr:  callable
@@ -142,272 +263,1802 @@ def convert(python_cmd,
                              to '>>>\n').
     :type clean_blanklines:  True or False
 
+    :param hoist_literals: If a number N is given, assignments of a literal
+                           (``NAME = {...}``, ``NAME = [...]`` ...) that
+                           span N or more lines are fed to the interpreter
+                           (and shown in the docstr) as a single line instead
+                           of being pasted line by line.  The literal is not
+                           evaluated: its source tokens are joined on that
+                           line as written, only comments and layout are
+                           lost.  Literals with a string that spans lines
+                           are left alone.
+    :type hoist_literals:  None or int
+
+    :param max_output_lines: Keep at most this many lines of the output of
+                             each statement, the rest is ellipsed.
+    :type max_output_lines:  None or int
+
+    :param max_output_bytes: Keep at most this many bytes of the output of
+                             each statement, the rest is ellipsed.
+    :type max_output_bytes:  None or int
+
+    :param max_line_width: Ellipse output lines after this many characters.
+    :type max_line_width:  None or int
+
+    :param collapse_repeats: Collapse runs of at least this many identical
+                             output lines into a single ellipsed line
+                             (``spam...``).
+    :type collapse_repeats:  None or int
+
+    :param sections: Only run these sections (a section starts at a ``#>``
+                     title that is underlined by another ``#>`` line).
+                     Sections are given by number (the first title is 1)
+                     or by title.  The code before the first title and
+                     sections tagged ``[setup]`` (e.g. ``#>Setup [setup]``)
+                     are always run.  If the ``target`` file already
+                     exists, the sections that are not run are copied
+                     over from its docstring as they are.
+    :type sections:  None, or a list of int / str
+
+    :param until: Do not run any section after this one (a number or a
+                  title, like ``sections``).  The sections after it are
+                  kept from the existing ``target`` like for ``sections``.
+    :type until:  None, int or str
+
+    :param reporter: What to print while the module is converted:
+                     ``'verbose'`` (the output and ``#>`` comments of the
+                     module), ``'summary'`` (a line per module and any
+                     warnings), ``'quiet'`` (nothing) or a
+                     :class:`mod2doctest.reporters.Reporter`.
+    :type reporter:  str or :class:`mod2doctest.reporters.Reporter`
+
+    :param layout: How the docstring is saved to the ``target``:
+                   ``'docstring'`` (one module docstring) or
+                   ``'sections'``.  With ``'sections'`` the module docstring
+                   only has the code before the first section and the
+                   ``[setup]`` sections (the fixture), and every other
+                   section is an entry of a module level ``__test__`` dict
+                   (``'02 Title'``, ``'03 Title [isolated]'``).
+                   :func:`verify` runs the fixture once and the entries on
+                   its globals, the ``[isolated]`` ones each on a fresh
+                   fixture and, with ``jobs``, in parallel, so a failure is
+                   reported against its section.  The ``__main__`` block
+                   calls :func:`verify` (``doctest.testmod`` would run every
+                   entry without the fixture).  Not for ``target=True``.
+    :type layout:  'docstring' or 'sections'
+
     :returns: None or, if ``target=None`` a docstring of type str.
+
+    :raises SyntaxError: If the module cannot be tokenized (unterminated
+                         strings, unbalanced brackets, bad indentation).
+                         This is checked before the interpreter is started.
     """
 
-    if src is True:
-        src = sys.modules['__main__']
-    elif isinstance(src, str):
-        if not os.path.isfile(src):
-            raise SystemError, "Cannot find src file %s ..." % src
-    else:
-        raise SystemError, "Unknown src type %s ..." % src
-
-    if inspect.ismodule(src):
-        input = open(src.__file__, 'r').read()
-    elif isinstance(src, str) and os.path.isfile(src):
-        input = open(src, 'r').read()
-    elif isinstance(src, str):
-        input = src
-    else:
-        raise SystemError, ("'src' %s must be a valid module or file path, "
-                            "or string ...") % obj
-
-    # First, remove the docstring.  Keep the input variable around, it's
-    # needed later on (the raw input with just the docstring removed).
-    input = _input_remove_docstring(input)
-    #pdb.set_trace()
-    pinput = _input_fix_whitespace(input)
-    pinput = _input_escape_shell_prompt(pinput)
-    pinput = _input_remove_name_eq_main(pinput)
-    pinput = _input_split_on_exit(pinput)
-
-    # Remove extra whitespace at end.
-    # You need to do this AFTER the removing of ``if __name__ == '__main__'``
-    pinput = pinput.strip()
-    pinput = pinput.replace('\r', '')
-    pinput = pinput.replace('\t', '    ')
-
-    popen = subprocess.Popen(args="%s -i" % python_cmd,
-                             bufsize=-1,
-                             shell=True,
-                             stdin=subprocess.PIPE,
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.STDOUT,
+    conversion = _Conversion(python_cmd,
+                             src=src,
+                             target=target,
+                             add_autogen=add_autogen,
+                             add_testmod=add_testmod,
+                             ellipse_memid=ellipse_memid,
+                             ellipse_traceback=ellipse_traceback,
+                             ellipse_path=ellipse_path,
+                             ellipse_volatile=ellipse_volatile,
+                             deterministic=deterministic,
+                             freeze_time=freeze_time,
+                             tmpdir=tmpdir,
+                             run_doctest=run_doctest,
+                             doctest_flags=doctest_flags,
+                             doctest_cache=doctest_cache,
+                             export=export,
+                             profile=profile,
+                             fn_process_input=fn_process_input,
+                             fn_process_docstr=fn_process_docstr,
+                             fn_process_example=fn_process_example,
+                             fn_title_docstr=fn_title_docstr,
+                             clean_blanklines=clean_blanklines,
+                             hoist_literals=hoist_literals,
+                             max_output_lines=max_output_lines,
+                             max_output_bytes=max_output_bytes,
+                             max_line_width=max_line_width,
+                             collapse_repeats=collapse_repeats,
+                             sections=sections,
+                             until=until,
+                             reporter=reporter,
+                             layout=layout,
                              )
 
-    def kill_popen():
-        try:
-            popen.kill()
-        except EnvironmentError:
-            pass
-    atexit.register(kill_popen)
+    start = time.time()
+    error = None
+
+    # The reporter is told even if it fails, its transcript may say why.
+    try:
+        stdouts = _run_interpreters(conversion.runs(), conversion.output)
+
+        docstr = conversion.docstr(stdouts)
+
+        if target:
+            target = conversion.save(docstr)
+    except Exception as e:
+        error = '%s: %s' % (type(e).__name__, e)
+        raise
+    finally:
+        conversion.reporter.finish({'src': getattr(conversion.src,
+                                                   '__file__',
+                                                   conversion.src),
+                                    'target': None if error else
+                                              target or None,
+                                    'error': error,
+                                    'seconds': time.time() - start})
+        conversion.reporter.close()
+
+    if target:
+        if run_doctest:
+            _run_doctest(target, doctest_flags, doctest_cache)
+        raise SystemExit
+    else:
+        return docstr
 
-    docstr = _communicate(pinput, popen, ellipse_memid, ellipse_path)
+class _Conversion(object):
+    """The parts of a :func:`convert` run that do not care how the
+    interpreter is driven.
 
-    if ellipse_traceback:
-        docstr = _docstr_ellipse_traceback(docstr)
+    :func:`convert` feeds each of :meth:`runs` to a blocking ``Popen``
+    while :func:`mod2doctest.aio.convert_async` uses :mod:`asyncio`
+    subprocesses; both hand the interpreter outputs back to :meth:`docstr`.
+    The keyword arguments are the same as those of :func:`convert`, but
+    ``reporter`` defaults to ``None`` (quiet).
 
-    docstr = _process_docstr_markers(docstr)
+    """
 
-    if fn_process_docstr:
-        docstr = fn_process_docstr(docstr)
+    def __init__(self,
+                 python_cmd,
+                 src=True,
+                 target='_doctest',
+                 add_autogen=True,
+                 add_testmod=True,
+                 ellipse_memid=True,
+                 ellipse_traceback=True,
+                 ellipse_path=True,
+                 ellipse_volatile=False,
+                 deterministic=False,
+                 freeze_time=None,
+                 tmpdir=None,
+                 run_doctest=False,
+                 doctest_flags=DEFAULT_DOCTEST_FLAGS,
+                 doctest_cache=None,
+                 export=None,
+                 profile=None,
+                 fn_process_input=None,
+                 fn_process_docstr=None,
+                 fn_process_example=None,
+                 fn_title_docstr=None,
+                 clean_blanklines=True,
+                 hoist_literals=None,
+                 max_output_lines=None,
+                 max_output_bytes=None,
+                 max_line_width=None,
+                 collapse_repeats=None,
+                 sections=None,
+                 until=None,
+                 reporter=None,
+                 layout='docstring',
+                 ):
+
+        selected_sections = sections
+
+        if layout not in ('docstring', 'sections'):
+            raise SystemError("Unknown layout %r ..." % (layout,))
+        if layout == 'sections' and target is True:
+            raise SystemError("layout='sections' cannot be saved to the "
+                              "src file (target=True) ...")
+
+        if src is True:
+            src = sys.modules['__main__']
+        elif isinstance(src, str):
+            if not os.path.isfile(src):
+                raise SystemError("Cannot find src file %s ..." % src)
+        else:
+            raise SystemError("Unknown src type %s ..." % src)
+
+        if isinstance(src, types.ModuleType):
+            input = open(src.__file__, 'r').read()
+        elif isinstance(src, str) and os.path.isfile(src):
+            input = open(src, 'r').read()
+        elif isinstance(src, str):
+            input = src
+        else:
+            raise SystemError(("'src' %s must be a valid module or file "
+                               "path, or string ...") % src)
 
-    if add_autogen is False:
-        fn_title_docstr = lambda docstr: ''
+        if isinstance(src, types.ModuleType):
+            filename = src.__file__
+        else:
+            filename = src
 
-    if fn_title_docstr:
-        doctitle = fn_title_docstr(docstr)
+        statements = _input_parse(input, filename)
 
-    if add_autogen:
-        doctitle = '%s\n' % _docstr_get_title()
-    else:
-        doctitle = '\n'
-        docstr = '\n'.join(docstr.split('\n')[3:-2]).lstrip()
+        # Keep the raw input around (with just the docstring removed), it's
+        # needed if the docstring is saved back to the src file.
+        if fn_process_input:
+            pstatements = _input_parse(fn_process_input(input), filename)
+        else:
+            pstatements = statements
+        input = _input_body(input, statements)
+
+        if hoist_literals:
+            pstatements = _input_hoist_literals(pstatements, hoist_literals)
+
+        sections = _input_sections(pstatements)
+        titles = [_section_title(section) for section in sections[1:]]
+        section_tags = [tags for tags, section in sections[1:]]
+        if selected_sections is not None or until is not None:
+            sections, selected_sections = _input_select(sections,
+                                                        selected_sections,
+                                                        until)
+
+        section_titles = dict((id(statement), _section_title(section))
+                              for section in sections[1:]
+                              for statement in section[1])
+
+        profiles = None
+        if profile:
+            if target:
+                base = _target_path(src, target)
+            elif isinstance(src, types.ModuleType):
+                base = src.__file__
+            else:
+                base = src
+            profiles, sections = _input_profile(sections,
+                                                os.path.splitext(base)[0],
+                                                profile == 'section')
+
+        # Sections marked ``[isolated]`` get their own interpreter.
+        shards = _input_shards(sections)
+        origins = [[] for shard in shards]
+        pinputs = [_input_render(shard, origin)
+                   for shard, origin in zip(shards, origins)]
+
+        if isinstance(python_cmd, str):
+            python_cmd = [python_cmd]
+        self.python_cmds = list(python_cmd)
+        self.src = src
+        self.target = target
+        self.input = input
+        self.pinputs = pinputs
+        self.origins = origins
+        self.section_titles = section_titles
+        self.profile = profile
+        self.profiles = profiles
+        self.titles = titles
+        self.section_tags = section_tags
+        self.layout = layout
+        self.selected_sections = selected_sections
+        self.add_autogen = add_autogen
+        self.add_testmod = add_testmod
+        self.ellipse_memid = ellipse_memid
+        self.ellipse_traceback = ellipse_traceback
+        self.ellipse_path = ellipse_path
+        self.ellipse_volatile = ellipse_volatile
+        self.deterministic = deterministic
+        self.freeze_time = freeze_time
+        self.tmpdir = tmpdir
+        self.run_doctest = run_doctest
+        self.doctest_flags = doctest_flags
+        self.doctest_cache = doctest_cache
+        self.export = export
+        self.timings = None
+        self.exporter = None
+        self.fn_process_docstr = fn_process_docstr
+        if callable(fn_process_example):
+            fn_process_example = [fn_process_example]
+        self.fn_process_example = fn_process_example
+        self.fn_title_docstr = fn_title_docstr
+        self.clean_blanklines = clean_blanklines
+        self.max_output_lines = max_output_lines
+        self.max_output_bytes = max_output_bytes
+        self.max_line_width = max_line_width
+        self.collapse_repeats = collapse_repeats
+        self.reporter = get_reporter(reporter)
+        # A directory for the interpreters to list the files of the modules
+        # they loaded in (see :meth:`module_files`), or None.
+        self.modules = None
+
+    def runs(self):
+        """Returns the ``(python_cmd, stdin, env)`` triples of the
+        interpreters to run.  They come in one group per entry of
+        ``pinputs`` (the main run, then the isolated sections), with one
+        run per ``python_cmd`` in each group (each of them repeated
+        ``ellipse_volatile`` times).  ``env`` is ``None`` if the interpreter
+        inherits the current environment.
+
+        The ``deterministic``, ``freeze_time`` and ``tmpdir`` settings go to
+        every run.  If there is an ``export`` or a ``profile``, the first run
+        of each group is also told to record when every statement starts /
+        to run the code under :mod:`cProfile`.  If ``modules`` is set every
+        run lists the modules it loaded there.  The interpreters get them
+        through their environment and ``_startup.py``.  The first call
+        with an ``export`` also makes the :class:`_Export` that
+        :meth:`output` passes the output on to.
+
+        """
+
+        if self.export and self.timings is None:
+            import tempfile
+            self.timings = tempfile.mkdtemp(prefix='mod2doctest-')
+
+        import random
+
+        base = None
+        startup = dict(PYTHONSTARTUP=_STARTUP,
+                       MOD2DOCTEST_STARTUP=os.environ.get('PYTHONSTARTUP',
+                                                          ''))
+        seed = self.deterministic
+        if seed is True:
+            seed = 0
+        if seed is not False and seed is not None:
+            seed = '%d' % seed
+            base = dict(os.environ, PYTHONHASHSEED=seed,
+                        MOD2DOCTEST_SEED=seed, **startup)
+        if self.freeze_time is not None:
+            base = dict(base or os.environ,
+                        MOD2DOCTEST_TIME=repr(float(self.freeze_time)),
+                        **startup)
+        if self.tmpdir:
+            if not os.path.isdir(self.tmpdir):
+                os.makedirs(self.tmpdir)
+            tmpdir = os.path.abspath(self.tmpdir)
+            base = dict(base or os.environ, TMPDIR=tmpdir, TEMP=tmpdir,
+                        TMP=tmpdir)
+
+        runs = []
+        for group, pinput in enumerate(self.pinputs):
+            stdin = '%s\n\nraise SystemExit\n\n' % pinput
+            if self.profile:
+                # (what the interpreter does to exit is not profiled)
+                stdin = '%s\n\n%s\nraise SystemExit\n\n' % (
+                    pinput, _PROFILE_SECTION % -1)
+            first = len(runs)
+            for python_cmd in self.python_cmds:
+                if self.ellipse_volatile and self.ellipse_volatile > 1:
+                    for i in range(self.ellipse_volatile):
+                        seed = random.randint(1, 4294967295)
+                        env = dict(base or os.environ,
+                                   PYTHONHASHSEED=str(seed))
+                        runs.append((python_cmd, stdin, env))
+                else:
+                    runs.append((python_cmd, stdin, base))
+            if self.export or self.profile:
+                python_cmd, stdin, env = runs[first]
+                env = dict(env or os.environ, **startup)
+                if self.export:
+                    env['MOD2DOCTEST_TIMINGS'] = os.path.join(
+                        self.timings, '%d.txt' % first)
+                if self.profile:
+                    import json
+                    env['MOD2DOCTEST_PROFILE'] = json.dumps(
+                        self.profiles[group])
+                runs[first] = (python_cmd, stdin, env)
+        if self.modules:
+            for i, (python_cmd, stdin, env) in enumerate(runs):
+                env = dict(env or os.environ, **startup)
+                env['MOD2DOCTEST_MODULES'] = os.path.join(self.modules,
+                                                          '%d.txt' % i)
+                runs[i] = (python_cmd, stdin, env)
+        if self.export and self.exporter is None:
+            self.exporter = _Export(self, runs)
+        return runs
+
+    def module_files(self):
+        """Returns the set of files of the modules the interpreters loaded
+        (if ``modules`` was set before they were run)."""
+        files = set()
+        for name in os.listdir(self.modules):
+            for path in open(os.path.join(self.modules, name)).read().split(
+                    '\n'):
+                if path[-4:] in ('.pyc', '.pyo') and os.path.isfile(path[:-1]):
+                    path = path[:-1]
+                if path:
+                    files.add(os.path.normpath(path))
+        return files
+
+    def output(self, i, text):
+        """Takes the ``text`` that run ``i`` (of :meth:`runs`) printed, as it
+        comes in.  The ``export`` records are written as the statements
+        complete (see :class:`_Export`)."""
+        if self.exporter is not None:
+            self.exporter.feed(i, text)
+
+    def docstr(self, stdouts):
+        """Turns the interpreter ``stdouts`` (one per :meth:`runs`) into
+        the final docstr."""
+
+        docstrlines = [_docstr_lines(stdin, stdout, self.ellipse_memid,
+                                     self.ellipse_path, self.max_line_width)
+                       for (python_cmd, stdin, env), stdout
+                       in zip(self.runs(), stdouts)]
+
+        if self.ellipse_volatile and self.ellipse_volatile > 1:
+            n = self.ellipse_volatile
+            docstrlines = [self._merge(docstrlines[i:i+n])
+                           for i in range(0, len(docstrlines), n)]
+
+        if len(self.python_cmds) > 1:
+            n = len(self.python_cmds)
+            docstrlines = [self._merge(docstrlines[i:i+n], self.python_cmds)
+                           for i in range(0, len(docstrlines), n)]
+
+        # (the output of the runs that was not passed to output() is
+        # exported now)
+        if self.exporter is not None:
+            self.exporter.close(stdouts)
+
+        if self.profile:
+            marker = _PROFILE_SECTION.split('%')[0]
+            docstrlines = [_Transcript(line for line in lines
+                                       if not (line[4:].startswith(marker) and
+                                               line[:4] in ('>>> ', '... ')))
+                           for lines in docstrlines]
+
+        docstrlines = _docstr_stitch(docstrlines[0], docstrlines[1:])
+
+        if (self.max_output_lines or self.max_output_bytes or
+            self.collapse_repeats):
+            docstrlines = _docstr_cap_output(docstrlines,
+                                             self.max_output_lines,
+                                             self.max_output_bytes,
+                                             self.collapse_repeats)
+
+        if self.fn_process_example:
+            docstrlines = _docstr_process_examples(docstrlines,
+                                                   self.fn_process_example)
+
+        # The interpreter banner ('Python 2.6.2 (r262:71605, ...').
+        banner = 0
+        while (banner < len(docstrlines) and
+               not docstrlines[banner].startswith('>>> ')):
+            banner += 1
+
+        self.reporter.transcript(docstrlines)
+
+        # The lines are only joined into one string at the very end (and
+        # for the user's functions).
+        if self.ellipse_traceback:
+            docstrlines = _docstr_ellipse_traceback(docstrlines)
+
+        docstrlines = _process_docstr_markers(docstrlines)
+
+        if self.fn_process_docstr:
+            docstrlines = self.fn_process_docstr(
+                '\n'.join(docstrlines)).split('\n')
+
+        if self.fn_title_docstr and self.add_autogen is not False:
+            doctitle = self.fn_title_docstr('\n'.join(docstrlines))
+
+        if self.add_autogen:
+            doctitle = '%s\n' % _docstr_get_title()
+        else:
+            doctitle = '\n'
+            docstrlines = _docstr_strip(docstrlines[banner:-2], right=False)
 
-    # Remember to remove any triple quotes """
-    docstr = docstr.replace("'''", '"""')
+        # Remember to remove any triple quotes """
+        docstrlines = [line.replace("'''", '"""') if "'''" in line else line
+                       for line in docstrlines]
 
-    docstr = "'''%s%s\n\n'''" % (doctitle, docstr.strip())
+        docstrlines = _docstr_strip(docstrlines)
 
-    if clean_blanklines:
-        docstr = _docstr_clean_blanklines(docstr)
+        if self.clean_blanklines:
+            docstrlines = _docstr_clean_blanklines(docstrlines)
+
+        docstr = "'''%s%s\n\n'''" % (doctitle, '\n'.join(docstrlines))
+
+        # Only some of the sections were run, take the others from the docstr
+        # that is already there.
+        if self.selected_sections is not None and self.target:
+            path = _target_path(self.src, self.target)
+            if os.path.isfile(path):
+                saved = _saved_docstr(open(path, 'r').read(), self.titles)
+                if saved is not None:
+                    docstr = _docstr_merge_sections(docstr, saved,
+                                                    self.titles,
+                                                    self.selected_sections)
 
-    if target:
-        target = _docstr_save(docstr, src, target, input, add_testmod)
-        if run_doctest:
-            _run_doctest(target, doctest_flags)
-        raise SystemExit
-    else:
         return docstr
 
+    def _merge(self, variants, python_cmds=None):
+        """Merges the docstr lines of runs of the same input (see
+        :func:`_docstr_merge_runs`), reporting the differences to the
+        ``reporter``.  If ``python_cmds`` is given the runs are from
+        those interpreters and every difference is reported, otherwise only
+        those that could not be ellipsed."""
+
+        lines, differences = _docstr_merge_runs(variants)
+
+        if differences is None:
+            self.reporter.warning('runs did not execute the same input, '
+                                  'output not ellipsed')
+        elif python_cmds:
+            differences = [difference for difference in differences
+                           if difference[0] is not None]
+            if differences:
+                message = ['output differs between interpreters:']
+                for prompt, outputs, merged in differences:
+                    message.append(prompt)
+                    for python_cmd, output in zip(python_cmds, outputs):
+                        message.append('    [%s]' % python_cmd)
+                        message.extend('        %s' % line for line in output)
+                self.reporter.warning('\n'.join(message))
+        else:
+            for prompt, outputs, merged in differences:
+                if merged is None:
+                    self.reporter.warning('output differs between runs: %r'
+                                          % ('\n'.join(outputs[0]),))
+
+        return lines
+
+    def save(self, docstr):
+        """Saves ``docstr`` to the target and returns the target path."""
+        add_testmod = self.add_testmod
+        if self.layout == 'sections':
+            docstr = _docstr_layout_sections(docstr, self.titles,
+                                             self.section_tags)
+            if add_testmod is True:
+                add_testmod = _ADD_VERIFY_STR % DEFAULT_DOCTEST_FLAGS
+        return _docstr_save(docstr, self.src, self.target, self.input,
+                            add_testmod)
+
 _ADD_TESTMOD_STR = """
 if __name__ == '__main__':
     import doctest
     doctest.testmod(optionflags=%d)
 """
 
-_RE_INPUT_PROCESS = re.compile(r"""
-^\s*            # Start of file, exclude whitespace
-(r|R)?          # Allow for raw-strings
-'''             # First triple quote.
-(.|\n)*?        # Everything in-between, but a non-greedy match
-'''             # Second triple quote.
-\s*             # Get rid of all other whitespace.
-""", flags=re.VERBOSE)
-def _input_remove_docstring(input):
-    """Strips the input and removes the first docstring from the input.
-
-    .. note;:
-
-       The first docstring is never treated as part of the input file.
-       Most notably, because this is when -- if directed -- mod2doctest
-       will put the output docstring (at the top of the file).
-
-    """
-    input = '\n\n' + _RE_INPUT_PROCESS.sub('', input).strip() + '\n'
-    return input.replace(r'\r', r'')
-
-def _input_escape_shell_prompt(input):
-    """Replaces `>>>` and '...' with escaped versions."""
-    input = input.replace('>>>', '\>>>')
-    return input.replace('...', '\...')
-
-def _input_fix_whitespace(input):
-    """Fixes problems with spaces in the input that cause interpreter errors.
+# The __main__ block of a target saved with layout='sections'.
+_ADD_VERIFY_STR = """
+if __name__ == '__main__':
+    import mod2doctest
+    mod2doctest.verify(__file__, %d)
+"""
 
-    There are two major problems and will use ^ to denote spaces
-    Normally, a statement like::
+# A top-level statement (or blank / comment line) of the input.  ``kind`` is
+# one of 'code', 'compound' (needs a blank line before the interpreter runs
+# it), 'main' (an ``if __name__ == '__main__'`` block), 'exit' (``exit()`` or
+# ``raise SystemExit``), 'docstring', 'blank', 'comment', '#>' or '#|'.
+# ``start`` and ``end`` are the (1-based, inclusive) line numbers in the
+# source and ``lines`` are the lines as they should be fed to the interpreter.
+_Statement = collections.namedtuple('_Statement', 'kind start end lines')
+
+_COMPOUND_TOKENS = set(['if', 'for', 'while', 'try', 'with', 'def', 'class',
+                        'async', '@'])
+_STACKABLE_TOKENS = set(['else', 'elif', 'except', 'finally'])
+_BRACKETS = {')': '(', ']': '[', '}': '{'}
+
+def _input_parse(input, filename='<string>'):
+    """Splits the input into a list of :data:`_Statement`.
+
+    This is the only pass over the input.  It uses :mod:`tokenize` to find
+    the top-level statements (so multi-line strings, bracketed expressions
+    and decorators are kept in one piece) and fixes up the whitespace
+    problems that keep a module from being pasted into the interpreter
+    as-is.  There are two major ones (^ denotes a space).  Normally, a
+    statement like::
 
         def fn():
 
         ^^^^print 'foobar'
 
-    will not work if directly copied / pasted because there are no spaces after
-    the ``def fn():`` line.
-
-    Also::
+    will not work if directly copied / pasted because there are no spaces
+    after the ``def fn():`` line.  So blank and comment lines within a
+    statement are indented to the level of the code around them.  Also::
 
         def fn():
         ^^^^print 'hi'
         def fx():
         ^^^^print 'bye'
 
-    does not allow direct copy paste either (you need a newline betwen the fn
-    calls). This will run fine within a module but **not** if pasted into the
-    interpreter. This function fixes these problem.
+    does not allow direct copy paste either (you need a newline between the
+    fn calls).  So compound statements are marked and
+    :func:`_input_render` puts a blank line after them.
 
-    The strategy is to collect all whitespace/comments and hold them in the
-    ``hold`` list.  Then, track the current indent level.  When a non
-    whitespace/comment line is encountered, apply the stored whitespace
-    with the correct level of indentation.  Also, add a blank line between
-    statements like those shown above.
+    Problems the tokenizer finds (unterminated strings, unbalanced
+    brackets, bad indentation) are raised as :exc:`SyntaxError` so they are
+    reported before any interpreter is started.
 
-    .. note::
+    """
 
-       This function makes assumptions about the Python syntax as taken
-       from http://docs.python.org/reference/compound_stmts.html
+    lines = input.replace('\r', '').replace('\t', ' '*4).split('\n')
+
+    logical = _input_logical_lines(lines, filename)
+
+    # Group the logical lines into top-level statements.  ``else:`` etc.
+    # and the line after a decorator continue the current statement.
+    groups = []
+    for lline in logical:
+        start, end, indent, tokens = lline
+        if (groups and (indent > 0 or tokens[0] in _STACKABLE_TOKENS or
+                        groups[-1][-1][3][0] == '@')):
+            groups[-1].append(lline)
+        else:
+            groups.append([lline])
+
+    continued = set()
+    for start, end, indent, tokens in logical:
+        continued.update(range(start + 1, end + 1))
+
+    statements = []
+    row = 1
+    for group in groups:
+        start, end = group[0][0], group[-1][1]
+        statements.extend(_input_gap(lines, row, start))
+        row = start
+
+        tokens = group[0][3]
+        if tokens[:5] == ['if', '__name__', '==', "'__main__'", ':'] or \
+           tokens[:5] == ['if', '__name__', '==', '"__main__"', ':']:
+            kind = 'main'
+        elif tokens[:3] == ['exit', '(', ')'] or \
+             tokens[:2] == ['raise', 'SystemExit']:
+            kind = 'exit'
+        elif (all(s.kind == 'blank' for s in statements) and
+              len(group) == 1 and len(tokens) == 1 and
+              tokens[0].lstrip('rR').startswith("'''")):
+            kind = 'docstring'
+        elif tokens[0] in _COMPOUND_TOKENS or tokens[-1] == ':':
+            kind = 'compound'
+        else:
+            kind = 'code'
+
+        fixed = []
+        last_indent = 0
+        for lstart, lend, indent, ltokens in group:
+            # Blank / comment lines between the logical lines get the
+            # indent of the code that follows (or, before an ``else:`` etc.,
+            # of the code that came before).
+            if ltokens[0] not in _STACKABLE_TOKENS:
+                last_indent = indent
+            while row < lstart:
+                fixed.append('%s%s' % (' '*last_indent, lines[row-1].lstrip()))
+                row += 1
+            for row in range(lstart, lend + 1):
+                line = lines[row-1]
+                if row not in continued and row + 1 not in continued:
+                    line = line.rstrip()
+                fixed.append(line)
+            row = lend + 1
+
+        statements.append(_Statement(kind, start, end, fixed))
+
+    statements.extend(_input_gap(lines, row, len(lines) + 1))
+
+    return statements
+
+def _input_gap(lines, start, stop):
+    """Returns the blank / comment lines from ``start`` up to ``stop``."""
+    statements = []
+    for row in range(start, stop):
+        line = lines[row-1].lstrip()
+        if not line:
+            kind = 'blank'
+        elif line[:2] in ('#>', '#|'):
+            kind = line[:2]
+        else:
+            kind = 'comment'
+        statements.append(_Statement(kind, row, row, [line]))
+    return statements
+
+def _input_logical_lines(lines, filename):
+    """Tokenizes ``lines`` and returns the logical lines as ``(start, end,
+    indent, tokens)`` tuples, where ``tokens`` are the strings of the
+    significant tokens."""
+
+    import tokenize
+
+    readline = functools.partial(next, iter([l + '\n' for l in lines]), '')
+
+    logical = []
+    current = None
+    brackets = []
+    indented = False
+    expect_indent = False
+
+    def error(cls, msg, row, col):
+        return cls(msg, (filename, row, col + 1, lines[row-1] + '\n'))
+
+    try:
+        for token in tokenize.generate_tokens(readline):
+            type, string, (srow, scol), (erow, ecol), line = token
+            if type == tokenize.INDENT:
+                if not expect_indent:
+                    raise error(IndentationError, 'unexpected indent',
+                                srow, scol)
+                indented = True
+            elif type == tokenize.NEWLINE and current is not None:
+                current[1] = srow
+                logical.append(tuple(current))
+                expect_indent = current[3][-1] == ':'
+                indented = False
+                current = None
+            elif type in (tokenize.NEWLINE, tokenize.NL, tokenize.COMMENT,
+                          tokenize.DEDENT, tokenize.ENDMARKER):
+                pass
+            else:
+                if current is None:
+                    if expect_indent and not indented:
+                        raise error(IndentationError,
+                                    'expected an indented block', srow, scol)
+                    current = [srow, erow, scol, []]
+                current[3].append(string)
+                if string in '([{' and type == tokenize.OP:
+                    brackets.append((string, srow, scol))
+                elif string in _BRACKETS and type == tokenize.OP:
+                    if not brackets or brackets[-1][0] != _BRACKETS[string]:
+                        raise error(SyntaxError, "unmatched '%s'" % string,
+                                    srow, scol)
+                    brackets.pop()
+    except tokenize.TokenError as e:
+        msg, (row, col) = e.args
+        if brackets:
+            string, row, col = brackets[-1]
+            msg = "'%s' was never closed" % string
+        row = min(max(row, 1), len(lines))
+        raise error(SyntaxError, msg, row, col)
+    except IndentationError as e:
+        raise error(IndentationError, e.args[0], e.lineno,
+                    (e.offset or 1) - 1)
+
+    return logical
+
+def _input_render(statements, origins=None):
+    """Turns the list of :data:`_Statement` into the text that is fed to
+    the interpreter.
+
+    ``if __name__ == '__main__'`` blocks are dropped (they act as
+    |mod2doctest| comments), everything from the first ``exit()`` / ``raise
+    SystemExit`` on is dropped, and '>>>' and '...' are escaped.
+
+    If an ``origins`` list is given, the statement each line of the text
+    comes from (``None`` for added blank lines) is appended to it.
 
     """
+
     lines = []
-    input = input.replace('\r', '')
-    input = input.replace('\t', ' '*4)
-    hold = []
-    last_indent = 0
-    stackable_tokens = set(['else', 'elif', 'except', 'finally'])
-    for line in input.split('\n'):
-        left_stripped = line.lstrip()
-        if not left_stripped or left_stripped.startswith('#'):
-            # collect all blank lines or full comment lines
-            hold.append(left_stripped)
+    froms = []
+    need_blank = False
+    after_main = False
+    for statement in statements:
+        kind = statement.kind
+        if kind == 'exit':
+            break
+        elif kind == 'docstring' or (after_main and kind == 'blank'):
+            continue
+        elif kind == 'main':
+            lines.append('') # add one blank line for every main block
+            froms.append(None)
+            need_blank = False
+            after_main = True
+            continue
+
+        if need_blank and kind != 'blank':
+            lines.append('')
+            froms.append(None)
+        need_blank = kind == 'compound'
+        after_main = False
+
+        for line in statement.lines:
+            line = line.replace('>>>', r'\>>>')
+            lines.append(line.replace('...', r'\...'))
+            froms.append(statement)
+
+    # Remove extra whitespace at the start and the end.
+    if origins is not None:
+        start, end = 0, len(lines)
+        while start < end and not lines[start].strip():
+            start += 1
+        while end > start and not lines[end-1].strip():
+            end -= 1
+        origins.extend(froms[start:end])
+    return '\n'.join(lines).strip()
+
+def _input_hoist_literals(statements, min_lines):
+    """Returns the statements with every assignment of a literal that spans
+    ``min_lines`` or more lines put on a single line.
+
+    The tokens of the literal are put on one line as they are written (the
+    interpreter may be another Python version, so ``u''`` and ``b''``
+    strings have to stay what they were), only comments and layout inside
+    the literal are lost.  Literals with a string that spans lines are
+    left alone.
+
+    """
+
+    hoisted = []
+    for statement in statements:
+        if statement.kind == 'code' and len(statement.lines) >= min_lines:
+            line = _input_hoist_literal('\n'.join(statement.lines))
+            if line is not None:
+                statement = statement._replace(lines=[line])
+        hoisted.append(statement)
+    return hoisted
+
+def _input_hoist_literal(source):
+    """Returns ``source`` as one ``NAME = <literal>`` line, or ``None`` if
+    it is not a plain assignment of a literal."""
+
+    import ast
+    import tokenize
+
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return None
+    if (len(tree.body) != 1 or not isinstance(tree.body[0], ast.Assign) or
+        not all(isinstance(t, ast.Name) for t in tree.body[0].targets)):
+        return None
+
+    try:
+        ast.literal_eval(tree.body[0].value)
+    except (ValueError, SyntaxError, TypeError):
+        return None
+
+    readline = functools.partial(next, iter((source + '\n').splitlines(True)),
+                                 '')
+    line = ''
+    previous = None
+    for token in tokenize.generate_tokens(readline):
+        type, string = token[:2]
+        if type in (tokenize.NL, tokenize.NEWLINE, tokenize.COMMENT,
+                    tokenize.INDENT, tokenize.DEDENT, tokenize.ENDMARKER):
+            continue
+        if '\n' in string:
+            return None
+        if string in (',', ':'):
+            line += string + ' '
+        elif string == '=':
+            line = line.rstrip() + ' = '
+        elif string in (')', ']', '}'):
+            line = line.rstrip() + string
+        elif type == tokenize.STRING and previous == tokenize.STRING:
+            line += ' ' + string
         else:
-            new_indent = len(line) - len(left_stripped)
-            if left_stripped.split()[0].split(':')[0] not in stackable_tokens:
-                # Add whitespace if, for example, two functions are defined
-                # with no whitespace in between
-                if not hold and new_indent < last_indent:
-                    lines.append(' '*new_indent)
-                last_indent = new_indent
+            line += string
+        previous = type
+    return line.rstrip()
+
+def _input_body(input, statements):
+    """Returns the raw input with the first docstring removed.  This is what
+    is kept below the new docstring if the output goes to the src file."""
+    for statement in statements:
+        if statement.kind == 'docstring':
+            input = '\n'.join(input.split('\n')[statement.end:])
+            break
+        elif statement.kind != 'blank':
+            break
+    return '\n\n' + input.strip() + '\n'
+
+_RE_SECTION_UNDERLINE = re.compile(r'^#>\s*([=\-+~*^#"`])\1+\s*$')
+_RE_SECTION_TAG = re.compile(r'\s*\[(isolated|setup)\]\s*$')
+def _input_sections(statements):
+    """Splits the statements into sections.
+
+    A section starts at a ``#>`` title that is underlined by another ``#>``
+    line (e.g. ``#>Title`` and then ``#>=====``) and runs up to the next
+    one.  Returns a list of ``(tags, statements)`` pairs, the first of which
+    is whatever comes before the first title (the preamble).  ``tags`` is
+    the set of ``[tag]`` markers found at the end of the ``#>`` lines at
+    the top of the section (which are removed from those lines).  Nothing
+    after an ``exit()`` / ``raise SystemExit`` is kept.
 
-            hold = ['%s%s' % (' '*last_indent, h,) for h in hold]
-            lines.extend(hold)
-            hold = []
+    """
 
-            lines.append(line.rstrip())
+    sections = [(set(), [])]
+    in_title = False
+    for i, statement in enumerate(statements):
+        if statement.kind == '#>':
+            if (not in_title and i + 1 < len(statements) and
+                statements[i+1].kind == '#>' and
+                _RE_SECTION_UNDERLINE.match(statements[i+1].lines[0])):
+                sections.append((set(), []))
+                in_title = True
+            if in_title and len(sections) > 1:
+                line = statement.lines[0]
+                match = _RE_SECTION_TAG.search(line)
+                while match:
+                    sections[-1][0].add(match.group(1))
+                    line = line[:match.start()]
+                    match = _RE_SECTION_TAG.search(line)
+                if line == '#>':
+                    continue
+                statement = statement._replace(lines=[line])
+        else:
+            in_title = False
 
-    return '\n'.join(lines)
+        sections[-1][1].append(statement)
 
-_RE_NEM = re.compile(r"""^if\s+__name__\s*==\s*['"]+__main__['"]+\s*:""",
-                     flags=re.IGNORECASE)
-def _input_remove_name_eq_main(input):
-    lines = []
-    in_nem = False
-    for line in input.split('\n'):
-        if _RE_NEM.match(line):
-            in_nem = True
-            lines.append('') # add one blank line for every nem
-        elif in_nem and line.strip() and line[0] not in ' \t':
-            in_nem = False
-        if in_nem is False:
-            lines.append(line)
-    return '\n'.join(lines)
+        if statement.kind == 'exit':
+            break
+
+    return sections
+
+def _section_title(section):
+    """Returns the title of a section (as returned by
+    :func:`_input_sections`), e.g. 'Make A List' for ``#>Make A List``."""
+    return section[1][0].lines[0][2:].strip()
+
+def _input_select(sections, selected=None, until=None):
+    """Picks the sections to run.
+
+    ``selected`` is a list of section numbers (1 is the first titled
+    section) or titles; ``None`` selects them all.  If ``until`` (a number
+    or title) is given, nothing after that section is run.  The preamble
+    and any section tagged ``[setup]`` are always run.  Returns the
+    sections to run and the set of their numbers.
+
+    """
 
-_RE_EXIT = re.compile(r"^(exit\(\)|raise SystemExit)", re.MULTILINE)
-def _input_split_on_exit(input):
-    return _RE_EXIT.split(input, 1)[0]
+    titles = [_section_title(section).lower() for section in sections[1:]]
 
-def _communicate(pinput, popen, ellipse_memid, ellipse_path):
+    def lookup(selector):
+        if isinstance(selector, int) or selector.strip().isdigit():
+            if 1 <= int(selector) <= len(titles):
+                return int(selector)
+        elif selector.strip().lower() in titles:
+            return titles.index(selector.strip().lower()) + 1
+        raise SystemError("Unknown section %r ..." % (selector,))
 
-    pinput = '%s\n\nraise SystemExit\n\n' % pinput
+    if selected is None:
+        numbers = set(range(1, len(titles) + 1))
+    else:
+        if isinstance(selected, (int, str)):
+            selected = [selected]
+        numbers = set(lookup(selector) for selector in selected)
+
+    if until is not None:
+        last = lookup(until)
+        numbers = set(n for n in numbers if n <= last)
+
+    numbers.update(n for n, section in enumerate(sections[1:], 1)
+                   if 'setup' in section[0])
+
+    return ([sections[0]] + [section for n, section in
+                             enumerate(sections[1:], 1) if n in numbers],
+            numbers)
+
+_SHARD_BEGIN = '#mod2doctest: begin shard %d'
+_SHARD_END = '#mod2doctest: end shard %d'
+def _input_shards(sections):
+    """Returns the statements for each interpreter run.
 
-    pinputlines = pinput.split('\n')
+    The first run is the module with every ``[isolated]`` section replaced
+    by a placeholder comment.  Each isolated section then gets a run of its
+    own: the preamble and the ``[setup]`` sections before it, followed by
+    the section between two marker comments.  :func:`_docstr_stitch` puts
+    the pieces back together.
+
+    """
+
+    def comment(text):
+        return _Statement('comment', 0, 0, [text])
+
+    preamble = list(sections[0][1])
+    shards = [list(preamble)]
+    for tags, section in sections[1:]:
+        if 'isolated' in tags:
+            n = len(shards)
+            shards[0].append(comment(_SHARD_BEGIN % n))
+            shards.append(preamble + [comment(_SHARD_BEGIN % n)] + section +
+                          [comment(_SHARD_END % n)])
+        else:
+            shards[0].extend(section)
+            if 'setup' in tags:
+                preamble.extend(section)
 
-    stdout, stderr = popen.communicate(pinput)
+    return shards
 
-    docstrlines = []
+# Run by the interpreters (as $PYTHONSTARTUP) for ``export`` / ``profile``.
+_STARTUP = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '_startup.py')
 
-    intraceback = False
-    startheader = True
+# The hidden statement that starts a new section with ``profile='section'``
+# (-1 stops the profiler).  It does nothing in the interpreters that are
+# not profiled.
+_PROFILE_SECTION = ("getattr(__import__('sys'), '_mod2doctest_section', "
+                    "lambda n: None)(%d)")
+
+def _input_profile(sections, base, per_section):
+    """Returns the file names for the ``profile`` option of :func:`convert`
+    and the sections to run.
+
+    The names (``base`` plus the section number and title, without an
+    extension) come as a ``{section number: name}`` dict for each
+    interpreter run of :func:`_input_shards`: the main run profiles every
+    section that is not ``[isolated]`` and each isolated run profiles its
+    section.  If ``per_section`` is set, each section starts with a
+    :data:`_PROFILE_SECTION` statement, else there is a single profile.
+
+    """
+
+    if not per_section:
+        return [{'0': base}] + [{} for tags, section in sections[1:]
+                                if 'isolated' in tags], sections
+
+    profiles = [{}]
+    marked = []
+    for n, (tags, statements) in enumerate(sections):
+        name = '%s.%02d' % (base, n)
+        if n:
+            slug = re.sub(r'\W+', '-', _section_title((tags, statements)))
+            name = '%s-%s' % (name, slug.strip('-').lower())
+        if 'isolated' in tags:
+            profiles.append({str(n): name})
+        else:
+            profiles[0][str(n)] = name
+        marker = _Statement('code', 0, 0, [_PROFILE_SECTION % n])
+        marked.append((tags, [marker] + statements))
+    return profiles, marked
+
+def _run_interpreters(runs, output=None):
+    """Runs a ``python_cmd -i`` shell for each of the ``(python_cmd, stdin,
+    env)`` ``runs`` concurrently and returns their outputs.  If ``output``
+    is given, it is called with the number of the run and the text as the
+    text comes in (from several threads)."""
+
+    import subprocess
+    import threading
+    import atexit
+
+    popens = []
+    for python_cmd, stdin, env in runs:
+        popen = subprocess.Popen(args="%s -i" % python_cmd,
+                                 bufsize=-1,
+                                 shell=True,
+                                 stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT,
+                                 universal_newlines=True,
+                                 env=env,
+                                 )
+
+        def kill_popen(popen=popen):
+            try:
+                popen.kill()
+            except EnvironmentError:
+                pass
+        atexit.register(kill_popen)
+
+        popens.append(popen)
+
+    stdouts = [None]*len(popens)
+
+    def communicate(i):
+        if output is None:
+            stdouts[i] = popens[i].communicate(runs[i][1])[0]
+        else:
+            stdouts[i] = _communicate(popens[i], runs[i][1],
+                                      functools.partial(output, i))
+
+    threads = [threading.Thread(target=communicate, args=(i,))
+               for i in range(1, len(popens))]
+    for thread in threads:
+        thread.start()
+    communicate(0)
+    for thread in threads:
+        thread.join()
+
+    return stdouts
+
+def _communicate(popen, stdin, output):
+    """Like ``popen.communicate(stdin)[0]`` (with ``universal_newlines``),
+    but the output is also passed to ``output`` as it comes in."""
+
+    import threading
+
+    def write():
+        try:
+            popen.stdin.write(stdin)
+            popen.stdin.close()
+        except EnvironmentError:
+            # (the interpreter did not read it all)
+            pass
+    writer = threading.Thread(target=write)
+    writer.start()
+
+    if bytes is str:
+        decode = lambda data, final: data
+    else:
+        import codecs
+        import locale
+        decode = codecs.getincrementaldecoder(
+            locale.getpreferredencoding(False))().decode
+
+    texts = []
+    carry = ''
+    fd = popen.stdout.fileno()
+    while True:
+        data = os.read(fd, 65536)
+        text = carry + decode(data, not data)
+        carry = ''
+        # ('\r\n' may be cut in two)
+        if data and text.endswith('\r'):
+            text, carry = text[:-1], '\r'
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+        if text:
+            texts.append(text)
+            output(text)
+        if not data:
+            break
+
+    writer.join()
+    popen.stdout.close()
+    popen.wait()
+    return ''.join(texts)
+
+# sys.intern is the builtin intern in Python 2.
+_intern = getattr(sys, 'intern', None) or intern
+
+class _Transcript(object):
+    """The docstr lines of a run, as the postprocessing passes them on.
+
+    The lines are kept in one list (the output lines are interned, so the
+    lines that repeat share one string) and the offsets of the prompt
+    lines in an ``array``, so the statements are found without looking at
+    every line again (see :meth:`blocks`).  It reads like a list of lines.
+
+    """
+
+    __slots__ = ('lines', 'prompts')
+
+    def __init__(self, lines=()):
+        self.lines = []
+        self.prompts = array.array('l')
+        for line in lines:
+            if line.startswith('>>> ') or line.startswith('... '):
+                self.prompts.append(len(self.lines))
+            self.lines.append(line)
+
+    def add(self, prompt, output):
+        """Adds the ``prompt`` line (``None`` for the interpreter header)
+        and the ``output`` lines that follow it."""
+        if prompt is not None:
+            self.prompts.append(len(self.lines))
+            self.lines.append(prompt)
+        self.lines.extend(output)
+
+    def blocks(self):
+        """Returns the ``(prompt line, output lines)`` pairs, like
+        :func:`_docstr_blocks`."""
+        lines, prompts = self.lines, self.prompts
+        ends = list(prompts[1:]) + [len(lines)]
+        blocks = [(None, lines[:prompts[0] if prompts else len(lines)])]
+        for start, end in zip(prompts, ends):
+            blocks.append((lines[start], lines[start+1:end]))
+        return blocks
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __getitem__(self, index):
+        return self.lines[index]
+
+def _docstr_lines(pinput, stdout, ellipse_memid, ellipse_path,
+                  max_line_width=None):
+    """Matches the interpreter ``stdout`` up with the ``pinput`` that was fed
+    to it and returns the docstr lines.  The memory id / path ellipses and
+    ``max_line_width`` are applied to the output (not the input) lines,
+    ``max_line_width`` not to the interpreter header before the first
+    prompt.  Returns a :class:`_Transcript`."""
+
+    pinputlines = iter(pinput.split('\n'))
+
+    transcript = _Transcript()
+    docstrlines = transcript.lines
+    header = True
 
     for outputline in stdout.split('\n'):
         outputline = outputline.replace('\r', '')
         outputline = outputline.replace('\t', '    ')
 
-        if ellipse_memid:
-            outputline = _docstr_ellipse_mem_id(outputline)
+        if outputline.startswith('>>> ') or outputline.startswith('... '):
+            lines = list(_match_input_to_output(pinputlines, outputline))
+            # (the line is split into the inputs and what follows them)
+            header = header and len(lines) == 1
+            for line in lines[:-1]:
+                transcript.add(line, ())
+            # The last line is what is left after the prompts.
+            outputline = lines[-1]
+
+        outputline = _docstr_ellipse_output(outputline, ellipse_memid,
+                                            ellipse_path,
+                                            None if header else max_line_width)
+
+        # Output lines repeat a lot (in loops, across runs), keep one copy.
+        docstrlines.append(_intern(outputline))
+
+    return transcript
+
+def _docstr_ellipse_output(line, ellipse_memid, ellipse_path,
+                           max_line_width):
+    """Returns an output ``line`` with the memory id / path ellipses and
+    cut to ``max_line_width``."""
+
+    if ellipse_memid:
+        line = _docstr_ellipse_mem_id(line)
+
+    if ellipse_path:
+        line = _docstr_ellipse_paths(line)
+
+    # (after the ellipses, a cut through an id would not match them)
+    if max_line_width and len(line) > max_line_width:
+        line = _docstr_add_ellipse(line[:max_line_width])
+    return line
+
+class _OutputBlocks(object):
+    """Splits the output of an interpreter into the ``(prompt line, output
+    lines)`` blocks of :func:`_docstr_blocks` as it comes in, matching it
+    up with the ``pinput`` fed to it like :func:`_docstr_lines` does
+    (without the ellipses).  A block is complete once the next prompt is
+    seen or the output ends (see :meth:`complete`)."""
+
+    def __init__(self, pinput):
+        self.inputlines = iter(pinput.split('\n'))
+        self.blocks = [(None, [])]
+        self.rest = ''
+        self.closed = False
+
+    def feed(self, text):
+        lines = (self.rest + text).split('\n')
+        self.rest = lines.pop().replace('\r', '').replace('\t', '    ')
+        for line in lines:
+            self._line(line)
+
+        # The prompts need not wait for the end of their line (the block
+        # before them is complete).
+        while self.rest[:4] in ('>>> ', '... '):
+            inputline = next(self.inputlines, None)
+            if inputline is None:
+                break
+            self.blocks.append(('%s%s' % (self.rest[:4], inputline), []))
+            self.rest = self.rest[4:]
+
+    def close(self):
+        """The output has ended."""
+        self._line(self.rest)
+        self.rest = ''
+        self.closed = True
+
+    def complete(self):
+        """Returns the number of complete blocks (the interpreter header
+        is the first)."""
+        return len(self.blocks) - (not self.closed)
+
+    def _line(self, line):
+        line = line.replace('\r', '').replace('\t', '    ')
+        pieces = list(_match_input_to_output(self.inputlines, line))
+        for prompt in pieces[:-1]:
+            self.blocks.append((prompt, []))
+        self.blocks[-1][1].append(pieces[-1])
+
+def _docstr_cap_output(docstrlines, max_lines=None, max_bytes=None,
+                       repeats=None):
+    """Limits the output of each statement to ``max_lines`` lines and
+    ``max_bytes`` bytes and collapses runs of ``repeats`` or more identical
+    lines.
+
+    What is cut is replaced by an ellipse added to the end of the line
+    before it ('...' also matches newlines), so a run of ``spam`` lines
+    becomes a single ``spam...``.  Output with a traceback is left alone
+    (|doctest| needs the last line of it).
 
-        if ellipse_path:
-            outputline = _docstr_ellipse_paths(outputline)
+    """
 
+    lines = _Transcript()
+    for prompt, output in _docstr_blocks(docstrlines):
+        if (prompt is None or not output or
+            'Traceback (most recent call last):' in output):
+            lines.add(prompt, output)
+            continue
+
+        if repeats:
+            collapsed = []
+            for line, run in itertools.groupby(output):
+                count = len(list(run))
+                if line and count >= repeats:
+                    collapsed.append(_docstr_add_ellipse(line))
+                else:
+                    collapsed.extend([line] * count)
+            output = collapsed
+
+        cut = False
+        if max_lines and len(output) > max_lines:
+            output = output[:max_lines]
+            cut = True
+        if max_bytes:
+            size = 0
+            for i, line in enumerate(output):
+                size += len(line) + 1
+                if size > max_bytes:
+                    output = output[:i+1]
+                    output[i] = line[:max(max_bytes - size + len(line), 1)]
+                    cut = True
+                    break
+        if cut and not output[-1].endswith('...'):
+            output[-1] = _docstr_add_ellipse(output[-1])
+
+        lines.add(prompt, output)
+    return lines
+
+def _docstr_stitch(docstrlines, shards):
+    """Replaces the placeholders in the main run's ``docstrlines`` with the
+    lines of the isolated ``shards`` (see :func:`_input_shards`)."""
+
+    if not shards:
+        return docstrlines
+
+    pieces = {}
+    for n, shardlines in enumerate(shards):
+        begin, end = _SHARD_BEGIN % (n + 1), _SHARD_END % (n + 1)
+        piece = None
+        for prompt, output in _docstr_blocks(shardlines)[1:]:
+            if prompt[4:] == begin:
+                piece = [(None, output)]
+            elif prompt[4:] == end:
+                break
+            elif piece is not None:
+                piece.append((prompt, output))
+        pieces[begin] = piece or []
+
+    lines = _Transcript()
+    for prompt, output in _docstr_blocks(docstrlines):
+        if prompt is not None and prompt[4:] in pieces:
+            for block in pieces[prompt[4:]]:
+                lines.add(*block)
+            lines.add(None, output)
+        else:
+            lines.add(prompt, output)
+    return lines
 
-        for line in _match_input_to_output(pinputlines, outputline):
+_RE_EXCEPTION = re.compile(r'^([A-Za-z_][\w.]*)(:|$)')
 
-            docstrlines.append(line)
+class _Export(object):
+    """Writes the ``export`` records of a :class:`_Conversion` while its
+    interpreters run.
 
-            if line.startswith('>>> #>') or line.startswith('... #>'):
-                if startheader:
-                    print '\n'
-                line = line[6:]
-                startheader = False
-            elif line.startswith('>>> ') or line.startswith('...'):
-                startheader = True
-                continue
-
-            if line.startswith('Traceback') or line.startswith('Exception'):
-                intraceback = True
-            elif intraceback and not line.startswith(' '):
-                intraceback = None
-
-            if intraceback is False:
-                print line
+    It is made by :meth:`_Conversion.runs`, for the runs it returns.  The
+    output of every run is split into blocks as it comes in (see
+    :class:`_OutputBlocks`).  Once every run of a group has printed a
+    block, the block gets the ellipses, merging and caps of the docstr,
+    and the record of a statement is written as soon as the next one
+    starts (see :class:`_Records`).  The records of an isolated section
+    are written in the place of its placeholder in the main run (like
+    :func:`_docstr_stitch`).
+
+    """
+
+    def __init__(self, conversion, runs):
+        import json
+        import threading
+
+        self.conversion = conversion
+        self.json = json
+        self.lock = threading.Lock()
+
+        self.group = len(runs) // len(conversion.pinputs)
+        self.streams = [_OutputBlocks(stdin) for python_cmd, stdin, env
+                        in runs]
+        self.fed = [False] * len(runs)
+        self.records = [_Records(origins, os.path.join(
+                                     conversion.timings,
+                                     '%d.txt' % (n * self.group)))
+                        for n, origins in enumerate(conversion.origins)]
+        # The blocks done and the records written of every group.
+        self.done = [0] * len(self.records)
+        self.written = [0] * len(self.records)
+        self.inside = [False] * len(self.records)
+        self.ended = [False] * len(self.records)
+        self.out = open(conversion.export, 'w')
+
+    def feed(self, i, text):
+        """Takes the ``text`` that run ``i`` printed."""
+        with self.lock:
+            self.fed[i] = True
+            self.streams[i].feed(text)
+            self._update(i // self.group)
+            self._write()
+
+    def close(self, stdouts):
+        """Writes the rest of the records, given the ``stdouts`` of all of
+        the runs (only the ones that were not fed are used)."""
+        with self.lock:
+            if self.out.closed:
+                return
+            for i, stream in enumerate(self.streams):
+                if not stream.closed:
+                    if not self.fed[i]:
+                        stream.feed(stdouts[i])
+                    stream.close()
+            for n in range(len(self.records)):
+                self._update(n)
+            self._write()
+            self.out.close()
+        import shutil
+        shutil.rmtree(self.conversion.timings, ignore_errors=True)
+
+    def _update(self, n):
+        """Passes the blocks that every run of group ``n`` has printed on
+        to its records."""
+
+        conversion = self.conversion
+        streams = self.streams[n*self.group:(n+1)*self.group]
+        records = self.records[n]
+        while not records.closed:
+            k = self.done[n] + 1
+            if not all(stream.closed or k < stream.complete()
+                       for stream in streams):
+                return
+            if k >= streams[0].complete():
+                records.close()
+                return
+
+            prompt, raw = streams[0].blocks[k]
+            outputs = [[_docstr_ellipse_output(line, conversion.ellipse_memid,
+                                               conversion.ellipse_path,
+                                               conversion.max_line_width)
+                        for line in stream.blocks[k][1]]
+                       for stream in streams if k < len(stream.blocks)]
+            if len(outputs) == len(streams):
+                output = self._merge(outputs)
             else:
-                time.sleep(0.010)
-                print >> sys.stderr, line
-                time.sleep(0.010)
+                output = outputs[0]
+
+            lines = _Transcript()
+            lines.add(prompt, output)
+            if (conversion.max_output_lines or conversion.max_output_bytes or
+                conversion.collapse_repeats):
+                lines = _docstr_cap_output(lines, conversion.max_output_lines,
+                                           conversion.max_output_bytes,
+                                           conversion.collapse_repeats)
+            if conversion.ellipse_traceback:
+                lines = _docstr_ellipse_traceback(lines)
+
+            records.add(prompt, raw, list(lines[1:]))
+            for stream in streams:
+                if k < len(stream.blocks):
+                    stream.blocks[k] = None
+            self.done[n] = k
+
+    def _merge(self, outputs):
+        """Merges the ``outputs`` of the runs of a group like
+        :meth:`_Conversion.docstr` does."""
+        conversion = self.conversion
+        if conversion.ellipse_volatile and conversion.ellipse_volatile > 1:
+            n = conversion.ellipse_volatile
+            outputs = [_docstr_ellipse_outputs(outputs[i:i+n]) or outputs[i]
+                       for i in range(0, len(outputs), n)]
+        if len(outputs) > 1:
+            outputs = [_docstr_ellipse_outputs(outputs) or outputs[0]]
+        return outputs[0]
+
+    def _write(self):
+        """Writes the records of the main run that are done, with the
+        isolated sections in their place."""
+
+        main = self.records[0].records
+        while self.written[0] < len(main):
+            record = main[self.written[0]]
+            if record[0] == 'begin':
+                if not self._write_section(record[1]):
+                    return
+            elif record[0] != 'end':
+                self._write_record(*record)
+            self.written[0] += 1
+
+    def _write_section(self, n):
+        """Writes the records of isolated section ``n`` that are done and
+        returns whether that was all of them."""
+
+        if n >= len(self.records) or self.ended[n]:
+            return True
+        records = self.records[n].records
+        while self.written[n] < len(records):
+            record = records[self.written[n]]
+            self.written[n] += 1
+            if record == ('begin', n):
+                self.inside[n] = True
+            elif record == ('end', n):
+                self.ended[n] = True
+                break
+            elif self.inside[n] and record[0] not in ('begin', 'end'):
+                self._write_record(*record)
+        return self.ended[n] or self.records[n].closed
+
+    def _write_record(self, statement, record):
+        record['section'] = self.conversion.section_titles.get(id(statement))
+        self.out.write(self.json.dumps(record, sort_keys=True) + '\n')
+        self.out.flush()
+
+class _Records(object):
+    """Makes the ``(statement, record)`` pairs of the ``export`` records of
+    one interpreter run out of its blocks, given the ``origins`` (the
+    statement of each input line, see :func:`_input_render`) and the
+    ``path`` of the file the interpreter writes the start time of every
+    '>>> ' prompt to.  The shard marker comments are kept as ``('begin',
+    n)`` / ``('end', n)`` pairs.
+
+    The record of a statement is added to ``records`` once the block of
+    the next statement is added, or sooner if the input shows that the
+    next block starts another statement.
+
+    """
 
-            if intraceback is None:
-                intraceback = False
+    def __init__(self, origins, path):
+        self.origins = origins
+        self.path = path
+        self.times = []
+        self.times_offset = 0
+        self.times_rest = ''
+        self.records = []
+        self.closed = False
+        self.current = None
+        self.prompt = -1
+        self.k = 0
+
+    def add(self, line, raw, output):
+        """Adds the block of prompt ``line``, with its ``raw`` output and the
+        ``output`` as put in the docstr."""
+
+        begin, end = _SHARD_BEGIN.split('%')[0], _SHARD_END.split('%')[0]
+        origins = self.origins
+
+        k = self.k
+        self.k += 1
+        if line.startswith('>>> '):
+            self.prompt += 1
+        statement = origins[k] if k < len(origins) else None
+
+        current = self.current
+        if current and (statement is current[0] or statement is None or
+                        statement.kind == 'blank'):
+            # More of the statement, or the blank line that ends it.
+            current[1].extend(raw)
+            current[2].extend(output)
+        else:
+            if current:
+                self._record()
+            if statement is None:
+                pass
+            elif statement.kind in ('code', 'compound') and statement.start:
+                # (statements that were not in the src have no start line)
+                self.current = [statement, list(raw), list(output),
+                                self.prompt]
+            elif statement.kind == 'comment' and statement.start == 0:
+                text = statement.lines[0]
+                if text.startswith(begin):
+                    self.records.append(('begin', int(text[len(begin):])))
+                elif text.startswith(end):
+                    self.records.append(('end', int(text[len(end):])))
+
+        following = origins[k+1] if k + 1 < len(origins) else None
+        if (self.current and following is not None and
+            following is not self.current[0] and following.kind != 'blank'):
+            self._read_times()
+            if len(self.times) > self.current[3] + 1:
+                self._record()
+
+    def close(self):
+        """There are no more blocks."""
+        if self.current:
+            self._record(True)
+        self.closed = True
+
+    def _read_times(self, final=False):
+        if not os.path.isfile(self.path):
+            return
+        # (opened again every time, the end of a file is sticky in Python 2)
+        times_file = open(self.path)
+        try:
+            times_file.seek(self.times_offset)
+            text = times_file.read()
+            self.times_offset = times_file.tell()
+        finally:
+            times_file.close()
+        lines = (self.times_rest + text).split('\n')
+        self.times_rest = '' if final else lines.pop()
+        self.times.extend(float(line) for line in lines if line.strip())
+
+    def _record(self, final=False):
+        self._read_times(final)
+        statement, raw, output, prompt = self.current
+        self.current = None
+
+        while raw and not raw[-1]:
+            raw.pop()
+        while output and not output[-1]:
+            output.pop()
+        exception = None
+        if raw and any(line.startswith('Traceback (most recent call last)')
+                       or line.startswith('  File "<stdin>"') for line in raw):
+            match = _RE_EXCEPTION.match(raw[-1])
+            if match:
+                exception = match.group(1)
+        times = self.times
+        started = duration = None
+        if prompt < len(times):
+            started = times[prompt]
+        if prompt + 1 < len(times):
+            duration = round(times[prompt+1] - times[prompt], 6)
+        self.records.append((statement, {'source': '\n'.join(statement.lines),
+                                         'start': statement.start,
+                                         'end': statement.end,
+                                         'raw_output': '\n'.join(raw),
+                                         'output': '\n'.join(output),
+                                         'exception': exception,
+                                         'started': started,
+                                         'duration': duration}))
+
+def _docstr_merge_runs(variants):
+    """Merges the docstr lines of several runs of the same input.
+
+    The runs are split up at the input lines, and where the output of a
+    statement differs between the runs the differing part is replaced by
+    '...' (e.g. ``set([3, 1, 2])`` and ``set([1, 2, 3])`` become
+    ``set([...])``).  A line can not start with '...' right after the
+    input (|doctest| would take it for more input), so in that case the
+    output of the first run is kept.
+
+    Returns the merged lines and a list of ``(input line, outputs,
+    merged)`` for every statement whose output differs (``merged`` is
+    ``None`` if it could not be ellipsed).  If the runs did not see the
+    same input, the lines of the first run and ``None`` are returned.
+
+    """
 
-    return '\n'.join(docstrlines)
+    blocks = [_docstr_blocks(lines) for lines in variants]
+    if len(set(len(block) for block in blocks)) > 1:
+        return variants[0], None
+
+    lines = _Transcript()
+    differences = []
+    for parts in zip(*blocks):
+        outputs = [output for prompt, output in parts]
+        merged = _docstr_ellipse_outputs(outputs)
+        if merged is not outputs[0]:
+            differences.append((parts[0][0], outputs, merged))
+        lines.add(parts[0][0], merged or outputs[0])
+    return lines, differences
+
+def _docstr_blocks(lines):
+    """Splits docstr lines into ``(input line, output lines)`` pairs (the
+    first input line is ``None``, the output before it is the interpreter
+    header).  The blocks of a :class:`_Transcript` are already known."""
+    if isinstance(lines, _Transcript):
+        return lines.blocks()
+    blocks = [(None, [])]
+    for line in lines:
+        if line.startswith('>>> ') or line.startswith('... '):
+            blocks.append((line, []))
+        else:
+            blocks[-1][1].append(line)
+    return blocks
+
+def _docstr_ellipse_outputs(outputs):
+    """Returns one list of output lines that matches all of the ``outputs``
+    (with |doctest| ELLIPSIS), or ``None`` if there is no good one."""
+
+    first = outputs[0]
+    if all(output == first for output in outputs):
+        return first
+
+    # Lines at the start and the end that are the same in every run.
+    size = min(len(output) for output in outputs)
+    head = 0
+    while head < size and all(output[head] == first[head]
+                              for output in outputs):
+        head += 1
+    tail = 0
+    while tail < size - head and all(output[-tail-1] == first[-tail-1]
+                                     for output in outputs):
+        tail += 1
+
+    middles = [output[head:len(output)-tail] for output in outputs]
+    if len(set(len(middle) for middle in middles)) == 1:
+        middle = [_docstr_ellipse_line(lines) for lines in zip(*middles)]
+    else:
+        middle = ['...']
+
+    lines = first[:head]
+    for line in middle:
+        if not line.startswith('...'):
+            lines.append(line)
+        elif not lines:
+            return None
+        elif not lines[-1].endswith('...'):
+            # '...' also matches the newline, so tack it on to the line
+            # before.
+            lines[-1] = _docstr_add_ellipse(lines[-1])
+    return lines + first[len(first)-tail:]
+
+_RE_WORD_END = re.compile(r'\w+\Z')
+_RE_WORD_START = re.compile(r'\A\w+')
+def _docstr_ellipse_line(lines):
+    """Returns the common start and end of ``lines`` with '...' in
+    between (or the line itself if they are all the same).  A word that
+    is only partly in common (the '12' of '123' and '124') is ellipsed
+    too, it is the same by chance."""
+    if len(set(lines)) == 1:
+        return lines[0]
+    prefix = os.path.commonprefix(lines)
+    size = min(len(line) for line in lines) - len(prefix)
+    suffix = os.path.commonprefix([line[::-1] for line in lines])[:size]
+    prefix = _RE_WORD_END.sub('', prefix)
+    suffix = _RE_WORD_START.sub('', suffix[::-1].lstrip('.'))
+    return '%s%s' % (_docstr_add_ellipse(prefix), suffix)
+
+def _docstr_add_ellipse(text):
+    """Returns ``text`` followed by '...'.  The dots it ends with are
+    left out (the ellipse matches them): |doctest| would take the first
+    three dots of '0....' as the ellipse, and then want a '.' at the
+    end."""
+    return '%s...' % text.rstrip('.')
+
+def _docstr_process_examples(docstrlines, fns):
+    """Calls each of the ``fns`` (see the ``fn_process_example`` parameter
+    of :func:`convert`) on the output of every statement in
+    ``docstrlines`` and returns the new lines."""
+
+    blocks = _docstr_blocks(docstrlines)
+    lines = _Transcript()
+    lines.add(None, blocks[0][1])
+
+    # Put the '... ' blocks together with the '>>> ' one they belong to.
+    statements = []
+    for prompt, output in blocks[1:]:
+        if prompt.startswith('... ') and statements:
+            statements[-1][0].append(prompt)
+            statements[-1][1].extend(output)
+        else:
+            statements.append(([prompt], list(output)))
+
+    section = None
+    sources = [[prompt[4:] for prompt in prompts]
+               for prompts, output in statements]
+    for k, (prompts, output) in enumerate(statements):
+        source = sources[k]
+        if (source[0].startswith('#>') and k + 1 < len(sources) and
+            _RE_SECTION_UNDERLINE.match(sources[k+1][0])):
+            section = source[0][2:].strip()
+
+        # Only the statements of the src go to the functions.
+        if (all(not line.strip() or line.lstrip().startswith('#')
+                for line in source) or
+            (k == len(statements) - 1 and source == ['raise SystemExit'])):
+            for prompt in prompts[:-1]:
+                lines.add(prompt, ())
+            lines.add(prompts[-1], output)
+            continue
+
+        for fn in fns:
+            new = fn(source, output, section)
+            if new is not None:
+                output = new
+
+        for prompt in prompts[:-1]:
+            lines.add(prompt, ())
+        lines.add(prompts[-1], output)
+    return lines
 
 def _match_input_to_output(inputlines, outputline):
+    """Splits an ``outputline`` at its prompts, putting the next of the
+    ``inputlines`` (an iterator, shared by all of the output lines) after
+    each of them."""
 
     has_input = True
 
     while has_input:
         if outputline.startswith('>>> ') or outputline.startswith('... '):
-            if inputlines:
-                yield "%s%s" % (outputline[0:4], inputlines.pop(0),)
+            inputline = next(inputlines, None)
+            if inputline is not None:
+                yield "%s%s" % (outputline[0:4], inputline,)
                 outputline = outputline[4:]
             else:
                 yield ""
@@ -430,25 +2081,34 @@ def _docstr_get_title():
     return "\n%s\nAuto generated by mod2doctest on %s\n%s" % \
            ('='*80, time.ctime(), '='*80)
 
-def _docstr_save(docstr, src, target, input, add_testmod):
+def _target_path(src, target):
+    """Returns the path of the file the docstr is saved to (see the
+    ``target`` parameter of :func:`convert`)."""
 
-    if inspect.ismodule(src):
+    if isinstance(src, types.ModuleType):
         src = src.__file__
     elif not isinstance(src, str):
-        raise SystemError, "Unknown src type %s ..." % src
+        raise SystemError("Unknown src type %s ..." % src)
 
     if target is True:
-        target = src
+        return src
     elif isinstance(target, str):
         if target.startswith('_'):
-            target = '%s%s.py' % (src.replace('.py', ''), target)
+            return '%s%s.py' % (src.replace('.py', ''), target)
+        return target
+    else:
+        raise SystemError("Unknown target type %s ..." % target)
+
+def _docstr_save(docstr, src, target, input, add_testmod):
+
+    path = _target_path(src, target)
+
+    if target is not True:
         # Then, if target a string (not True) it is different than the src
         # Therefore, blank out the input so we just get a docstring.
         input = ''
-    else:
-        raise SystemError, "Unknown target type %s ..." % target
 
-    if add_testmod and src is not target:
+    if add_testmod and target is not True:
         if add_testmod is True:
             add_testmod  = _ADD_TESTMOD_STR % DEFAULT_DOCTEST_FLAGS
     else:
@@ -458,37 +2118,187 @@ def _docstr_save(docstr, src, target, input, add_testmod):
                               add_testmod,
                               input)
 
-    open(target, 'w').write(output)
+    open(path, 'w').write(output)
+
+    return path
+
+_RE_SAVED_DOCSTR = re.compile(r"^\s*[rR]?'''(.*?)'''", flags=re.DOTALL)
+_RE_DOCSTR_TAIL = re.compile(r"(?:\n(?:>>>|\.\.\.)[ \t]*)*"
+                             r"(?:\n>>> raise SystemExit)?\s*\Z")
+_RE_DOCSTR_UNDERLINE = re.compile(r'^([=\-+~*^#"`])\1+\s*$')
+def _docstr_split_sections(docstr, titles):
+    """Splits a docstr (without the quotes) at the section ``titles``.
 
-    return target
+    Returns the text before the first title, a dict mapping the section
+    number to its text, and the text after the last section (the trailing
+    ``>>> raise SystemExit`` etc.).
+
+    """
+
+    lines = docstr.split('\n')
+    titles = [title.strip() for title in titles]
+    chunks = {0: []}
+    current = 0
+    for i, line in enumerate(lines):
+        title = line.strip()
+        if (title in titles[current:] and i + 1 < len(lines) and
+            _RE_DOCSTR_UNDERLINE.match(lines[i+1])):
+            current = titles.index(title, current) + 1
+            chunks[current] = []
+        chunks[current].append(line)
+
+    chunks = dict((n, '\n'.join(chunk)) for n, chunk in chunks.items())
+    tail = _RE_DOCSTR_TAIL.search(chunks[current])
+    chunks[current] = chunks[current][:tail.start()]
+    return chunks.pop(0), chunks, tail.group(0)
+
+def _docstr_merge_sections(docstr, old_docstr, titles, numbers):
+    """Returns ``docstr`` (a new docstr in which only the sections in
+    ``numbers`` were run) with the other sections copied over verbatim from
+    ``old_docstr``."""
+
+    head, new, tail = _docstr_split_sections(docstr[3:-3], titles)
+    old = _docstr_split_sections(old_docstr, titles)[1]
+
+    chunks = [head]
+    for n in range(1, len(titles) + 1):
+        if n in numbers and n in new:
+            chunks.append(new[n])
+        elif n in old:
+            chunks.append(old[n])
+    chunks = [chunk.rstrip('\n') for chunk in chunks]
+    return "'''%s%s'''" % ('\n\n'.join(chunks), tail)
+
+def _docstr_layout_sections(docstr, titles, tags):
+    """Returns ``docstr`` in the ``layout='sections'`` form (see
+    :func:`convert`): the fixture docstring (with the quotes) followed by
+    the ``__test__`` dict.  The tail (``>>> raise SystemExit`` ...) is
+    left out."""
+
+    head, chunks, tail = _docstr_split_sections(docstr[3:-3], titles)
+    fixture = [head.rstrip('\n')]
+    entries = []
+    width = len(str(len(titles)))
+    for n in sorted(chunks):
+        chunk = chunks[n].strip('\n')
+        if 'setup' in tags[n-1]:
+            fixture.append(chunk)
+            continue
+        name = '%0*d %s' % (width, n, titles[n-1])
+        if 'isolated' in tags[n-1]:
+            name += ' [isolated]'
+        entries.append("    %r: r'''\n%s\n\n'''," % (name, chunk))
+
+    text = "'''%s\n\n'''" % '\n\n'.join(fixture)
+    if entries:
+        text += '\n\n__test__ = {\n%s\n}\n' % '\n'.join(entries)
+    return text
+
+_RE_TEST_DICT = re.compile(r'^__test__ = \{', flags=re.MULTILINE)
+_RE_TEST_ENTRY = re.compile(r"^    ('(?:[^'\\\n]|\\.)*'|"
+                            r"\"(?:[^\"\\\n]|\\.)*\"): "
+                            r"[rR]'''(.*?)'''",
+                            flags=re.MULTILINE | re.DOTALL)
+def _load_sections(text):
+    """Returns the fixture ``(docstr, lineno)`` of a target saved with
+    ``layout='sections'`` and its ``__test__`` entries as ``(name, docstr,
+    lineno)`` in section order (``lineno`` is the 0-based line the string
+    starts on)."""
+
+    import ast
+
+    match = _RE_SAVED_DOCSTR.match(text)
+    fixture = (match.group(1), text.count('\n', 0, match.start(1))) \
+              if match else ('', 0)
+    entries = []
+    test = _RE_TEST_DICT.search(text)
+    if test:
+        for entry in _RE_TEST_ENTRY.finditer(text, test.end()):
+            entries.append((ast.literal_eval(entry.group(1)), entry.group(2),
+                            text.count('\n', 0, entry.start(2))))
+    entries.sort(key=lambda entry: int(entry[0].split()[0]))
+    return fixture, entries
+
+def _saved_docstr(text, titles):
+    """Returns the docstr (without the quotes) saved in ``text`` (the
+    content of a target), or ``None`` if it has none.  The sections of a
+    ``layout='sections'`` target are put back in order."""
+
+    match = _RE_SAVED_DOCSTR.match(text)
+    if not match:
+        return None
+    fixture, entries = _load_sections(text)
+    if not entries:
+        return match.group(1)
+
+    head, chunks, tail = _docstr_split_sections(fixture[0], titles)
+    for name, docstr, lineno in entries:
+        chunks[int(name.split()[0])] = docstr
+    return '%s\n\n' % '\n\n'.join([head.rstrip('\n')] +
+                                    [chunks[n].strip('\n')
+                                     for n in sorted(chunks)])
 
 _RE_ELLIPSE_MEM_ID = re.compile(r'<(?:(?:\w+\.)*)(.*? at 0x)\w+>')
 def _docstr_ellipse_mem_id(line):
+    if ' at 0x' not in line:
+        return line
     return _RE_ELLIPSE_MEM_ID.sub(r'<...\1...>', line)
 
-_RE_LOCAL_PATH = re.compile(r"""
-                             (?:\S*(?:[/\\][^\s/\\]+)+)
-a                            ([/\\][^\s/\\]+)
-                             """, flags=re.VERBOSE)
+_RE_SPACE = re.compile(r'(\s+)')
+_RE_PATH_SEP = re.compile(r'([/\\])')
 def _docstr_ellipse_paths(line):
-    return _RE_LOCAL_PATH.sub(r'...\1', line)
+    r"""Replaces the start of every word of ``line``, up to the separator
+    after its last part (of two or more characters) that ends with 'a' and
+    has another part after it, by '...'.
 
-_RE_ELLIPSE_TRACEBACK = re.compile(r"""
-                                    (\nTraceback \(most recent call last\):)
-                                    (?:(?:\n[ |\t]+.*)*)
-                                    (\n\w+.*)
-                                    """, flags=re.MULTILINE | re.VERBOSE)
-def _docstr_ellipse_traceback(docstr):
-    return _RE_ELLIPSE_TRACEBACK.sub(r'\1\n    ...\2', docstr)
+    It matches like ``(?:\S*(?:[/\\][^\s/\\]+)+)a([/\\][^\s/\\]+)``
+    (replaced by ``...\1``) but takes a time linear in the length of the
+    line, the regex backtracks over every start of a long word.
+
+    """
+    if '/' not in line and '\\' not in line:
+        return line
+    words = _RE_SPACE.split(line)
+    for i in range(0, len(words), 2):
+        parts = _RE_PATH_SEP.split(words[i])
+        # parts[k] is a part, parts[k-1] the separator before it.
+        for k in range(len(parts) - 3, 1, -2):
+            if (len(parts[k]) > 1 and parts[k].endswith('a') and
+                parts[k+2]):
+                words[i] = '...' + ''.join(parts[k+1:])
+                break
+    return ''.join(words)
+
+_RE_TRACEBACK_INDENT = re.compile(r'[ |\t]')
+_RE_TRACEBACK_END = re.compile(r'\w')
+def _docstr_ellipse_traceback(lines):
+    """Replaces the stack (the indented lines) of every traceback in the
+    docstr ``lines`` by an ellipse, keeping the first and the last line."""
+
+    ellipsed = []
+    i, size = 0, len(lines)
+    while i < size:
+        line = lines[i]
+        ellipsed.append(line)
+        i += 1
+        if line == 'Traceback (most recent call last):' and i > 1:
+            end = i
+            while end < size and _RE_TRACEBACK_INDENT.match(lines[end]):
+                end += 1
+            if end < size and _RE_TRACEBACK_END.match(lines[end]):
+                ellipsed.append('    ...')
+                ellipsed.append(lines[end])
+                i = end + 1
+    return ellipsed
 
 
 _RE_PRINT_MARKER = re.compile(r'(?:>>>|...)\s#[>|]')
-def _process_docstr_markers(docstr):
+def _process_docstr_markers(docstrlines):
 
     lines = []
     in_print = False
 
-    for line in docstr.split('\n'):
+    for line in docstrlines:
         if _RE_PRINT_MARKER.match(line):
             if in_print is False:
                 lines.append('')
@@ -508,14 +2318,14 @@ def _process_docstr_markers(docstr):
 
         lines.append(line)
 
-    return '\n'.join(lines)
+    return lines
 
-def _docstr_clean_blanklines(docstr):
+def _docstr_clean_blanklines(docstrlines):
 
     lines = []
 
     extra_marker = None
-    for line in docstr.split('\n'):
+    for line in docstrlines:
         test = line.strip()
         if test == '>>>' or test == '...':
             extra_marker = line
@@ -525,10 +2335,281 @@ def _docstr_clean_blanklines(docstr):
             extra_marker = None
             lines.append(line)
 
-    return '\n'.join(lines)
+    return lines
+
+def _docstr_strip(lines, left=True, right=True):
+    """Returns the docstr ``lines`` as ``'\\n'.join(lines).strip()`` (or
+    ``lstrip()`` / ``rstrip()``) would split them."""
+
+    start, end = 0, len(lines)
+    if left:
+        while start < end and not lines[start].strip():
+            start += 1
+    if right:
+        while end > start and not lines[end-1].strip():
+            end -= 1
+    lines = lines[start:end]
+    if lines and left:
+        lines[0] = lines[0].lstrip()
+    if lines and right:
+        lines[-1] = lines[-1].rstrip()
+    return lines
+
+def _run_doctest(target, doctest_flags, cache=None):
+    # (not doctest.testfile, which wants a path relative to this module)
+    verify(target, doctest_flags, cache)
+
+def verify(target, doctest_flags=DEFAULT_DOCTEST_FLAGS, cache=None,
+           jobs=None):
+    """
+    :summary: Runs |doctest| on the ``target`` file (e.g. one saved by
+              :func:`convert`) and returns ``doctest.TestResults(failed,
+              attempted)``.  Failures are reported like
+              :func:`doctest.testfile` does.
+
+    :param target: Path of the file (relative to the current directory).
+    :type target:  str
+
+    :param doctest_flags: Valid OR'd together :mod:`doctest` flags.
+    :type doctest_flags:  :mod:`doctest` flags
+
+    :param cache: A directory used to cache the |doctest| examples, keyed
+                  by a hash of the file content, so an unchanged file is
+                  not parsed again.  If an unchanged file already passed
+                  with the same Python (version, executable, ``sys.path``)
+                  and flags, and none of the modules that were loaded when
+                  it passed changed (size or modification time of their
+                  files), it is not run at all; ``TestResults(0, n)`` is
+                  returned right away.
+    :type cache:  None or str directory path
+
+    :param jobs: For a file saved with ``layout='sections'`` (see
+                 :func:`convert`): run the ``[isolated]`` sections in this
+                 many processes at once.
+    :type jobs:  None or int
+    """
 
-def _run_doctest(target, doctest_flags):
-    doctest.testfile(target, optionflags=doctest_flags)
+    import doctest
+    import hashlib
+    import json
+    import marshal
+    import zlib
+
+    text = open(target, 'r').read()
+    name = os.path.basename(target)
+    sections = _RE_TEST_DICT.search(text) is not None
+
+    if cache is None and sections:
+        return _verify_sections(target, text, doctest_flags, jobs)
+    elif cache is None:
+        examples = _parse_examples(text, name)
+        return _run_examples(examples, text, name, target, doctest_flags)
+
+    key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+    environment = hashlib.sha1(repr((sys.version, sys.executable,
+                                     sys.platform, sys.path,
+                                     doctest_flags)).encode('utf-8'))
+    # The marshal format is not the same in every Python version.
+    examples_path = os.path.join(cache, '%s-py%d%d.examples'
+                                 % ((key,) + tuple(sys.version_info[:2])))
+    passed_path = os.path.join(cache, '%s-%s.passed'
+                               % (key, environment.hexdigest()))
+
+    passed = _load_passed(passed_path)
+    if passed is not None:
+        return doctest.TestResults(0, passed)
+
+    files = set()
+    if sections:
+        results = _verify_sections(target, text, doctest_flags, jobs, files)
+    else:
+        examples = _load_examples(examples_path)
+        if examples is None:
+            examples = _parse_examples(text, name)
+            _save(examples_path, zlib.compress(marshal.dumps(
+                [(e.source, e.want, e.exc_msg, e.lineno, e.indent, e.options)
+                 for e in examples])))
+        results = _run_examples(examples, text, name, target, doctest_flags)
+    if not results.failed:
+        files.update(_module_files())
+        _save(passed_path, json.dumps(
+            {'attempted': results.attempted,
+             'files': _file_stamps(sorted(files))}).encode('ascii'))
+    return results
+
+def _load_passed(path):
+    """Returns the number of examples of the ``.passed`` file at ``path``,
+    or ``None`` if there is none or one of the files it lists changed."""
+    import json
+
+    try:
+        passed = json.loads(open(path).read())
+        if _file_stamps([stamp[0] for stamp in passed['files']]) == \
+           passed['files']:
+            return passed['attempted']
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+def _module_files():
+    """Returns the files (the sources if they are there) of the modules
+    that are loaded."""
+    files = set()
+    for module in list(sys.modules.values()):
+        path = getattr(module, '__file__', None)
+        if not path:
+            continue
+        if path[-4:] in ('.pyc', '.pyo') and os.path.isfile(path[:-1]):
+            path = path[:-1]
+        files.add(os.path.abspath(path))
+    return files
+
+def _file_stamps(paths):
+    """Returns ``[path, size, mtime]`` for each of ``paths`` (``[path, None,
+    None]`` if it does not exist)."""
+    stamps = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamps.append([path, stat.st_size, stat.st_mtime])
+        except OSError:
+            stamps.append([path, None, None])
+    return stamps
+
+def _run_examples(examples, text, name, target, doctest_flags):
+    """Runs the examples like :func:`doctest.testfile` does."""
+    import doctest
+
+    test = doctest.DocTest(examples, {'__name__': '__main__'}, name, target,
+                           0, text)
+    runner = doctest.DocTestRunner(verbose=False, optionflags=doctest_flags)
+    runner.run(test)
+    runner.summarize()
+    return doctest.TestResults(runner.failures, runner.tries)
+
+def _verify_sections(target, text, doctest_flags, jobs=None, files=None):
+    """Runs a target saved with ``layout='sections'``: the fixture once,
+    then the ``__test__`` entries in order on its globals, except the
+    ``[isolated]`` ones, which each get a fresh fixture (in a pool of
+    ``jobs`` processes if ``jobs`` is more than 1).  Prints the failures
+    and a summary per entry like :func:`doctest.testmod` does.  The files
+    of the modules loaded by the worker processes are added to the
+    ``files`` set."""
+
+    import doctest
+
+    fixture, entries = _load_sections(text)
+    name = os.path.basename(target)
+    globs = {'__name__': '__main__'}
+    results = [(name,) + _run_test(fixture[0], globs, name, target,
+                                   fixture[1], doctest_flags)]
+
+    isolated = []
+    for name, docstr, lineno in entries:
+        if name.endswith('[isolated]'):
+            isolated.append((target, fixture, name, docstr, lineno,
+                             doctest_flags))
+        else:
+            results.append((name,) + _run_test(docstr, globs, name, target,
+                                               lineno, doctest_flags))
+
+    if jobs and jobs > 1 and len(isolated) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(min(jobs, len(isolated)))
+        try:
+            outcomes = pool.map(_verify_isolated, isolated)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        outcomes = [_verify_isolated(args) for args in isolated]
+    for name, failed, attempted, report, loaded in outcomes:
+        sys.stdout.write(report)
+        results.append((name, failed, attempted))
+        if files is not None:
+            files.update(loaded)
+
+    failures = [result for result in results if result[1]]
+    if failures:
+        print('%d items had failures:' % len(failures))
+        for name, failed, attempted in failures:
+            print(' %3d of %3d in %s' % (failed, attempted, name))
+        print('***Test Failed*** %d failures.'
+              % sum(result[1] for result in failures))
+    return doctest.TestResults(sum(result[1] for result in results),
+                               sum(result[2] for result in results))
+
+def _verify_isolated(args):
+    """Runs an ``[isolated]`` entry on a fresh fixture (in a worker process
+    of :func:`_verify_sections`) and returns ``(name, failed, attempted,
+    report, module files)``.  Failures of the fixture are reported by the
+    caller."""
+
+    target, fixture, name, docstr, lineno, doctest_flags = args
+    globs = {'__name__': '__main__'}
+    _run_test(fixture[0], globs, name, target, fixture[1], doctest_flags,
+              out=lambda text: None)
+    report = []
+    failed, attempted = _run_test(docstr, globs, name, target, lineno,
+                                  doctest_flags, out=report.append)
+    return name, failed, attempted, ''.join(report), sorted(_module_files())
+
+def _run_test(docstr, globs, name, target, lineno, doctest_flags, out=None):
+    """Runs the examples of ``docstr`` on ``globs`` (which are kept for
+    the next test) and returns ``(failed, attempted)``."""
+    import doctest
+
+    test = doctest.DocTestParser().get_doctest(docstr, globs, name, target,
+                                               lineno)
+    runner = doctest.DocTestRunner(verbose=False, optionflags=doctest_flags)
+    runner.run(test, out=out, clear_globs=False)
+    # (the test ran on a copy of ``globs``)
+    globs.update(test.globs)
+    return runner.failures, runner.tries
+
+def _parse_examples(text, name):
+    """Returns the |doctest| examples of ``text``, without the ``>>> raise
+    SystemExit`` that ends the docstring of a default layout target (the
+    run was ended with it, it is not a test)."""
+    import doctest
+
+    examples = doctest.DocTestParser().get_examples(text, name)
+    if examples and examples[-1].source == 'raise SystemExit\n':
+        examples.pop()
+    return examples
+
+def _load_examples(path):
+    """Returns the cached examples at ``path`` (``None`` if there are
+    none or they cannot be read)."""
+    import doctest
+    import marshal
+    import zlib
+
+    try:
+        data = marshal.loads(zlib.decompress(open(path, 'rb').read()))
+    except (IOError, OSError, ValueError, EOFError, TypeError, zlib.error):
+        return None
+    return [doctest.Example(source, want, exc_msg, lineno, indent, options)
+            for source, want, exc_msg, lineno, indent, options in data]
+
+def _save(path, data):
+    """Writes ``data`` (bytes) to ``path``, so that another process never
+    sees half of it."""
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    temp = '%s.%d.tmp' % (path, os.getpid())
+    open(temp, 'wb').write(data)
+    if hasattr(os, 'replace'):
+        os.replace(temp, path)
+    else:
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(temp, path)
 
 
 
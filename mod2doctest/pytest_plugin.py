@@ -0,0 +1,247 @@
+"""A pytest plugin that checks saved docstrings against the modules they were
+made from, without writing anything::
+
+    pytest --mod2doctest tests/
+    pytest --mod2doctest -n auto tests/         # with pytest-xdist
+
+Every module with a ``mod2doctest.convert(...)`` call in its ``if __name__
+== '__main__'`` block (and a ``target``) is collected.  The call is read,
+not run: its arguments must be literals (a module where they are not is
+reported as a collection error of its own), and ``python_cmd`` can be
+overridden with the ``mod2doctest_python`` ini option.
+
+Each ``#>`` section is a test item of its own (plus one for the code
+before the first section) that compares the section of the new docstring
+with the same section of the saved one, so a failure points at a section.
+The module is run once for all of its items, only up to the last section
+that is selected (see the ``until`` parameter of
+:func:`mod2doctest.convert`); with pytest-xdist each worker that is given
+sections of a module runs it once.  The autogen title (with its
+date) is not compared.  Targets saved with ``layout='sections'`` are
+read back section by section.
+
+An item that passed is not run again until the module, the saved file,
+the options or |mod2doctest| change (the key is kept in the pytest cache,
+``--cache-clear`` forgets it), or any of the files of the modules the
+interpreters loaded when it passed does.
+
+"""
+
+import os
+import re
+import json
+import hashlib
+import difflib
+
+import pytest
+
+from .mod2doctest import convert
+from .mod2doctest import _Conversion
+from .mod2doctest import _input_parse
+from .mod2doctest import _input_sections
+from .mod2doctest import _section_title
+from .mod2doctest import _target_path
+from .mod2doctest import _run_interpreters
+from .mod2doctest import _docstr_split_sections
+from .mod2doctest import _saved_docstr
+from .mod2doctest import _file_stamps
+
+# convert() arguments that are about running, not about the docstring.
+_IGNORED = set(['src', 'target', 'run_doctest', 'doctest_cache', 'export',
+                'profile', 'sections', 'until'])
+
+def pytest_addoption(parser):
+    group = parser.getgroup('mod2doctest')
+    group.addoption('--mod2doctest', action='store_true', default=False,
+                    help="check the saved docstrings of the modules that "
+                         "call mod2doctest.convert()")
+    parser.addini('mod2doctest_python',
+                  "python_cmd to use instead of the one in the "
+                  "mod2doctest.convert() calls")
+
+def pytest_collect_file(parent, file_path):
+    # (the call is read in collect(), so a bad one is an error of the file)
+    if (parent.config.getoption('mod2doctest') and
+        file_path.suffix == '.py' and
+        'mod2doctest.convert(' in file_path.read_text()):
+        return Mod2DoctestFile.from_parent(parent, path=file_path)
+
+_RE_CONVERT = re.compile(r'\bmod2doctest\.convert\(')
+def _convert_call(source):
+    """Returns the ``(python_cmd, kwargs)`` of the ``mod2doctest.convert()``
+    call in the ``__main__`` blocks of ``source`` (``None`` if there is
+    none).  Raises :exc:`ValueError` if the arguments are not literals."""
+
+    import ast
+
+    for statement in _input_parse(source):
+        if statement.kind != 'main':
+            continue
+        text = '\n'.join(statement.lines)
+        match = _RE_CONVERT.search(text)
+        if not match:
+            continue
+
+        # The call ends at the bracket that closes the one it opens.
+        depth = 0
+        for end in range(match.end() - 1, len(text)):
+            depth += {'(': 1, ')': -1}.get(text[end], 0)
+            if not depth:
+                break
+        call = ast.parse(text[match.start():end + 1].strip(),
+                         mode='eval').body
+
+        names = convert.__code__.co_varnames[:convert.__code__.co_argcount]
+        kwargs = dict(zip(names, [ast.literal_eval(arg)
+                                  for arg in call.args]))
+        for keyword in call.keywords:
+            kwargs[keyword.arg] = ast.literal_eval(keyword.value)
+        return kwargs.pop('python_cmd', 'python'), kwargs
+    return None
+
+class Mod2DoctestFile(pytest.File):
+    """A module with a ``mod2doctest.convert()`` call."""
+
+    def collect(self):
+        source = self.path.read_text()
+        try:
+            call = _convert_call(source)
+        except (ValueError, SyntaxError) as e:
+            raise self.CollectError("the mod2doctest.convert() arguments "
+                                    "are not literals (%s)" % e)
+        if call is None:
+            return
+        python_cmd, kwargs = call
+
+        target = kwargs.get('target', '_doctest')
+        if not target:
+            return
+        src = str(self.path)
+        if isinstance(target, str) and not target.startswith('_'):
+            target = os.path.join(os.path.dirname(src), target)
+
+        self.python_cmd = (self.config.getini('mod2doctest_python') or
+                           python_cmd)
+        self.target = target
+        self.options = dict((name, value) for name, value in kwargs.items()
+                            if name not in _IGNORED)
+        self.titles = [_section_title(section) for section in
+                       _input_sections(_input_parse(source, src))[1:]]
+        self.docstrs = {}
+        self.files = {}
+
+        yield Mod2DoctestItem.from_parent(self, name='0 (preamble)',
+                                          number=0)
+        for number, title in enumerate(self.titles, 1):
+            yield Mod2DoctestItem.from_parent(self,
+                                              name='%d %s' % (number, title),
+                                              number=number)
+
+    def docstr(self, number):
+        """Returns a new docstr (without the quotes) with section ``number``
+        in it, and the set of files of the modules the interpreters loaded.
+
+        The module is run once, up to the last of its sections among the
+        items of the session (the sections before it may set up what it
+        needs).  A pytest-xdist worker collects all of the items and is
+        given some of them, so it runs the module as far as they go.
+
+        """
+
+        for done in sorted(self.docstrs):
+            if done >= number:
+                return self.docstrs[done], self.files[done]
+        until = max([number] + [item.number for item in self.session.items
+                                if item.parent is self])
+
+        import shutil
+        import tempfile
+
+        options = dict(self.options)
+        if until:
+            options['until'] = until
+        else:
+            options['sections'] = []
+        conversion = _Conversion(self.python_cmd, src=str(self.path),
+                                 target=self.target, **options)
+        conversion.modules = tempfile.mkdtemp(prefix='mod2doctest-')
+        try:
+            docstr = conversion.docstr(_run_interpreters(conversion.runs()))
+            self.files[until] = conversion.module_files()
+        finally:
+            shutil.rmtree(conversion.modules)
+        self.docstrs[until] = docstr[3:-3]
+        return self.docstrs[until], self.files[until]
+
+    def key(self, number, path):
+        """Returns the pytest cache key of section ``number``.  What it
+        depends on beyond the module and the saved file at ``path`` is
+        stored under the key (see :meth:`Mod2DoctestItem.runtest`)."""
+        sha1 = hashlib.sha1(json.dumps([self.python_cmd, self.options,
+                                        number],
+                                       sort_keys=True).encode('utf-8'))
+        here = os.path.dirname(os.path.abspath(__file__))
+        for filename in [str(self.path), path,
+                         os.path.join(here, 'mod2doctest.py'),
+                         os.path.join(here, '_startup.py')]:
+            sha1.update(open(filename, 'rb').read())
+        return 'mod2doctest/%s' % sha1.hexdigest()
+
+class Mod2DoctestMismatch(Exception):
+    """A section of the saved docstring differs from the new one."""
+
+_RE_AUTOGEN = re.compile(r'\n*=+\nAuto generated by mod2doctest on .*\n=+\n')
+class Mod2DoctestItem(pytest.Item):
+    """One section (0 is the code before the first section) of a module."""
+
+    def __init__(self, name, parent, number):
+        super(Mod2DoctestItem, self).__init__(name, parent)
+        self.number = number
+
+    def runtest(self):
+        path = _target_path(str(self.path), self.parent.target)
+        if not os.path.isfile(path):
+            raise Mod2DoctestMismatch('%s does not exist' % path)
+        saved = _saved_docstr(open(path, 'r').read(), self.parent.titles)
+        if saved is None:
+            raise Mod2DoctestMismatch('%s has no docstring' % path)
+
+        # The key stores the files the passing run loaded, and the pass only
+        # counts while none of them changed.
+        cache = getattr(self.config, 'cache', None)
+        key = self.parent.key(self.number, path)
+        if cache is not None:
+            passed = cache.get(key, None)
+            if (isinstance(passed, dict) and
+                passed.get('files') == _file_stamps(
+                    [stamp[0] for stamp in passed['files']])):
+                return
+
+        docstr, files = self.parent.docstr(self.number)
+        new = self._section(docstr)
+        old = self._section(saved)
+        if new != old:
+            diff = difflib.unified_diff(old.split('\n'), new.split('\n'),
+                                        path, 'new', lineterm='')
+            raise Mod2DoctestMismatch('\n'.join(diff))
+        if cache is not None:
+            cache.set(key, {'files': _file_stamps(sorted(files))})
+
+    def _section(self, docstr):
+        """Returns the text of this item's section of ``docstr``."""
+        head, sections, tail = _docstr_split_sections(docstr,
+                                                      self.parent.titles)
+        if self.number:
+            section = sections.get(self.number, '')
+        else:
+            section = _RE_AUTOGEN.sub('', head, count=1)
+        # (the blank lines at the end depend on what comes after it)
+        return section.rstrip().strip('\n')
+
+    def repr_failure(self, excinfo):
+        if isinstance(excinfo.value, Mod2DoctestMismatch):
+            return str(excinfo.value)
+        return super(Mod2DoctestItem, self).repr_failure(excinfo)
+
+    def reportinfo(self):
+        return self.path, None, '%s::%s' % (self.path.name, self.name)
@@ -0,0 +1,181 @@
+"""What |mod2doctest| tells the user while it works.
+
+:func:`mod2doctest.convert` and the batch workers (see
+:mod:`mod2doctest.batch`) hand their events to a reporter:
+
+``'quiet'`` (:class:`Reporter`)
+    Nothing at all.
+
+``'summary'`` (:class:`SummaryReporter`)
+    One line per module, and the warnings (output that differs between
+    runs ...).
+
+``'verbose'`` (:class:`VerboseReporter`)
+    The output and the ``#>`` comments of the module, like the module would
+    print them, then the summary line.  This is what ``convert`` does by
+    default.
+
+``'progress'`` (:class:`ProgressReporter`)
+    A single status line that is updated as modules are done (on a
+    terminal, one line per module elsewhere), for batch runs.
+
+Reporters buffer what they write and send it to one stream (stdout by
+default) in one go at the end of every module, so nothing waits on the
+console and the text of a module is not broken up by other output.  Pass a
+subclass instance as ``reporter`` for anything else.
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+
+class Reporter(object):
+    """Reports nothing, the base class of the other reporters.
+
+    :param stream: Where the text goes (``sys.stdout`` if ``None``, looked
+                   up when the text is written).
+    :type stream:  None or file
+
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self._buffer = []
+
+    def write(self, text):
+        """Adds ``text`` to the buffer."""
+        self._buffer.append(text)
+
+    def flush(self):
+        """Writes the buffer to the stream."""
+        if self._buffer:
+            stream = self.stream or sys.stdout
+            stream.write(''.join(self._buffer))
+            stream.flush()
+            del self._buffer[:]
+
+    def close(self):
+        """Called when there is nothing more to report."""
+        self.flush()
+
+    def transcript(self, docstrlines):
+        """The docstr lines of a module (before they are post processed)."""
+
+    def warning(self, message):
+        """Something the user should look at (``message`` can have several
+        lines)."""
+
+    def finish(self, result):
+        """A module is done.  ``result`` is a dict with the ``src``, the
+        ``target`` (or ``None``), the ``error`` (or ``None``) and the
+        ``seconds`` it took."""
+
+    def status(self, counts):
+        """The ``pending`` / ``claimed`` / ``done`` / ``failed`` counts of a
+        batch queue (see :func:`mod2doctest.batch.status`)."""
+
+class SummaryReporter(Reporter):
+    """One line per module, and the warnings."""
+
+    def warning(self, message):
+        self.write('mod2doctest: %s\n' % message)
+
+    def finish(self, result):
+        src = os.path.basename(result['src'])
+        if result.get('error'):
+            self.write('mod2doctest: %s failed: %s\n' % (src, result['error']))
+        else:
+            target = result.get('target')
+            self.write('mod2doctest: %s%s (%.2f s)\n'
+                       % (src, ' -> %s' % os.path.basename(target)
+                          if target else '', result.get('seconds') or 0))
+
+class VerboseReporter(SummaryReporter):
+    """The output and ``#>`` comments of every module, then the summary
+    line."""
+
+    def transcript(self, docstrlines):
+        startheader = True
+        for line in docstrlines:
+            if line.startswith('>>> #>') or line.startswith('... #>'):
+                if startheader:
+                    self.write('\n\n')
+                line = line[6:]
+                startheader = False
+            elif line.startswith('>>> ') or line.startswith('...'):
+                startheader = True
+                continue
+            self.write(line + '\n')
+
+class ProgressReporter(Reporter):
+    """A status line for batch runs, rewritten in place on a terminal."""
+
+    def __init__(self, stream=None):
+        super(ProgressReporter, self).__init__(stream)
+        self.done = 0
+        self.failed = 0
+        self._last = None
+        self._width = 0
+
+    def finish(self, result):
+        self.done += 1
+        if result.get('error'):
+            self.failed += 1
+            self.write(self._line('%s failed: %s' % (result['src'],
+                                                     result['error'])) + '\n')
+            self._width = 0
+        self._show('%d done (%d failed), last %s'
+                   % (self.done, self.failed,
+                      os.path.basename(result['src'])))
+
+    def status(self, counts):
+        self._show('%(done)d done (%(failed)d failed), %(claimed)d running, '
+                   '%(pending)d pending' % counts)
+
+    def close(self):
+        if self._width:
+            self.write('\n')
+            self._width = 0
+        super(ProgressReporter, self).close()
+
+    def _show(self, text):
+        if text == self._last:
+            return
+        self._last = text
+        if self._isatty():
+            self.write(self._line(text))
+            self._width = len(text)
+        else:
+            self.write(text + '\n')
+
+    def _line(self, text):
+        """Returns ``text`` to write over the status line (if any)."""
+        if not self._width:
+            return text
+        return '\r%s%s' % (text, ' ' * max(self._width - len(text), 0))
+
+    def _isatty(self):
+        stream = self.stream or sys.stdout
+        return hasattr(stream, 'isatty') and stream.isatty()
+
+REPORTERS = {
+    'quiet': Reporter,
+    'summary': SummaryReporter,
+    'verbose': VerboseReporter,
+    'progress': ProgressReporter,
+}
+
+def get_reporter(reporter):
+    """Returns a :class:`Reporter` for the ``reporter`` argument of
+    :func:`mod2doctest.convert`: a name from :data:`REPORTERS`, a reporter
+    (returned as is) or ``None`` (quiet)."""
+
+    if reporter is None:
+        return Reporter()
+    if isinstance(reporter, Reporter):
+        return reporter
+    if reporter in REPORTERS:
+        return REPORTERS[reporter]()
+    raise SystemError("Unknown reporter %r ..." % (reporter,))
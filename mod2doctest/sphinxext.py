@@ -0,0 +1,164 @@
+"""A Sphinx extension that converts modules while the docs are built, so
+their docstrings do not have to be made (and kept up to date) by hand.
+
+In ``conf.py``::
+
+    extensions = ['mod2doctest.sphinxext']
+    mod2doctest_python = 'python2.7'                # default: 'python'
+    mod2doctest_options = {'ellipse_memid': True}    # convert() kwargs
+
+and in the ``.rst`` files::
+
+    .. mod2doctest:: ../../tests/basicexample.py
+       :python: python3
+       :options: {"max_output_lines": 20}
+       :depends: ../../tests/data.txt
+       :literal:
+
+The path is relative to the ``.rst`` file (or to the source directory if
+it starts with ``/``).  ``:options:`` is a JSON object of
+:func:`mod2doctest.convert` keyword arguments, on top of
+``mod2doctest_options``.  The docstring is parsed as ReST (``#>`` titles
+become sections), or shown as an interactive session with ``:literal:``.
+
+Docstrings are cached (in ``mod2doctest_cache``, by default a
+``mod2doctest`` directory next to the doctrees) under a SHA-1 of the
+module, the ``:depends:`` files, the options and |mod2doctest| itself, so
+a module is only run again when one of those changed.  The pages that use
+a module are rebuilt when it (or a ``:depends:`` file) changes.
+
+The extension is parallel safe: with ``sphinx-build -j auto`` the pages,
+and so the modules on them, are converted in several processes at once.
+
+"""
+
+import os
+import json
+import hashlib
+
+from docutils import nodes
+from docutils.parsers.rst import Directive
+from docutils.parsers.rst import directives
+from docutils.statemachine import StringList
+
+from .mod2doctest import _Conversion
+from .mod2doctest import _run_interpreters
+from .mod2doctest import _save
+from .mod2doctest import _RE_SAVED_DOCSTR
+
+# What the directive changes in the defaults of convert().
+DEFAULT_OPTIONS = {'add_autogen': False}
+
+def _cache_key(src, depends, python_cmd, options):
+    """Returns the SHA-1 (hex) of everything the docstring of ``src``
+    depends on."""
+
+    sha1 = hashlib.sha1()
+    sha1.update(json.dumps([python_cmd, options],
+                           sort_keys=True).encode('utf-8'))
+    code = [os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+            for name in ('mod2doctest.py', '_startup.py')]
+    for path in [src] + list(depends) + code:
+        sha1.update(('\0%s\0' % os.path.basename(path)).encode('utf-8'))
+        sha1.update(open(path, 'rb').read())
+    return sha1.hexdigest()
+
+def docstring(src, python_cmd, options=None, depends=(), cache=None):
+    """Returns the docstring :func:`mod2doctest.convert` makes of ``src``
+    (without the quotes, and without saving or printing it), from the
+    ``cache`` directory if it was made before with the same inputs.
+
+    :param src: The path of the module.
+    :type src:  str
+
+    :param python_cmd: Like for :func:`mod2doctest.convert`.
+    :type python_cmd:  str or list of str
+
+    :param options: :func:`mod2doctest.convert` keyword arguments.
+    :type options:  None or dict
+
+    :param depends: The paths of other files the output depends on.
+    :type depends:  list of str
+
+    :param cache: A directory to keep the docstrings in.
+    :type cache:  None or str
+
+    """
+
+    options = dict(DEFAULT_OPTIONS, **(options or {}))
+    options['target'] = None
+    path = None
+    if cache:
+        key = _cache_key(src, depends, python_cmd, options)
+        path = os.path.join(cache, '%s.txt' % key)
+        if os.path.isfile(path):
+            return open(path, 'rb').read().decode('utf-8')
+
+    conversion = _Conversion(python_cmd, src=src, **options)
+    docstr = conversion.docstr(_run_interpreters(conversion.runs()))
+    docstr = _RE_SAVED_DOCSTR.match(docstr).group(1).strip('\n') + '\n'
+    if path:
+        _save(path, docstr.encode('utf-8'))
+    return docstr
+
+class Mod2DoctestDirective(Directive):
+    """``.. mod2doctest:: path/to/module.py``"""
+
+    required_arguments = 1
+    optional_arguments = 0
+    final_argument_whitespace = True
+    has_content = False
+    option_spec = {
+        'python': directives.unchanged_required,
+        'options': directives.unchanged_required,
+        'depends': directives.unchanged_required,
+        'literal': directives.flag,
+    }
+
+    def run(self):
+        env = self.state.document.settings.env
+        config = env.config
+
+        src = env.relfn2path(self.arguments[0])[1]
+        depends = [env.relfn2path(path)[1]
+                   for path in self.options.get('depends', '').split()]
+        options = dict(config.mod2doctest_options)
+        if 'options' in self.options:
+            try:
+                options.update(json.loads(self.options['options']))
+            except ValueError as e:
+                raise self.error('mod2doctest: bad :options: (%s)' % e)
+        python_cmd = self.options.get('python', config.mod2doctest_python)
+        cache = config.mod2doctest_cache or os.path.join(env.app.doctreedir,
+                                                         'mod2doctest')
+
+        for path in [src] + depends:
+            if not os.path.isfile(path):
+                raise self.error('mod2doctest: %s is not a file' % path)
+            env.note_dependency(path)
+
+        try:
+            docstr = docstring(src, python_cmd, options, depends, cache)
+        except (SystemError, SyntaxError, OSError) as e:
+            raise self.error('mod2doctest: cannot convert %s (%s)'
+                             % (src, e))
+
+        if 'literal' in self.options:
+            block = nodes.literal_block(docstr, docstr)
+            block['language'] = 'pycon'
+            return [block]
+
+        from sphinx.util.nodes import nested_parse_with_titles
+
+        node = nodes.section()
+        node.document = self.state.document
+        nested_parse_with_titles(self.state,
+                                 StringList(docstr.splitlines(), src), node)
+        return node.children
+
+def setup(app):
+    app.add_config_value('mod2doctest_python', 'python', 'env')
+    app.add_config_value('mod2doctest_options', {}, 'env')
+    app.add_config_value('mod2doctest_cache', None, '')
+    app.add_directive('mod2doctest', Mod2DoctestDirective)
+    return {'parallel_read_safe': True, 'parallel_write_safe': True}
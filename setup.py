@@ -14,6 +14,7 @@ setup(
     keywords = "doctest unit test",
     url = "http://packages.python.org/mod2doctest/",
     packages=['mod2doctest'],
+    entry_points={'pytest11': ['mod2doctest = mod2doctest.pytest_plugin']},
     long_description=read('README'),
     classifiers=[
         "Development Status :: 3 - Alpha",
@@ -1,30 +1,145 @@
+"""Converts the example modules and checks the docstrings against the
+saved ones (``<name>_doctest.py``)::
+
+    python __init__.py                        # all of them with python2.7
+    python __init__.py python2.7 untilexample
+
+The autogen banner and the ``__main__`` blocks are not compared, and the
+saved docstrings are taken as the doctest "want" (so their ellipses match
+anything and whitespace is normalized).  The examples are converted in a
+temporary ``tests`` directory that has a copy of the saved file, so the
+sections that are not run are kept from it.  ``matrixexample`` needs both
+python2.7 and python3.
+
+The new files of the ``VERIFIED`` examples are also checked with
+:func:`mod2doctest.verify` (in this interpreter), twice with a cache: the
+second time has to be a cache hit.
+
+"""
+
+from __future__ import print_function
+
 # PYTHON
+import os
 import re
+import sys
+import shutil
 import doctest
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
 # MOD2DOCTEST
 import mod2doctest
 
-main_re = re.compile(r'("""[\s.]*?""")[\s.]*')
+# (name, python_cmd or None for the one given, convert() arguments)
+EXAMPLES = [
+    ('basicexample', None, {}),
+    ('blanklines', None, {}),
+    ('fix_input_whitespace', None, {}),
+    ('leadingdocstring', None, {}),
+    ('sectionsexample', None, {'layout': 'sections', 'run_doctest': True}),
+    ('volatileexample', None, {'ellipse_volatile': 3}),
+    ('matrixexample', ['python2.7', 'python3'], {}),
+    ('untilexample', None, {'until': 2}),
+    ('freezeexample', None, {'freeze_time': 1000000000}),
+    ('cacheexample', None, {'layout': 'sections', 'run_doctest': True,
+                            'doctest_cache': '.mod2doctest-cache'}),
+]
+
+# (the others are Python 2 only)
+VERIFIED = set(['leadingdocstring', 'sectionsexample', 'volatileexample',
+                'matrixexample', 'untilexample', 'cacheexample'])
 
 delimit = 'Type "help", "copyright", "credits" or "license" for more information.'
-end = '\n\nif __name__ == \'__main__\':\n    import doctest\n    doctest.testmod(optionflags=268)'
+main_re = re.compile(r"\n+if __name__ == '__main__':.*", re.DOTALL)
+exit_re = re.compile(r'(\n>>> )?\n>>> raise SystemExit\n')
 
 def process_docstr(docstr):
-    docstr = docstr.split(delimit)[1].strip()
-    return docstr.replace(end, '')
-    
-def run_all():
-    for file in ['basicexample', 'blanklines', 'fix_input_whitespace']:
-        output = process_docstr(mod2doctest.convert(src='%s.py' % file, 
-                                                    target=None, 
-                                                    run_doctest=False, 
-                                                    ))
-        known_to_be_good_output = process_docstr(open('%s_doctest.py' % file).read())
-        print `output`
-        print `known_to_be_good_output`
-        assert(output == known_to_be_good_output)
-        
+    """Returns the part of a saved file that is compared."""
+    docstr = docstr.replace('\r\n', '\n').split(delimit, 1)[-1]
+    docstr = exit_re.sub('\n', main_re.sub('', docstr))
+    return docstr.replace('"""', "'''").strip()
 
-if __name__ == '__main__':
-    run_all()
+def run_example(name, python_cmd, options):
+    """Converts example ``name`` in the current directory and returns a
+    list of what went wrong."""
+    shutil.copy(os.path.join(HERE, '%s.py' % name), '.')
+    shutil.copy(os.path.join(HERE, '%s_doctest.py' % name), '.')
+    try:
+        mod2doctest.convert(python_cmd, src='%s.py' % name,
+                            target='_doctest', reporter='quiet', **options)
+    except SystemExit:
+        pass
+
+    output = process_docstr(open('%s_doctest.py' % name).read()) + '\n'
+    known_to_be_good_output = process_docstr(
+        open(os.path.join(HERE, '%s_doctest.py' % name)).read()) + '\n'
+    failures = []
+    checker = doctest.OutputChecker()
+    flags = doctest.ELLIPSIS | doctest.NORMALIZE_WHITESPACE
+    if not checker.check_output(known_to_be_good_output, output, flags):
+        example = doctest.Example('', known_to_be_good_output)
+        failures.append('%s_doctest.py differs:\n%s' % (
+            name, checker.output_difference(example, output, flags)))
+
+    cache = options.get('doctest_cache')
+    if cache and not [filename for filename in os.listdir(cache)
+                      if filename.endswith('.passed')]:
+        failures.append('no passing run of %s in %s' % (name, cache))
+
+    if name in VERIFIED:
+        failures.extend(verify_twice('%s_doctest.py' % name))
+    return failures
+
+def verify_twice(target):
+    """Verifies ``target`` with a cache twice and returns a list of what
+    went wrong (the second time nothing may be run)."""
+    cache = '.verify-cache'
+    results = mod2doctest.verify(target, cache=cache)
+    if results.failed:
+        return ['%s fails verify(): %d of %d examples' % ((target,) +
+                                                          tuple(results))]
 
+    def run(*args, **kwargs):
+        raise AssertionError('run')
+
+    original = doctest.DocTestRunner.run
+    doctest.DocTestRunner.run = run
+    try:
+        cached = mod2doctest.verify(target, cache=cache)
+    except AssertionError:
+        return ['%s: verify() ran it again, the cache was not hit' % target]
+    finally:
+        doctest.DocTestRunner.run = original
+    if cached != results:
+        return ['%s: verify() gave %r from the cache, not %r'
+                % (target, cached, results)]
+    return []
+
+def run_all(python_cmd='python2.7', names=None):
+    """Runs the ``EXAMPLES`` (or the ones in ``names``) and returns the
+    number of them that failed."""
+    cwd = os.getcwd()
+    directory = tempfile.mkdtemp(prefix='mod2doctest-tests-')
+    failed = 0
+    try:
+        os.mkdir(os.path.join(directory, 'tests'))
+        os.chdir(os.path.join(directory, 'tests'))
+        for name, cmd, options in EXAMPLES:
+            if names and name not in names:
+                continue
+            failures = run_example(name, cmd or python_cmd, options)
+            print('%s: %s' % (name, 'FAILED' if failures else 'OK'))
+            for failure in failures:
+                print(failure)
+            failed += bool(failures)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+    return failed
+
+if __name__ == '__main__':
+    python_cmd = sys.argv[1] if sys.argv[1:] else 'python2.7'
+    sys.exit(1 if run_all(python_cmd, sys.argv[2:]) else 0)
@@ -0,0 +1,86 @@
+"""Checks that :func:`mod2doctest.convert_async` kills the other
+interpreters of a conversion when one of them fails: a module that
+writes its pid and sleeps is converted with an interpreter that does not
+exist next to a real one, and the real one may not be left running
+(Python 3.5+)::
+
+    python3 aiocheck.py
+    python3 aiocheck.py --python python2.7    # the interpreter that runs
+
+Everything happens in a temporary directory.
+
+"""
+
+import os
+import sys
+import time
+import shutil
+import asyncio
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+from mod2doctest import convert_async
+
+SLEEP = 30
+WAIT = 2.0
+
+_MODULE = """\
+import os
+import time
+open(%r, 'w').write(str(os.getpid()))
+time.sleep(%d)
+"""
+
+def main(args):
+    python_cmd = 'python3'
+    if '--python' in args:
+        python_cmd = args[args.index('--python') + 1]
+
+    directory = tempfile.mkdtemp(prefix='mod2doctest-aio-')
+    failures = []
+    try:
+        src = os.path.join(directory, 'sleeper.py')
+        pidfile = os.path.join(directory, 'pid')
+        open(src, 'w').write(_MODULE % (pidfile, SLEEP))
+
+        async def convert():
+            start = time.time()
+            try:
+                await convert_async(
+                    [python_cmd, 'mod2doctest-no-such-python'], src=src,
+                    reporter='quiet')
+                failures.append('no error for the missing interpreter')
+            except OSError as e:
+                print('%s after %.2f s' % (type(e).__name__,
+                                           time.time() - start))
+            # (the loop keeps running, had the interpreter not been killed
+            # it would have its stdin and write its pid by now)
+            await asyncio.sleep(WAIT)
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(convert())
+        finally:
+            loop.close()
+        if os.path.isfile(pidfile):
+            pid = int(open(pidfile).read())
+            try:
+                os.kill(pid, 0)
+            except OSError:
+                pass
+            else:
+                os.kill(pid, 9)
+                failures.append('%s was left running' % python_cmd)
+    finally:
+        shutil.rmtree(directory)
+
+    for failure in failures:
+        print(failure)
+    print('OK' if not failures else 'FAILED')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
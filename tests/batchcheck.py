@@ -0,0 +1,105 @@
+"""Runs the example modules through a :mod:`mod2doctest.batch` queue with
+several local worker processes and checks that every job was done once,
+then that ``submit(..., resume=True)`` (``submit --resume``) only submits
+the job of a module that changed since::
+
+    python batchcheck.py                          # 3 workers
+    python batchcheck.py --workers 8 --python python2.7
+
+Everything happens in a temporary directory (copies of the examples, the
+queue and the ``_doctest`` files).
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, '..')
+sys.path.insert(0, ROOT)
+
+from mod2doctest import batch
+
+EXAMPLES = ['basicexample', 'blanklines', 'fix_input_whitespace', 'intro']
+
+def run_workers(queue, workers):
+    """Runs ``workers`` worker processes on ``queue`` until it is empty."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    popens = [subprocess.Popen([sys.executable, '-m', 'mod2doctest.batch',
+                                'work', queue, '--lease', '5'], env=env)
+              for i in range(workers)]
+    for popen in popens:
+        popen.wait()
+
+def runs_per_job(queue):
+    """Returns ``{job name: number of times it was done}`` from the
+    journals."""
+    runs = {}
+    for record in batch._journal_records(queue):
+        runs[record['job']] = runs.get(record['job'], 0) + 1
+    return runs
+
+def main(args):
+    python_cmd = 'python'
+    workers = 3
+    if '--python' in args:
+        python_cmd = args[args.index('--python') + 1]
+    if '--workers' in args:
+        workers = int(args[args.index('--workers') + 1])
+
+    directory = tempfile.mkdtemp(prefix='mod2doctest-batch-')
+    try:
+        srcs = []
+        for name in EXAMPLES:
+            src = os.path.join(directory, '%s.py' % name)
+            shutil.copy(os.path.join(HERE, '%s.py' % name), src)
+            srcs.append(src)
+        queue = os.path.join(directory, 'queue')
+        names = batch.submit(queue, srcs, python_cmd)
+        run_workers(queue, workers)
+
+        failures = []
+        if runs_per_job(queue) != dict((name, 1) for name in names):
+            failures.append('unexpected runs per job %r'
+                            % runs_per_job(queue))
+        counts = batch.status(queue)
+        if counts != {'pending': 0, 'claimed': 0, 'done': len(srcs),
+                      'failed': 0}:
+            failures.append('unexpected queue status %r' % counts)
+        for filename in os.listdir(os.path.join(queue, 'results')):
+            result = json.load(open(os.path.join(queue, 'results', filename)))
+            if not os.path.isfile(result['target'] or ''):
+                failures.append('no target for %s' % result['src'])
+
+        # Nothing changed, so nothing is done again ...
+        resumed = batch.submit(queue, srcs, python_cmd, resume=True)
+        if resumed:
+            failures.append('resume submitted %r again' % resumed)
+        # ... but a module that changed is.
+        open(srcs[0], 'a').write('\n# changed\n')
+        resumed = batch.submit(queue, srcs, python_cmd, resume=True)
+        if resumed != names[:1]:
+            failures.append('resume submitted %r, not %r'
+                            % (resumed, names[:1]))
+        run_workers(queue, workers)
+        expected = dict((name, 1) for name in names)
+        expected[names[0]] = 2
+        if runs_per_job(queue) != expected:
+            failures.append('unexpected runs per job after resuming %r'
+                            % runs_per_job(queue))
+    finally:
+        shutil.rmtree(directory)
+
+    for failure in failures:
+        print(failure)
+    print('OK' if not failures else 'FAILED')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
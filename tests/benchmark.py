@@ -0,0 +1,285 @@
+"""Micro-benchmarks for each stage of the mod2doctest pipeline.
+
+Every stage is timed on synthetic input of growing size (1 KB up to 100 MB
+by default) and on a few pathological inputs (deeply nested blocks, huge
+single-line output, thousands of tracebacks).  Run it with::
+
+    python benchmark.py                   # all stages, 1 KB .. 100 MB
+    python benchmark.py --max-size 1MB    # stop at 1 MB
+    python benchmark.py _input_parse      # only some stages
+
+The interpreter is never started, so only the pre- and post-processing is
+measured (see ``perfgate.py`` for end-to-end numbers).  If a stage is
+projected (from the sizes before) to take more than 10 seconds at a size,
+counting the time it takes to make the input, that size and the bigger
+ones are skipped.
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import math
+import gc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from mod2doctest import mod2doctest as m2d
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time
+
+SIZES = [2**10, 2**14, 2**17, 2**20, 2**23, 100 * 2**20]
+
+_MODULE_CHUNK = '''
+#>Section %(n)d
+#>==========================================================================
+#|Some documentation for section %(n)d ...
+import os
+
+class Foo%(n)d(object):
+
+    def __init__(self, i):
+
+        self.i = i
+    def __repr__(self):
+        return '<Foo%(n)d %%d>' %% self.i
+for i in range(3):
+    print(Foo%(n)d(i))
+    # comment in a block
+x%(n)d = [1,
+
+          2, """a
+multi-line string"""]
+@staticmethod
+def fn%(n)d():
+    pass
+try:
+    x%(n)d.append(3)
+except ValueError:
+    pass
+else:
+    print('ok ... >>>')
+if __name__ == '__main__':
+    print('never')
+'''
+
+_OUTPUT_CHUNK = '''>>> #>Section %(n)d
+... #>==========================================================================
+>>> #|Some documentation for section %(n)d ...
+>>> import os
+>>> class Foo%(n)d(object):
+...     def __repr__(self):
+...         return repr(self)
+...
+>>> print(Foo%(n)d())
+<__main__.Foo%(n)d object at 0x7f2b4c3d5e%(n)02x>
+>>> print(os)
+<module 'os' from '/usr/lib/python3.11/os.py'>
+>>> os.getcwd()
+'/home/user/projects/mod2doctest/tests'
+>>>
+>>>
+>>> 1/0
+Traceback (most recent call last):
+  File "<stdin>", line 1, in <module>
+ZeroDivisionError: division by zero
+>>> print('%(n)d')
+%(n)d
+'''
+
+def gen_module(size):
+    """Returns a module of about ``size`` bytes that exercises everything
+    the input preprocessor deals with."""
+    return _repeat(_MODULE_CHUNK, size)
+
+def gen_output(size):
+    """Returns ``(pinput, stdout)``: interpreter output of about ``size``
+    bytes and the input that goes with it."""
+    stdout = _repeat(_OUTPUT_CHUNK, size)
+    pinput = [line[4:] for line in stdout.split('\n')
+              if line.startswith('>>> ') or line.startswith('... ')]
+    return '\n'.join(pinput), stdout
+
+def gen_docstr(size):
+    """Returns docstr lines (as made by :func:`m2d._docstr_lines`) of about
+    ``size`` bytes."""
+    pinput, stdout = gen_output(size)
+    return m2d._docstr_lines(pinput, stdout, True, True)
+
+def gen_deep_nesting(size, depth=90):
+    """Blocks nested ``depth`` levels deep (the tokenizer allows 100)."""
+    chunk = []
+    for level in range(depth):
+        chunk.append('%sif True:' % ('    ' * level))
+        chunk.append('')
+    chunk.append('%sx = 1' % ('    ' * depth))
+    return _repeat('\n'.join(chunk) + '\n', size)
+
+def gen_huge_line(size):
+    """A single statement whose output is one ``size`` byte line."""
+    return 'print(x)', '>>> %s\n>>> ' % ('x' * size)
+
+def gen_tracebacks(size):
+    """Output with one short traceback per statement."""
+    chunk = ('>>> f()\nTraceback (most recent call last):\n'
+             '  File "<stdin>", line 1, in <module>\n'
+             '  File "/usr/lib/python3.11/site-packages/pkg/mod.py", line 10, '
+             'in f\n    raise ValueError(x)\nValueError: 0x7f2b4c3d5e10\n')
+    stdout = _repeat(chunk, size)
+    return '\n'.join(['f()'] * stdout.count('>>> ')), stdout
+
+def _repeat(chunk, size):
+    """Repeats ``chunk`` (numbering the copies) until there are at least
+    ``size`` bytes.  Whole copies are used so the result still parses."""
+    pieces = []
+    total = 0
+    n = 0
+    while total < size:
+        piece = chunk % {'n': n % 256} if '%(n)' in chunk else chunk
+        pieces.append(piece)
+        total += len(piece)
+        n += 1
+    return ''.join(pieces)
+
+# (name, function that makes the arguments for a size, function to time)
+STAGES = [
+    ('_input_parse',
+     lambda size: (gen_module(size),),
+     m2d._input_parse),
+    ('_input_render',
+     lambda size: (m2d._input_parse(gen_module(size)),),
+     m2d._input_render),
+    ('_match_input_to_output',
+     lambda size: gen_output(size),
+     lambda pinput, stdout: [line for inputlines in [iter(pinput.split('\n'))]
+                             for outputline in stdout.split('\n')
+                             for line in m2d._match_input_to_output(
+                                 inputlines, outputline)]),
+    ('_docstr_lines',
+     lambda size: gen_output(size) + (True, True),
+     m2d._docstr_lines),
+    ('_docstr_ellipse_mem_id',
+     lambda size: (gen_output(size)[1].split('\n'),),
+     lambda lines: [m2d._docstr_ellipse_mem_id(line) for line in lines]),
+    ('_docstr_ellipse_paths',
+     lambda size: (gen_output(size)[1].split('\n'),),
+     lambda lines: [m2d._docstr_ellipse_paths(line) for line in lines]),
+    ('_docstr_ellipse_traceback',
+     lambda size: (gen_docstr(size),),
+     m2d._docstr_ellipse_traceback),
+    ('_process_docstr_markers',
+     lambda size: (gen_docstr(size),),
+     m2d._process_docstr_markers),
+    ('_docstr_clean_blanklines',
+     lambda size: (gen_docstr(size),),
+     m2d._docstr_clean_blanklines),
+    ('_docstr_merge_runs',
+     lambda size: ([gen_docstr(size), gen_docstr(size)],),
+     m2d._docstr_merge_runs),
+]
+
+# (name, stage, function that makes the arguments for a size)
+PATHOLOGICAL = [
+    ('deep nesting', '_input_parse',
+     lambda size: (gen_deep_nesting(size),)),
+    ('huge line', '_docstr_lines',
+     lambda size: gen_huge_line(size) + (True, True)),
+    ('tracebacks', '_docstr_lines',
+     lambda size: gen_tracebacks(size) + (True, True)),
+    ('tracebacks', '_docstr_ellipse_traceback',
+     lambda size: (m2d._docstr_lines(*gen_tracebacks(size) + (True, True)),)),
+]
+
+def bench(fn, args, budget=0.2):
+    """Returns the best time of ``fn(*args)`` over as many runs as fit in
+    about ``budget`` seconds (at least one)."""
+    best = None
+    spent = 0.0
+    while spent < budget or best is None:
+        gc.collect()
+        start = clock()
+        fn(*args)
+        elapsed = clock() - start
+        spent += elapsed
+        best = elapsed if best is None else min(best, elapsed)
+        if elapsed > budget:
+            break
+    return best
+
+def project(timings, size):
+    """Returns the seconds a stage is expected to take at ``size``, from
+    its ``(size, seconds)`` ``timings`` so far (assuming it is at least
+    linear, or as much worse as the last two sizes were)."""
+    last_size, last_seconds = timings[-1]
+    exponent = 1.0
+    if len(timings) > 1:
+        before_size, before_seconds = timings[-2]
+        if before_seconds > 0 and last_seconds > 0:
+            exponent = max(exponent,
+                           math.log(last_seconds / before_seconds) /
+                           math.log(float(last_size) / before_size))
+    return last_seconds * (float(size) / last_size) ** exponent
+
+def run(sizes=SIZES, names=None, pathological=True, out=sys.stdout,
+        max_seconds=10.0):
+    """Runs the benchmarks and returns ``{(stage, case, size): seconds}``.
+    Sizes projected to take more than ``max_seconds`` are skipped."""
+
+    results = {}
+    functions = dict((name, fn) for name, make, fn in STAGES)
+    cases = [(name, 'synthetic', make) for name, make, fn in STAGES]
+    if pathological:
+        cases += [(stage, case, make) for case, stage, make in PATHOLOGICAL]
+
+    out.write('%-28s %-14s %10s %12s %10s\n' %
+              ('stage', 'input', 'size', 'seconds', 'MB/s'))
+    for name, case, make in cases:
+        if names and name not in names:
+            continue
+        timings = []
+        for size in sizes:
+            if timings and project(timings, size) > max_seconds:
+                out.write('%-28s %-14s %10s %12s\n' %
+                          (name, case, _format_size(size),
+                           'skipped (%.0f s)' % project(timings, size)))
+                break
+            began = clock()
+            args = make(size)
+            made = clock() - began
+            seconds = bench(functions[name], args)
+            timings.append((size, made + seconds))
+            results[(name, case, size)] = seconds
+            out.write('%-28s %-14s %10s %12.6f %10.1f\n' %
+                      (name, case, _format_size(size), seconds,
+                       size / 2.0**20 / max(seconds, 1e-9)))
+            out.flush()
+    return results
+
+def _format_size(size):
+    for unit, scale in (('MB', 2**20), ('KB', 2**10)):
+        if size >= scale:
+            return '%d%s' % (size // scale, unit)
+    return '%dB' % size
+
+def _parse_size(text):
+    text = text.upper()
+    for unit, scale in (('MB', 2**20), ('KB', 2**10), ('B', 1)):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * scale)
+    return int(text)
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    sizes = SIZES
+    if '--max-size' in args:
+        i = args.index('--max-size')
+        limit = _parse_size(args[i+1])
+        sizes = [size for size in SIZES if size <= limit]
+        del args[i:i+2]
+    run(sizes, names=args)
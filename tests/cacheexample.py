@@ -0,0 +1,22 @@
+#>The saved file is checked with :func:`mod2doctest.verify`, the parsed
+#>examples and the passing run are kept in ``doctest_cache``: the check is
+#>skipped until the saved file or a module it loaded changes.
+import json
+
+#>Setup [setup]
+#>=============
+record = {'name': 'spam', 'tags': ['eggs', 'ham']}
+
+#>Dump
+#>====
+print(json.dumps(record, sort_keys=True))
+
+#>Load
+#>====
+print(json.loads(json.dumps(record)) == record)
+
+if __name__ == '__main__':
+    import mod2doctest
+    mod2doctest.convert('python', src=True, target='_doctest',
+                        layout='sections', run_doctest=True,
+                        doctest_cache='.mod2doctest-cache')
@@ -0,0 +1,44 @@
+r'''
+================================================================================
+Auto generated by mod2doctest on Mon Oct 19 06:04:42 2026
+================================================================================
+Python 3.11.7 (main, Oct  2 2025, 21:14:28) [GCC 12.2.0] on linux
+Type "help", "copyright", "credits" or "license" for more information.
+
+The saved file is checked with :func:`mod2doctest.verify`, the parsed
+examples and the passing run are kept in ``doctest_cache``: the check is
+skipped until the saved file or a module it loaded changes.
+ 
+>>> import json
+
+Setup
+=============
+ 
+>>> record = {'name': 'spam', 'tags': ['eggs', 'ham']}
+
+'''
+
+__test__ = {
+    '2 Dump': r'''
+Dump
+====
+ 
+>>> print(json.dumps(record, sort_keys=True))
+{"name": "spam", "tags": ["eggs", "ham"]}
+
+''',
+    '3 Load': r'''
+Load
+====
+ 
+>>> print(json.loads(json.dumps(record)) == record)
+True
+
+''',
+}
+
+
+if __name__ == '__main__':
+    import mod2doctest
+    mod2doctest.verify(__file__, 524)
+
@@ -0,0 +1,82 @@
+"""Checks that the ``export`` records of :func:`mod2doctest.convert` are
+written while the interpreter runs: a module that prints a line and then
+sleeps is converted in a thread, and the record of the ``print`` has to
+be in the file before the conversion is done::
+
+    python exportcheck.py
+    python exportcheck.py --python python2.7  # the interpreter to convert with
+
+Everything happens in a temporary directory.
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+import mod2doctest
+
+SLEEP = 3.0
+
+_MODULE = """\
+import time
+print('before')
+time.sleep(%r)
+print('after')
+"""
+
+def main(args):
+    python_cmd = 'python'
+    if '--python' in args:
+        python_cmd = args[args.index('--python') + 1]
+
+    directory = tempfile.mkdtemp(prefix='mod2doctest-export-')
+    failures = []
+    try:
+        src = os.path.join(directory, 'sleeper.py')
+        export = os.path.join(directory, 'sleeper.ndjson')
+        open(src, 'w').write(_MODULE % SLEEP)
+
+        thread = threading.Thread(target=mod2doctest.convert,
+                                  args=(python_cmd,),
+                                  kwargs=dict(src=src, target=None,
+                                              export=export,
+                                              reporter='quiet'))
+        start = time.time()
+        thread.start()
+        sources = []
+        while thread.is_alive() and "print('before')" not in sources:
+            if os.path.isfile(export):
+                sources = [json.loads(line)['source']
+                           for line in open(export).read().splitlines()]
+            time.sleep(0.05)
+        seconds = time.time() - start
+        thread.join()
+
+        print('%s after %.2f s' % (sources, seconds))
+        if "print('before')" not in sources:
+            failures.append('no record of the print before the sleep '
+                            'while the interpreter ran')
+        records = [json.loads(line) for line in open(export)]
+        if [record['output'] for record in records] != ['', 'before', '',
+                                                        'after']:
+            failures.append('the records are not all there: %r' % records)
+    finally:
+        shutil.rmtree(directory)
+
+    for failure in failures:
+        print(failure)
+    print('OK' if not failures else 'FAILED')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
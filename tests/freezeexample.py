@@ -0,0 +1,32 @@
+#>The clock stands still at 2001-09-09 01:46:40 UTC (the year is the same
+#>in every time zone).  The datetime and date classes of the module are
+#>replaced to do it, but they still pass for the real ones.
+import time
+import pickle
+import datetime
+
+#>The Time
+#>========
+print(time.time())
+now = datetime.datetime.now()
+print(now.year)
+print(datetime.date.today().year)
+
+#>Types
+#>=====
+later = now + datetime.timedelta(days=1)
+print(isinstance(datetime.datetime(2020, 1, 1), datetime.date))
+print(isinstance(later, datetime.datetime))
+print(issubclass(datetime.datetime, datetime.date))
+
+#>Pickling
+#>========
+values = [now, later, now.date(), later.date()]
+for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+    assert pickle.loads(pickle.dumps(values, protocol)) == values
+print(pickle.loads(pickle.dumps(values)) == values)
+
+if __name__ == '__main__':
+    import mod2doctest
+    mod2doctest.convert('python', src=True, target='_doctest',
+                        freeze_time=1000000000)
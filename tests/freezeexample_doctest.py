@@ -0,0 +1,55 @@
+r'''
+================================================================================
+Auto generated by mod2doctest on Mon Oct 19 06:31:14 2026
+================================================================================
+Python 3.11.7 (main, Oct  2 2025, 21:14:28) [GCC 12.2.0] on linux
+Type "help", "copyright", "credits" or "license" for more information.
+
+The clock stands still at 2001-09-09 01:46:40 UTC (the year is the same
+in every time zone).  The datetime and date classes of the module are
+replaced to do it, but they still pass for the real ones.
+ 
+>>> import time
+>>> import pickle
+>>> import datetime
+
+The Time
+========
+ 
+>>> print(time.time())
+1000000000.0
+>>> now = datetime.datetime.now()
+>>> print(now.year)
+2001
+>>> print(datetime.date.today().year)
+2001
+
+Types
+=====
+ 
+>>> later = now + datetime.timedelta(days=1)
+>>> print(isinstance(datetime.datetime(2020, 1, 1), datetime.date))
+True
+>>> print(isinstance(later, datetime.datetime))
+True
+>>> print(issubclass(datetime.datetime, datetime.date))
+True
+
+Pickling
+========
+ 
+>>> values = [now, later, now.date(), later.date()]
+>>> for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+...     assert pickle.loads(pickle.dumps(values, protocol)) == values
+... 
+>>> print(pickle.loads(pickle.dumps(values)) == values)
+True
+>>> 
+>>> raise SystemExit
+
+'''
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod(optionflags=524)
+
@@ -0,0 +1,110 @@
+"""Cold-start budget for ``import mod2doctest``.
+
+The package is imported in a fresh interpreter with ``-X importtime``
+(Python 3.7+) a few times and the best cumulative import time is compared
+to a budget.  It also checks that none of the modules that are only needed
+later on (``doctest``, ``subprocess``, ``asyncio`` ...) got imported,
+leaving out the ones the interpreter loads anyway (e.g. from a ``.pth``
+file in ``site-packages``)::
+
+    python importtime.py                  # exit 1 if over budget
+    python importtime.py --budget 20      # budget in ms (default 25)
+    python importtime.py --python python3.8
+
+Compiled files go to a temporary ``PYTHONPYCACHEPREFIX`` so the numbers do
+not depend on ``PYTHONDONTWRITEBYTECODE`` (the first import is not timed).
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, '..')
+
+BUDGET_MS = 25.0
+RUNS = 5
+
+# Imported on first use only.
+LAZY = ['doctest', 'pdb', 'asyncio', 'subprocess', 'inspect', 'threading',
+        'ast', 'json', 'tempfile', 'shutil', 'random', 'hashlib', 'zlib',
+        'mod2doctest.aio']
+
+_SCRIPT = "import mod2doctest, sys; print(' '.join(sorted(sys.modules)))"
+_BARE_SCRIPT = "import sys; print(' '.join(sorted(sys.modules)))"
+
+def startup_modules(python_cmd, env):
+    """Returns the set of modules a new ``python_cmd`` has loaded before
+    it runs anything."""
+
+    process = subprocess.Popen([python_cmd, '-c', _BARE_SCRIPT], cwd=ROOT,
+                               env=env, stdout=subprocess.PIPE,
+                               universal_newlines=True)
+    stdout, stderr = process.communicate()
+    return set(stdout.split())
+
+def import_once(python_cmd, env):
+    """Imports mod2doctest in a new ``python_cmd`` and returns the
+    cumulative import time (in ms) and the set of modules loaded."""
+
+    process = subprocess.Popen([python_cmd, '-X', 'importtime', '-c',
+                                _SCRIPT],
+                               cwd=ROOT, env=env, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
+                               universal_newlines=True)
+    stdout, stderr = process.communicate()
+    if process.returncode:
+        raise SystemError("Cannot import mod2doctest:\n%s" % stderr)
+
+    cumulative = None
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == 'mod2doctest':
+            cumulative = int(fields[1]) / 1000.0
+    return cumulative, set(stdout.split())
+
+def main(args):
+    python_cmd = sys.executable
+    budget = BUDGET_MS
+    if '--python' in args:
+        python_cmd = args[args.index('--python') + 1]
+    if '--budget' in args:
+        budget = float(args[args.index('--budget') + 1])
+
+    cache = tempfile.mkdtemp(prefix='mod2doctest-pycache-')
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=cache, PYTHONPATH=ROOT)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    try:
+        import_once(python_cmd, env)
+        preloaded = startup_modules(python_cmd, env)
+        times = []
+        for i in range(RUNS):
+            ms, modules = import_once(python_cmd, env)
+            times.append(ms)
+    finally:
+        shutil.rmtree(cache)
+
+    best = min(times)
+    print('import mod2doctest: %.2f ms (best of %d, budget %.2f ms)'
+          % (best, RUNS, budget))
+
+    failures = []
+    if best > budget:
+        failures.append('over budget by %.2f ms' % (best - budget))
+    for name in LAZY:
+        if name in preloaded:
+            print('%s is loaded at interpreter start-up, not checked' % name)
+        elif name in modules:
+            failures.append('%s is imported by import mod2doctest' % name)
+    for failure in failures:
+        print(failure)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,15 @@
+
+
+r'''This docstring comes after blank lines.  It is replaced by the new
+docstring (or, with target=True, dropped from the code kept below it), it is
+not run as an example.
+'''
+
+#>The Code
+#>========
+greeting = 'hello'
+print(greeting)
+
+if __name__ == '__main__':
+    import mod2doctest
+    mod2doctest.convert('python', src=True, target='_doctest')
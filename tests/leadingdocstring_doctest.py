@@ -0,0 +1,22 @@
+r'''
+================================================================================
+Auto generated by mod2doctest on Mon Oct 19 05:50:07 2026
+================================================================================
+Python 3.11.7 (main, Oct  2 2025, 21:14:28) [GCC 12.2.0] on linux
+Type "help", "copyright", "credits" or "license" for more information.
+
+The Code
+========
+ 
+>>> greeting = 'hello'
+>>> print(greeting)
+hello
+>>> 
+>>> raise SystemExit
+
+'''
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod(optionflags=524)
+
@@ -0,0 +1,76 @@
+"""Time budget for a module that prints a very long line.
+
+A module printing one line of 20 KB without spaces (a path like string,
+with ids in it) is converted with ``max_line_width`` and without, and
+each conversion has to take less than the budget.  With
+``max_line_width=80`` the line has to be cut to 80 characters and a
+'...'::
+
+    python longlinecheck.py                   # exit 1 if over budget
+    python longlinecheck.py --budget 5        # budget in seconds (default 3)
+    python longlinecheck.py --python python2.7
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+import mod2doctest
+
+BUDGET = 3.0
+SIZE = 20000
+
+_MODULE = """\
+line = ''.join('/part%%d' %% i for i in range(%d))[:%d]
+print(line + '<object at 0x1234>')
+"""
+
+def main(args):
+    python_cmd = 'python'
+    budget = BUDGET
+    if '--python' in args:
+        python_cmd = args[args.index('--python') + 1]
+    if '--budget' in args:
+        budget = float(args[args.index('--budget') + 1])
+
+    directory = tempfile.mkdtemp(prefix='mod2doctest-longline-')
+    failures = []
+    try:
+        src = os.path.join(directory, 'longline.py')
+        open(src, 'w').write(_MODULE % (SIZE, SIZE))
+        for width in [80, None]:
+            start = time.time()
+            docstr = mod2doctest.convert(python_cmd, src=src, target=None,
+                                         max_line_width=width,
+                                         reporter='quiet')
+            seconds = time.time() - start
+            print('max_line_width=%s: %.2f s (budget %.2f s)'
+                  % (width, seconds, budget))
+            if seconds > budget:
+                failures.append('max_line_width=%s took %.2f s'
+                                % (width, seconds))
+            lines = [line for line in docstr.split('\n')
+                     if line.startswith('/part')]
+            if len(lines) != 1:
+                failures.append('max_line_width=%s: no /part line' % width)
+            elif width and len(lines[0]) > width + 3:
+                failures.append('max_line_width=%s: the line has %d '
+                                'characters' % (width, len(lines[0])))
+    finally:
+        shutil.rmtree(directory)
+
+    for failure in failures:
+        print(failure)
+    print('OK' if not failures else 'FAILED')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
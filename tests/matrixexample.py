@@ -0,0 +1,17 @@
+#>The module is run in two interpreters at once: output that differs
+#>between them is ellipsed.
+
+#>Same Everywhere
+#>===============
+print(7 // 2)
+print(7 / 2.0)
+
+#>Different Everywhere
+#>====================
+print('the type of a string is %r' % type(''))
+print('integers are %s' % (type(10**20).__name__))
+
+if __name__ == '__main__':
+    import mod2doctest
+    mod2doctest.convert(['python2.7', 'python3'], src=True,
+                        target='_doctest')
@@ -0,0 +1,35 @@
+r'''
+================================================================================
+Auto generated by mod2doctest on Mon Oct 19 06:21:05 2026
+================================================================================
+Python 2.7.18 (default, Oct  2 2025, 21:08:05) 
+[GCC 12.2.0] on linux2
+Type "help", "copyright", "credits" or "license" for more information.
+
+The module is run in two interpreters at once: output that differs
+between them is ellipsed.
+
+Same Everywhere
+===============
+ 
+>>> print(7 // 2)
+3
+>>> print(7 / 2.0)
+3.5
+
+Different Everywhere
+====================
+ 
+>>> print('the type of a string is %r' % type(''))
+the type of a string is <... 'str'>
+>>> print('integers are %s' % (type(10**20).__name__))
+integers are ...
+>>> 
+>>> raise SystemExit
+
+'''
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod(optionflags=524)
+
@@ -0,0 +1,185 @@
+"""End-to-end throughput check for :func:`mod2doctest.convert`.
+
+A fixed corpus is built from the example modules in this directory (each
+one repeated ``SCALES`` times over), every module is converted, and the
+throughput (modules/sec, bytes/sec) and peak RSS (of this process and of
+the interpreters) is compared against a stored JSON baseline::
+
+    python perfgate.py --update           # (re)write perf_baseline.json
+    python perfgate.py                    # exit 1 if a metric regressed
+    python perfgate.py --tolerance 0.1    # allow 10% instead of 20%
+    python perfgate.py --python python2.7 # interpreter for the examples
+    python perfgate.py --baseline ~/perf/mod2doctest.json
+
+The examples are Python 2, so they are run with python2.7 by default (as
+in ``__init__.py``).  If one of them does not run cleanly with the
+interpreter given (a ``SyntaxError`` in its docstr), the check fails
+(exit 1) and no baseline is written: it would measure the wrong thing.
+
+The baseline is ``perf_baseline.json`` in this directory unless
+``--baseline`` says otherwise (e.g. a path CI keeps between checkouts).
+Without a baseline the check fails (exit 2) until ``--update`` writes one.
+Baselines only mean something on the machine they were made on.
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import platform
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+from mod2doctest import mod2doctest as m2d
+
+# The examples that run quickly and always print the same thing.
+EXAMPLES = ['basicexample', 'blanklines', 'fix_input_whitespace', 'intro']
+SCALES = [1, 10, 50]
+
+BASELINE = os.path.join(HERE, 'perf_baseline.json')
+TOLERANCE = 0.2
+
+# metric name -> True if bigger is better
+METRICS = {
+    'modules_per_sec': True,
+    'bytes_per_sec': True,
+    'peak_rss_mb': False,
+    'child_peak_rss_mb': False,
+}
+
+def build_corpus(directory):
+    """Writes the corpus to ``directory`` and returns the file paths."""
+
+    paths = []
+    for name in EXAMPLES:
+        source = open(os.path.join(HERE, '%s.py' % name)).read()
+        # Stop at the exit so the copies after the first one are run too.
+        lines = source.split('\n')
+        for statement in m2d._input_parse(source):
+            if statement.kind == 'exit':
+                lines = lines[:statement.start-1]
+                break
+        body = '\n'.join(lines).rstrip() + '\n\n'
+        for scale in SCALES:
+            path = os.path.join(directory, '%s_x%d.py' % (name, scale))
+            open(path, 'w').write(body * scale)
+            paths.append(path)
+    return paths
+
+def measure(python_cmd, paths, repeat=3):
+    """Converts every module in ``paths`` (``repeat`` times, keeping the
+    fastest pass) and returns the metrics and the paths of the modules
+    that did not run cleanly."""
+
+    size = sum(os.path.getsize(path) for path in paths)
+    best = None
+    broken = []
+    devnull = open(os.devnull, 'w')
+    for i in range(repeat):
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = devnull
+        try:
+            start = time.time()
+            for path in paths:
+                docstr = m2d.convert(python_cmd, src=path, target=None)
+                if i == 0 and 'SyntaxError' in docstr:
+                    broken.append(path)
+            elapsed = time.time() - start
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+        best = elapsed if best is None else min(best, elapsed)
+    devnull.close()
+
+    metrics = {
+        'modules_per_sec': len(paths) / best,
+        'bytes_per_sec': size / best,
+    }
+    if resource:
+        # ru_maxrss is in KB on Linux and in bytes on Mac OS X.
+        scale = 2.0**20 if sys.platform == 'darwin' else 2.0**10
+        metrics['peak_rss_mb'] = (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale)
+        metrics['child_peak_rss_mb'] = (
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+    return metrics, broken
+
+def compare(metrics, baseline, tolerance=TOLERANCE):
+    """Returns a list of messages, one for every metric that is worse than
+    the baseline by more than ``tolerance`` (a fraction)."""
+
+    failures = []
+    for name, bigger_is_better in sorted(METRICS.items()):
+        if name not in metrics or name not in baseline:
+            continue
+        new, old = metrics[name], baseline[name]
+        if bigger_is_better:
+            regressed = new < old * (1 - tolerance)
+        else:
+            regressed = new > old * (1 + tolerance)
+        if regressed:
+            failures.append('%s regressed: %.2f (baseline %.2f)' %
+                            (name, new, old))
+    return failures
+
+def main(args):
+    import tempfile
+    import shutil
+
+    python_cmd = 'python2.7'
+    tolerance = TOLERANCE
+    baseline_path = BASELINE
+    if '--python' in args:
+        python_cmd = args[args.index('--python') + 1]
+    if '--tolerance' in args:
+        tolerance = float(args[args.index('--tolerance') + 1])
+    if '--baseline' in args:
+        baseline_path = os.path.expanduser(args[args.index('--baseline') + 1])
+    update = '--update' in args
+
+    if not update and not os.path.isfile(baseline_path):
+        print('No baseline at %s (run with --update to write one)'
+              % baseline_path)
+        return 2
+
+    directory = tempfile.mkdtemp(prefix='mod2doctest-perf-')
+    try:
+        metrics, broken = measure(python_cmd, build_corpus(directory))
+    finally:
+        shutil.rmtree(directory)
+
+    for name in sorted(metrics):
+        print('%-20s %14.2f' % (name, metrics[name]))
+
+    if broken:
+        for path in broken:
+            print('%s does not run cleanly with %s (SyntaxError)'
+                  % (os.path.basename(path), python_cmd))
+        return 1
+
+    if update:
+        baseline = dict(metrics, python=platform.python_version(),
+                        platform=platform.platform(), python_cmd=python_cmd)
+        directory = os.path.dirname(os.path.abspath(baseline_path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        open(baseline_path, 'w').write(json.dumps(baseline, indent=4,
+                                                  sort_keys=True) + '\n')
+        print('Baseline written to %s' % baseline_path)
+        return 0
+
+    failures = compare(metrics, json.load(open(baseline_path)), tolerance)
+    for failure in failures:
+        print(failure)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,81 @@
+"""Runs the pytest plugin (:mod:`mod2doctest.pytest_plugin`) on copies of
+some of the examples, next to a module whose ``mod2doctest.convert()`` call
+has an argument that is not a literal, and checks that only that module
+is reported as a collection error::
+
+    python plugincheck.py
+    python plugincheck.py --python python3.12     # the interpreter of pytest
+
+It needs pytest.  Everything happens in a temporary directory.
+
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import shutil
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, '..')
+
+EXAMPLES = ['leadingdocstring', 'sectionsexample', 'untilexample']
+
+_NOT_LITERAL = """\
+print('hello')
+
+if __name__ == '__main__':
+    import mod2doctest
+    mod2doctest.convert('python', src=__file__, target='_doctest')
+"""
+
+def main(args):
+    python = sys.executable
+    if '--python' in args:
+        python = args[args.index('--python') + 1]
+
+    directory = tempfile.mkdtemp(prefix='mod2doctest-plugin-')
+    failures = []
+    try:
+        for name in EXAMPLES:
+            for filename in ['%s.py' % name, '%s_doctest.py' % name]:
+                shutil.copy(os.path.join(HERE, filename), directory)
+        open(os.path.join(directory, 'notliteral.py'), 'w').write(
+            _NOT_LITERAL)
+
+        env = dict(os.environ, PYTHONPATH=os.path.abspath(ROOT))
+        popen = subprocess.Popen([python, '-m', 'pytest', '-p',
+                                  'mod2doctest.pytest_plugin',
+                                  '--mod2doctest', '-p', 'no:cacheprovider',
+                                  '--continue-on-collection-errors',
+                                  '-rE', '.'],
+                                 cwd=directory, env=env,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT)
+        output = popen.communicate()[0].decode('utf-8', 'replace')
+        summary = output.strip().split('\n')[-1]
+
+        passed = re.search(r'(\d+) passed', summary)
+        if not passed or 'failed' in summary:
+            failures.append('the examples did not all pass: %s' % summary)
+        if not re.search(r'\b1 error\b', summary):
+            failures.append('expected one collection error: %s' % summary)
+        if 'ERROR notliteral.py' not in output:
+            failures.append('notliteral.py is not the one in error')
+        if failures:
+            print(output)
+        else:
+            print(summary)
+    finally:
+        shutil.rmtree(directory)
+
+    for failure in failures:
+        print(failure)
+    print('OK' if not failures else 'FAILED')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,66 @@
+"""Converts ``sectionsexample`` with ``profile='section'`` and checks that
+the docstr is the one made without a profile, and that the profiles leave
+out what the interpreter does to exit (the ``atexit`` functions, e.g.
+readline's ``write_history``)::
+
+    python profilecheck.py                    # with python2.7
+    python profilecheck.py --python python3.13
+
+Everything happens in a temporary directory.
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+import mod2doctest
+
+NAME = 'sectionsexample'
+EXIT = ['_run_exitfuncs', 'write_history']
+
+def main(args):
+    python_cmd = 'python2.7'
+    if '--python' in args:
+        python_cmd = args[args.index('--python') + 1]
+
+    cwd = os.getcwd()
+    directory = tempfile.mkdtemp(prefix='mod2doctest-profile-')
+    failures = []
+    try:
+        os.chdir(directory)
+        shutil.copy(os.path.join(HERE, '%s.py' % NAME), '.')
+        docstrs = [mod2doctest.convert(python_cmd, src='%s.py' % NAME,
+                                       target=None, reporter='quiet',
+                                       profile=profile).split('=' * 80)[-1]
+                   for profile in [None, 'section']]
+        if docstrs[0] != docstrs[1]:
+            failures.append('the docstr is not the same with a profile')
+
+        folded = sorted(name for name in os.listdir('.')
+                        if name.endswith('.folded'))
+        print('%d profiles' % len(folded))
+        if not folded:
+            failures.append('no profiles')
+        for name in folded:
+            stacks = open(name).read()
+            for function in EXIT:
+                if function in stacks:
+                    failures.append('%s has %s' % (name, function))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+    for failure in failures:
+        print(failure)
+    print('OK' if not failures else 'FAILED')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,32 @@
+#>Saved with ``layout='sections'``: the code before the first section and
+#>the ``[setup]`` sections are the fixture, every other section is an entry
+#>of ``__test__`` (the ``[isolated]`` ones only need the fixture).
+import os
+import pickle
+
+#>Setup [setup]
+#>=============
+data = [1, 2, 3]
+print(data)
+
+#>Add To The List
+#>===============
+data.append(4)
+print(data)
+
+#>Sum Of The List
+#>===============
+print(sum(data))
+
+#>Pickle The List [isolated]
+#>==========================
+print(pickle.loads(pickle.dumps(data)))
+
+#>Path Of The List [isolated]
+#>===========================
+print(os.path.join('tests', 'data') + str(len(data)))
+
+if __name__ == '__main__':
+    import mod2doctest
+    mod2doctest.convert('python', src=True, target='_doctest',
+                        layout='sections', run_doctest=True)
@@ -0,0 +1,64 @@
+r'''
+================================================================================
+Auto generated by mod2doctest on Mon Oct 19 05:35:22 2026
+================================================================================
+Python 3.11.7 (main, Oct  2 2025, 21:14:28) [GCC 12.2.0] on linux
+Type "help", "copyright", "credits" or "license" for more information.
+
+Saved with ``layout='sections'``: the code before the first section and
+the ``[setup]`` sections are the fixture, every other section is an entry
+of ``__test__`` (the ``[isolated]`` ones only need the fixture).
+ 
+>>> import os
+>>> import pickle
+
+Setup
+=============
+ 
+>>> data = [1, 2, 3]
+>>> print(data)
+[1, 2, 3]
+
+'''
+
+__test__ = {
+    '2 Add To The List': r'''
+Add To The List
+===============
+ 
+>>> data.append(4)
+>>> print(data)
+[1, 2, 3, 4]
+
+''',
+    '3 Sum Of The List': r'''
+Sum Of The List
+===============
+ 
+>>> print(sum(data))
+10
+
+''',
+    '4 Pickle The List [isolated]': r'''
+Pickle The List
+==========================
+ 
+>>> print(pickle.loads(pickle.dumps(data)))
+[1, 2, 3]
+
+''',
+    '5 Path Of The List [isolated]': r'''
+Path Of The List
+===========================
+ 
+>>> print(os.path.join('tests', 'data') + str(len(data)))
+tests/data3
+
+''',
+}
+
+
+if __name__ == '__main__':
+    import mod2doctest
+    mod2doctest.verify(__file__, 524)
+
@@ -0,0 +1,19 @@
+#>Only the sections up to the second one are run, the ones after it are
+#>kept from the saved file as they are (handy when they take long).
+import math
+
+#>First
+#>=====
+print(math.sqrt(16))
+
+#>Second
+#>======
+print(math.factorial(5))
+
+#>Third (Slow)
+#>============
+print(sum(i * i for i in range(10**6)))
+
+if __name__ == '__main__':
+    import mod2doctest
+    mod2doctest.convert('python', src=True, target='_doctest', until=2)
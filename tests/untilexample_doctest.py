@@ -0,0 +1,38 @@
+r'''
+================================================================================
+Auto generated by mod2doctest on Mon Oct 19 06:04:41 2026
+================================================================================
+Python 3.11.7 (main, Oct  2 2025, 21:14:28) [GCC 12.2.0] on linux
+Type "help", "copyright", "credits" or "license" for more information.
+
+Only the sections up to the second one are run, the ones after it are
+kept from the saved file as they are (handy when they take long).
+ 
+>>> import math
+
+First
+=====
+ 
+>>> print(math.sqrt(16))
+4.0
+
+Second
+======
+ 
+>>> print(math.factorial(5))
+120
+
+Third (Slow)
+============
+ 
+>>> print(sum(i * i for i in range(10**6)))
+333332833333500000
+>>> 
+>>> raise SystemExit
+
+'''
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod(optionflags=524)
+
@@ -0,0 +1,17 @@
+#>Output that changes from run to run is ellipsed: the module is run three
+#>times, each time with another ``PYTHONHASHSEED``.
+import random
+
+#>Random Values
+#>=============
+print('a random number: %s' % random.random())
+print('always the same: %s' % sorted(set(['spam', 'eggs', 'ham'])))
+
+#>Hash Values
+#>===========
+print('the hash of spam: %d' % abs(hash('spam')))
+
+if __name__ == '__main__':
+    import mod2doctest
+    mod2doctest.convert('python', src=True, target='_doctest',
+                        ellipse_volatile=3)
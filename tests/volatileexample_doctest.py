@@ -0,0 +1,34 @@
+r'''
+================================================================================
+Auto generated by mod2doctest on Mon Oct 19 06:21:53 2026
+================================================================================
+Python 3.11.7 (main, Oct  2 2025, 21:14:28) [GCC 12.2.0] on linux
+Type "help", "copyright", "credits" or "license" for more information.
+
+Output that changes from run to run is ellipsed: the module is run three
+times, each time with another ``PYTHONHASHSEED``.
+ 
+>>> import random
+
+Random Values
+=============
+ 
+>>> print('a random number: %s' % random.random())
+a random number: 0...
+>>> print('always the same: %s' % sorted(set(['spam', 'eggs', 'ham'])))
+always the same: ['eggs', 'ham', 'spam']
+
+Hash Values
+===========
+ 
+>>> print('the hash of spam: %d' % abs(hash('spam')))
+the hash of spam: ...
+>>> 
+>>> raise SystemExit
+
+'''
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod(optionflags=524)
+